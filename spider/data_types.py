@@ -14,13 +14,113 @@
 
 """Object Relational Mapping for Child, Sibling, and Contact objects."""
 
+from base64 import b64decode, b64encode
+from collections import OrderedDict
 from datetime import date, datetime
+import hashlib
+import tempfile
 
 from twisted.logger import Logger
 
 
 log = Logger()
 
+# Every record created during a run shares these timestamps
+RUN_STARTED = datetime.now()
+RUN_DATE = date.today().isoformat()
+
+# Spooled attachment bodies are read back in chunks of this many bytes. A
+# multiple of 3 keeps every encoded chunk free of base64 padding, so the
+# chunks can be sent one after another as a single base64 string.
+BODY_CHUNK_SIZE = 3 * 64 * 1024
+
+
+def parse_hashes(description):
+    """
+    Read the hashes an Attachment's Description holds.
+
+    @type description: String
+    @param description: e.g. "sha1:3f78... ahash:ffc3...", None or any other
+    text for attachments uploaded before hashes were recorded
+
+    @rtype: dict
+    @return: Hex digest by kind of hash, e.g. {"sha1": "3f78..."}
+    """
+    hashes = {}
+    for token in (description or "").split():
+        kind, _, digest = token.partition(":")
+        if kind and digest:
+            hashes[kind] = digest
+
+    return hashes
+
+
+def hash_distance(a, b):
+    """Number of bits two hex digests of perceptual hashes differ by."""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class _ProfileIndex(object):
+    """
+    Insertion ordered collection of profiles.
+
+    Profiles are indexed by both case number and profile URL, so adding,
+    looking up and membership tests take constant time. Profiles with
+    neither are only ever equal to themselves.
+    """
+
+    def __init__(self, link_field):
+        # Field holding the profile URL
+        self.link_field = link_field
+        # Primary key -> profile
+        self._profiles = OrderedDict()
+        # Case number or profile URL -> primary key
+        self._keys = {}
+
+    def _lookup_keys(self, profile):
+        """Return the case number and profile URL that are set."""
+        return [
+            key for key in (
+                profile.get_field("Case_Number__c"),
+                profile.get_field(self.link_field),
+            ) if key
+        ]
+
+    def add(self, profile):
+        """
+        Add a profile unless one with the same case number or URL exists.
+
+        @rtype: Bool
+        @return: Whether or not the profile was added
+        """
+        keys = self._lookup_keys(profile)
+        primary = keys[0] if keys else id(profile)
+        if primary in self._profiles or any(k in self._keys for k in keys):
+            return False
+
+        self._profiles[primary] = profile
+        for key in keys:
+            self._keys[key] = primary
+
+        return True
+
+    def get(self, key):
+        """Return the profile with a case number or URL of key, or None."""
+        primary = self._keys.get(key)
+        return None if primary is None else self._profiles[primary]
+
+    def __contains__(self, profile):
+        keys = self._lookup_keys(profile)
+        if not keys:
+            return id(profile) in self._profiles
+        return any(key in self._keys for key in keys)
+
+    def __iter__(self):
+        return self._profiles.itervalues()
+
+    def __len__(self):
+        return len(self._profiles)
+
 
 class AllChildren(object):
     """
@@ -28,11 +128,16 @@ class AllChildren(object):
 
     Non-database object containing the returned results of a search
     for both children and sibling groups.
+
+    Children and sibling groups are indexed by case number and profile URL,
+    so a Child or SiblingGroup already present is not added a second time.
     """
 
-    def __init__(self, children=[], siblings=[]):
+    def __init__(self, children=None, siblings=None):
         """Let's do some type checking upfront to make life a bit easier."""
         log.debug("Creating new AllChildren instance")
+        children = [] if children is None else children
+        siblings = [] if siblings is None else siblings
         if not ((type(children) == list) and (type(siblings) == list)):
             raise TypeError("children and siblings must be a list")
 
@@ -45,18 +150,27 @@ class AllChildren(object):
                 raise TypeError("%s is not a SiblingGroup object." % item)
 
         # If types are all good, create an AllChildren object
-        self.children = children
-        self.siblings = siblings
+        self._children = _ProfileIndex("Link_to_Child_s_Page__c")
+        self._siblings = _ProfileIndex("Children_s_Webpage__c")
+        for child in children:
+            self._children.add(child)
+        for group in siblings:
+            self._siblings.add(group)
 
     def __repr__(self):
-        lc = len(self.get_children())
-        ls = len(self.get_siblings())
+        lc = len(self._children)
+        ls = len(self._siblings)
         return "AllChildren: %s children, %s sibling groups" % (lc, ls)
 
+    def __len__(self):
+        return len(self._children) + len(self._siblings)
+
     def merge(self, second):
         """
         Merge this with s second AllChildren object.
 
+        Children and sibling groups already in this object are skipped.
+
         @type second: AllChildren
         @param second: A second AllChildren to merge with this one.
         """
@@ -70,23 +184,16 @@ class AllChildren(object):
             log.debug("Merge: 2nd type checks out, begin")
 
         log.debug("Merging children into AllChildren")
-        log.debug("Second.children: %s" % second.get_children())
-        for child in second.get_children():
-            if child not in self.children:
+        for child in second.iter_children():
+            if self._children.add(child):
                 log.debug("Adding Child: %s" % child)
-                self.children.append(child)
 
         log.debug("Merging SiblingGroups into AllChildren")
-        log.debug("Second.siblings: %s" % second.get_siblings())
-        for group in second.get_siblings():
-            if group not in self.siblings:
+        for group in second.iter_siblings():
+            if self._siblings.add(group):
                 log.debug("Adding Group: %s" % group)
-                self.siblings.append(group)
 
-        log.debug(
-            "Merge: Finished.\nMerge: %s\nMerge: %s" %
-            (self.children, self.siblings)
-        )
+        log.debug("Merge: Finished. %s" % self)
 
     def add_child(self, child):
         """
@@ -94,6 +201,9 @@ class AllChildren(object):
 
         @type child: Child
         @param child: Child object to be added.
+
+        @rtype: Bool
+        @return: False if the child was already present
         """
         log.debug("Adding Child.Name: %s" % child.get_field("Name"))
 
@@ -102,11 +212,27 @@ class AllChildren(object):
                 "Only child objects can be added to the list of children."
             )
 
-        self.children.append(child)
+        return self._children.add(child)
+
+    def get_child(self, key):
+        """
+        Look up a child.
+
+        @type key: String
+        @param key: Case number or profile URL of the child
+
+        @rtype: Child
+        @return: The child or None if it isn't present
+        """
+        return self._children.get(key)
 
     def get_children(self):
         """Return a deep copy of the list of children."""
-        return list(self.children)
+        return list(self._children)
+
+    def iter_children(self):
+        """Iterate over the children without copying them."""
+        return iter(self._children)
 
     def add_sibling_group(self, group):
         """
@@ -114,6 +240,9 @@ class AllChildren(object):
 
         @type group: SiblingGroup
         @param group: SiblingGroup object to be added.
+
+        @rtype: Bool
+        @return: False if the sibling group was already present
         """
 
         if type(group) != SiblingGroup:
@@ -121,64 +250,149 @@ class AllChildren(object):
                 "Only child objects can be added to the list of children."
             )
 
-        self.siblings.append(group)
+        return self._siblings.add(group)
+
+    def get_sibling_group(self, key):
+        """
+        Look up a sibling group.
+
+        @type key: String
+        @param key: Case number or profile URL of the sibling group
+
+        @rtype: SiblingGroup
+        @return: The sibling group or None if it isn't present
+        """
+        return self._siblings.get(key)
 
     def get_siblings(self):
         """Return a deep copy of the list of sibling groups."""
-        return list(self.siblings)
+        return list(self._siblings)
+
+    def iter_siblings(self):
+        """Iterate over the sibling groups without copying them."""
+        return iter(self._siblings)
 
     def is_empty(self):
         """Checks whether self contains any Child or SiblingGroup objects."""
-        count = len(self.get_children()) + len(self.get_siblings())
+        count = len(self)
         log.debug("is_empty count: %s" % count)
-        log.debug(
-            "\nChildren: %s\nSiblingGroups: %s" % (
-                self.get_children(), self.get_siblings()
-            )
-        )
 
-        if not count:
-            return True
-        else:
-            return False
+        return not count
+
+
+class _Schema(object):
+    """
+    Field layout shared by every object of a _DBObject type.
+
+    Built once per run by _DBObject.schema(). Constant fields live here only,
+    variable fields are stored by each object in a list ordered by names.
+    """
+
+    __slots__ = ("constants", "names", "positions", "defaults", "mutable")
+
+    def __init__(self, constants, variables):
+        self.constants = constants
+        self.names = tuple(variables.keys())
+        self.positions = dict((n, i) for i, n in enumerate(self.names))
+        self.defaults = tuple(variables[n] for n in self.names)
+        # Defaults that are lists need a fresh copy for every object
+        self.mutable = tuple(
+            i for i, v in enumerate(self.defaults) if type(v) is list
+        )
 
 
 class _DBObject(object):
-    """Database object."""
+    """
+    Database object.
+
+    Subclasses describe their fields with fields(), which is turned into a
+    _Schema the first time the type is instantiated. Objects then only hold
+    their variable field values, plus any fields outside of the schema that
+    get added along the way (Id, BodyLength, ...).
 
-    def __init__(self, name, constants, variables):
-        self.table_name = name
-        self._constant_fields = constants
-        self._variable_fields = variables
-        # A list of Attachment type objects
-        self._attachments = []
+    Two objects are equal when they represent the same record, that is they
+    share the first of identity_fields that is set. Objects with none of
+    them set are only equal to themselves.
+    """
+
+    __slots__ = ("_values", "_extra", "_attachments")
+
+    # Table name constant
+    table_name = None
+
+    # Fields identifying a record, in order of preference
+    identity_fields = ()
+
+    @staticmethod
+    def fields():
+        """
+        Describe the fields of this type of object.
+
+        @rtype: tuple(dict, dict)
+        @return: constant fields and variable fields with their defaults
+        """
+        return {}, {}
+
+    @classmethod
+    def schema(cls):
+        """Return the _Schema of this type, building it on first use."""
+        # Looked up on the class itself so subclasses never share a schema
+        schema = cls.__dict__.get("_schema")
+        if schema is None:
+            schema = _Schema(*cls.fields())
+            setattr(cls, "_schema", schema)
+
+        return schema
+
+    def __init__(self):
+        schema = self.schema()
+        self._values = list(schema.defaults)
+        for i in schema.mutable:
+            self._values[i] = list(self._values[i])
+        # Fields outside of the schema, created when first needed
+        self._extra = None
+        # A list of Attachment type objects, created when first needed
+        self._attachments = None
 
     def get_attachments(self):
         """
         @rtype: list(Attachment)
         @return: A clone of the list of Attachment type objects.
         """
-        return list(self._attachments)
+        return list(self._attachments or ())
 
     def get_variable_fields(self):
         """
         @rtype: list(String)
         @return: A list of keys that can be updated
         """
-        return list(self._variable_fields.keys())
+        keys = list(self.schema().names)
+        if self._extra:
+            keys.extend(self._extra.keys())
+
+        return keys
 
     def update_field(self, key, value):
         """
         Update a single field.
 
         @type key: String
-        @param key: Key of the _variable_fields
+        @param key: Key of a variable field
 
         @type value: object
         @param value: Data assigned to a field
         """
-        if key not in self._constant_fields:
-            self._variable_fields[key] = value
+        schema = self.schema()
+        if key in schema.constants:
+            return
+
+        pos = schema.positions.get(key)
+        if pos is not None:
+            self._values[pos] = value
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
 
     def update_fields(self, d):
         """
@@ -195,27 +409,50 @@ class _DBObject(object):
         Retrieve a single field.
 
         @type key: String
-        @param key: Key of the _variable_fields
+        @param key: Key of a constant or variable field
 
         @type value: object
         @param value: Data assigned to a field
         """
-        return self._constant_fields.get(key) or self._variable_fields.get(key)
+        schema = self.schema()
+        value = schema.constants.get(key)
+        if value:
+            return value
+
+        pos = schema.positions.get(key)
+        if pos is not None:
+            return self._values[pos]
+
+        return self._extra.get(key) if self._extra else None
+
+    def iter_fields(self):
+        """
+        Iterate over constant and variable fields as (key, value) pairs.
+
+        Nothing is copied, so this is the cheapest way to serialize an
+        object.
+        """
+        schema = self.schema()
+        for item in schema.constants.iteritems():
+            yield item
+        for item in zip(schema.names, self._values):
+            yield item
+        if self._extra:
+            for item in self._extra.iteritems():
+                yield item
 
     def as_dict(self):
         """
         Return both constant and variable fields together in one dict.
 
         Siblings of this parent object may want to override this to include
-        type checks on fields.
+        type checks on fields. The dict is new on every call, changing it
+        does not change the object.
 
         @rtrype: dict
         @returns: a complete Child object as a dict.
         """
-        data = self._constant_fields
-        data.update(self._variable_fields)
-
-        return data
+        return dict(self.iter_fields())
 
     def add_attachment(self, attachment):
         """
@@ -234,8 +471,42 @@ class _DBObject(object):
                 "added to the list of Attachments."
             )
 
+        if self._attachments is None:
+            self._attachments = []
         self._attachments.append(attachment)
 
+    def identity(self):
+        """
+        Return a key for the record this object represents.
+
+        @rtype: tuple
+        @return: (table name, value of the first identity field set), or None
+        if none of them are set
+        """
+        for field in self.identity_fields:
+            value = self.get_field(field)
+            if value:
+                return (self.table_name, value)
+
+        return None
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, _DBObject):
+            return NotImplemented
+
+        key = self.identity()
+        return key is not None and key == other.identity()
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        key = self.identity()
+        return id(self) if key is None else hash(key)
+
     def __repr__(self):
         return "%s: %s" % (type(self), self.get_field('Name'))
 
@@ -243,11 +514,16 @@ class _DBObject(object):
 class Child(_DBObject):
     """Child object."""
 
-    def __init__(self):
-        """Init."""
-        # Table name constant
-        name = "Children__c"
+    __slots__ = ()
 
+    # Table name constant
+    table_name = "Children__c"
+
+    identity_fields = ("Case_Number__c", "Link_to_Child_s_Page__c")
+
+    @staticmethod
+    def fields():
+        """Constant and variable fields of a Child."""
         # Constants
         constants = {
             # Recruitment Status
@@ -257,28 +533,24 @@ class Child(_DBObject):
             # Recruitment update
             "Recruitment_Update__c": (
                 "%s - Copied in by web spider from TARE" %
-                datetime.now().strftime("%m/%d/%Y %H:%M")
+                RUN_STARTED.strftime("%m/%d/%Y %H:%M")
             ),
             # Web Bio Approval - NULL
             "Web_Approval__c": False,
             # Child is Listed On Public Website - True
             "Adoption_Recruitment__c": True,
             # Public Web Adoption Recruitment Date
-            "Web_Adoption_Recruitment_Date__c": (
-                "%s" % date.today().isoformat()
-            ),
+            "Web_Adoption_Recruitment_Date__c": RUN_DATE,
             # Data Base Listing-Private
-            "Northwest_HG_Private_Listing_Date__c": (
-                "%s" % date.today().isoformat()
-            ),
+            "Northwest_HG_Private_Listing_Date__c": RUN_DATE,
             # Data Base Listing-Private
             "Northwest_HG__c": True,
             # AFFEC Web Site
             "Web__c": True,
             # AFFEC Web (Posted To)
-            "Web_Date__c": "%s" % date.today().isoformat(),
+            "Web_Date__c": RUN_DATE,
             # Action Needed Date
-            "Action_Needed_Date__c": "%s" % date.today().isoformat(),
+            "Action_Needed_Date__c": RUN_DATE,
             "How_Child_Came_to_us__c": "TARE",
         }
 
@@ -287,7 +559,7 @@ class Child(_DBObject):
             # Child's First Name
             "Name": "",
             # Child Bulletin Date
-            "Child_Bulletin_Date__c": "%s" % date.today().isoformat(),
+            "Child_Bulletin_Date__c": RUN_DATE,
             # Child's State
             "Child_s_State__c": "Texas TX",
             # Legal Status - If Possible
@@ -314,7 +586,7 @@ class Child(_DBObject):
             "Child_s_Birthdate__c": None,
         }
 
-        super(Child, self).__init__(name, constants, variables)
+        return constants, variables
 
     def __repr__(self):
         return "%s: %s - %s" % (
@@ -327,30 +599,36 @@ class Child(_DBObject):
 class SiblingGroup(_DBObject):
     """SiblingGroup object."""
 
+    __slots__ = ("children",)
+
+    # Table name constant
+    table_name = "Sibling_Group__c"
+
+    identity_fields = ("Case_Number__c", "Children_s_Webpage__c")
+
     def __init__(self):
         """Init."""
+        super(SiblingGroup, self).__init__()
         # List of Child objects in the SiblingGroup
         self.children = []
 
-        # Table name constant
-        name = "Sibling_Group__c"
-
+    @staticmethod
+    def fields():
+        """Constant and variable fields of a SiblingGroup."""
         # Constants
         constants = {
             # Same as only child
             "Recruitment_Status__c": 'Pre-Recruitment',
             # Data Base Listing - Private (date)
-            "Northwest_HG_Private_Listing_Date__c": (
-                "%s" % date.today().isoformat()
-            ),
+            "Northwest_HG_Private_Listing_Date__c": RUN_DATE,
             # Data Base Listing - Private (checkmark)
             "Northwest_HG__c": True,
             # Last update
-            "Date_of_Last_Update__c": '%s' % date.today().isoformat(),
+            "Date_of_Last_Update__c": RUN_DATE,
             # Recruitment Update
             "Recruitment_Update__c": (
                 "%s - Copied in by web spider from TARE" %
-                datetime.now().strftime("%m/%d/%Y %H:%M")
+                RUN_STARTED.strftime("%m/%d/%Y %H:%M")
             ),
         }
 
@@ -386,7 +664,7 @@ class SiblingGroup(_DBObject):
             'District__c': None,
         }
 
-        super(SiblingGroup, self).__init__(name, constants, variables)
+        return constants, variables
 
     def add_child(self, child):
         if type(child) == Child:
@@ -411,21 +689,24 @@ class SiblingGroup(_DBObject):
 class Contact(_DBObject):
     """Database object."""
 
-    def __init__(self):
+    __slots__ = ()
+
+    table_name = "Contact__c"
+
+    @staticmethod
+    def fields():
         """
-        Init.
+        Constant and variable fields of a Contact.
 
         FIXME:
         Much of the following data is hardcoded for TARE. Eventually this Needs
         to be added to the config or stripped out in some way to make room
         for any site to import data.
         """
-        name = "Contact__c"
-
         constants = {
             "Business_Name__c": "Techildrenas DFPS",
             "Last_Action__c":
-                "%s entered by TARE spider." % datetime.now().isoformat(' ')
+                "%s entered by TARE spider." % RUN_STARTED.isoformat(' ')
         }
 
         variables = {
@@ -443,17 +724,17 @@ class Contact(_DBObject):
             'MailingPostalCode': '',
         }
 
-        super(Contact, self).__init__(name, constants, variables)
+        return constants, variables
 
     def name(self):
         return "%s %s" % (
-            self._variable_fields['FirstName'],
-            self._variable_fields['LastName']
+            self.get_field('FirstName'),
+            self.get_field('LastName')
         )
 
     def __repr__(self):
         ret_list = []
-        for k, v in self.as_dict().iteritems():
+        for k, v in self.iter_fields():
             ret_list.append("%s: %s" % (k, v))
 
         ret_str = "Contact: %s" % ", ".join(ret_list)
@@ -462,12 +743,37 @@ class Contact(_DBObject):
 
 
 class Attachment(_DBObject):
-    """Attachment object."""
+    """
+    Attachment object.
+
+    The body of an attachment is not kept in memory. It is spooled, decoded,
+    to a temporary file when set and base64 encoded again only while it is
+    being read back, typically chunk by chunk during an upload. For the same
+    reason as_dict() leaves the Body out.
+
+    An attachment can also start out lazy, knowing only where its body comes
+    from. The body is then only fetched by load_body, once a DB plugin has
+    found the attachment to be new.
+    """
+
+    __slots__ = ("is_profile", "source_url", "_body_file", "_loader")
+
+    table_name = "Attachment__c"
 
     def __init__(self):
         """Init."""
-        name = "Attachment__c"
+        super(Attachment, self).__init__()
 
+        self.is_profile = False
+        # Where a lazy body comes from, see set_loader
+        self.source_url = None
+        # Temporary file holding the decoded body, see spool_body
+        self._body_file = None
+        self._loader = None
+
+    @staticmethod
+    def fields():
+        """Constant and variable fields of an Attachment."""
         constants = {
             "ContentType": "image/jpeg",
         }
@@ -475,12 +781,132 @@ class Attachment(_DBObject):
         variables = {
             "ParentId": "",
             "Name": "",
-            "Body": "",
+            "Description": "",
         }
 
-        super(Attachment, self).__init__(name, constants, variables)
+        return constants, variables
 
-        self.is_profile = False
+    def spool_body(self, data):
+        """
+        Spool the raw, not base64 encoded, body to a temporary file.
+
+        The body's sha1 is recorded in the Description, see set_hash.
+
+        @type data: String
+        @param data: Raw bytes of the attachment
+        """
+        self.release_body()
+        self._body_file = tempfile.TemporaryFile()
+        self._body_file.write(data)
+        self._body_file.flush()
+        self.update_field("BodyLength", len(data))
+        self.set_hash("sha1", hashlib.sha1(data).hexdigest())
+
+    def get_hashes(self):
+        """The hashes recorded in the Description, see parse_hashes."""
+        return parse_hashes(self.get_field("Description"))
+
+    def set_hash(self, kind, digest):
+        """
+        Record a hash of the body in the Description.
+
+        The Description is uploaded along with the attachment, which is how
+        a later run recognizes the attachment as one it already has.
+
+        @type kind: String
+        @param kind: sha1, ahash for the perceptual hash of an image, or
+        size for its width and height, which tell a thumbnail from the
+        picture it was made from
+
+        @type digest: String
+        @param digest: The hash as hex digits
+        """
+        hashes = self.get_hashes()
+        hashes[kind] = digest
+        self.update_field("Description", " ".join(
+            "%s:%s" % item for item in sorted(hashes.items())
+        ))
+
+    def set_loader(self, source_url, loader):
+        """
+        Make the attachment lazy.
+
+        @type source_url: String
+        @param source_url: Identifies the body, the same url is expected to
+        give the same body from one run to the next
+
+        @type loader: callable
+        @param loader: Called with the attachment by load_body, spools the
+        body and sets the fields that depend on it
+        """
+        self.source_url = source_url
+        self._loader = loader
+
+    def load_body(self):
+        """
+        Fetch a lazy attachment's body, if it has not been already.
+
+        @rtype: Bool
+        @return: Whether the attachment has a body, a loader can fail to
+        produce one
+        """
+        if self._body_file is None and self._loader is not None:
+            loader, self._loader = self._loader, None
+            loader(self)
+
+        return self.has_body()
+
+    def release_body(self):
+        """Close and remove the spooled body, if any."""
+        if self._body_file is not None:
+            self._body_file.close()
+            self._body_file = None
+
+    def has_body(self):
+        """Whether or not a body has been spooled."""
+        return self._body_file is not None
+
+    def iter_body(self, encoded=True, chunk_size=BODY_CHUNK_SIZE):
+        """
+        Read the spooled body back in chunks.
+
+        @type encoded: Bool
+        @param encoded: base64 encode each chunk
+
+        @type chunk_size: Integer
+        @param chunk_size: Bytes read per chunk, must be a multiple of 3 for
+        the encoded chunks to be joinable
+
+        @rtype: generator(String)
+        @return: The body, chunk by chunk
+        """
+        if self._body_file is None:
+            return
+
+        self._body_file.seek(0)
+        while True:
+            chunk = self._body_file.read(chunk_size)
+            if not chunk:
+                break
+            yield b64encode(chunk) if encoded else chunk
+
+    def update_field(self, key, value):
+        """Spool a base64 encoded Body instead of keeping it as a field."""
+        if key == "Body":
+            self.spool_body(b64decode(value) if value else "")
+        else:
+            super(Attachment, self).update_field(key, value)
+
+    def get_field(self, key):
+        """
+        Retrieve a single field.
+
+        The Body is encoded from the spooled file on every call, so prefer
+        iter_body where the whole string is not needed at once.
+        """
+        if key == "Body":
+            return "".join(self.iter_body())
+        return super(Attachment, self).get_field(key)
 
 
 __all__ = [Child, SiblingGroup, Attachment, Contact]
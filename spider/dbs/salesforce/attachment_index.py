@@ -0,0 +1,127 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""The attachments salesforce already has, by parent record."""
+
+from collections import OrderedDict
+
+from twisted.logger import Logger
+
+
+# Parent Ids per query. 300 quoted Ids make for a query of about 6,500
+# characters, well within the length of a SOQL query sent in a url.
+CHUNK_SIZE = 300
+
+
+class AttachmentIndex(object):
+    """
+    Attachments of many parent records, loaded a chunk of parents at a time.
+
+    Parents whose attachments will be asked for are announced with expect.
+    Asking for the attachments of a parent not loaded yet loads it along
+    with up to CHUNK_SIZE - 1 of the expected parents, with a single
+    ParentId IN (...) query. Loaded parents are kept for the rest of the run.
+
+    @type query: callable
+    @param query: Runs a SOQL query, returning an iterable of its records
+
+    @type fields: iterable(String)
+    @param fields: Attachment fields to load, along with Id and ParentId
+    """
+
+    log = Logger()
+
+    def __init__(self, query, fields=("BodyLength",), chunk_size=CHUNK_SIZE):
+        self.query = query
+        self.fields = ["Id", "ParentId"] + [
+            f for f in fields if f not in ("Id", "ParentId")
+        ]
+        self.chunk_size = chunk_size
+        # Parent Id -> list of attachment records
+        self._loaded = {}
+        # Expected parents not loaded yet, in the order they were announced
+        self._expected = OrderedDict()
+
+    def expect(self, parent_ids):
+        """Announce parents whose attachments will be asked for."""
+        for parent_id in parent_ids:
+            if parent_id and parent_id not in self._loaded:
+                self._expected[parent_id] = True
+
+    def get(self, parent_id):
+        """
+        Return the attachments of a parent.
+
+        @type parent_id: String
+        @param parent_id: Id of a Child's or SiblingGroup's record
+
+        @rtype: list(dict)
+        @return: The attachments' fields
+        """
+        if parent_id not in self._loaded:
+            self._load(parent_id)
+
+        return self._loaded[parent_id]
+
+    def add(self, parent_id, fields):
+        """
+        Record an attachment written to a parent during the run.
+
+        A parent not loaded yet is left be, its attachments will be loaded
+        from salesforce, this one included.
+        """
+        if parent_id in self._loaded:
+            self._loaded[parent_id].append(fields)
+
+    def add_parent(self, parent_id):
+        """Record a parent created during the run, it has no attachments."""
+        self._expected.pop(parent_id, None)
+        self._loaded.setdefault(parent_id, [])
+
+    def forget(self, parent_id):
+        """
+        Drop what is known of a parent's attachments.
+
+        For a parent some attachments may have failed to be written to, its
+        attachments are loaded from salesforce again when next asked for.
+        """
+        self._loaded.pop(parent_id, None)
+
+    def _load(self, parent_id):
+        """Load parent_id along with a chunk of the expected parents."""
+        self._expected.pop(parent_id, None)
+        chunk = [parent_id]
+        while self._expected and len(chunk) < self.chunk_size:
+            chunk.append(self._expected.popitem(last=False)[0])
+
+        self.log.debug("Loading attachments of %s parents" % len(chunk))
+        query = "SELECT %s FROM Attachment WHERE ParentId IN (%s)" % (
+            ", ".join(self.fields),
+            ", ".join("'%s'" % loaded_id for loaded_id in chunk)
+        )
+        # Only kept once the whole query is read, a parent loaded in part
+        # would look like it lacks attachments it has
+        loaded = dict((loaded_id, []) for loaded_id in chunk)
+        try:
+            for record in self.query(query):
+                loaded.setdefault(record["ParentId"], []).append(
+                    dict((f, record.get(f)) for f in self.fields)
+                )
+        except Exception:
+            # Expected again, parent_id included
+            for loaded_id in chunk:
+                self._expected[loaded_id] = True
+            raise
+
+        self._loaded.update(loaded)
@@ -0,0 +1,160 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""The daily API requests a run of the Salesforce plugin spends."""
+
+import threading
+from urlparse import urlparse
+
+from twisted.logger import Logger
+
+
+# Calls a Bulk API job makes: create, add the batch, close, at least one
+# status poll and the results
+BULK_JOB_CALLS = 5
+
+# Categories in the order summary lists them
+CATEGORIES = (
+    "query", "create", "update", "attachment", "composite", "bulk", "other"
+)
+
+
+def categorize(method, url):
+    """
+    The category of a REST call.
+
+    Only attachments are inserted through the sObject Collections
+    endpoint, and only profile photos are updated through it.
+
+    @type method: String
+    @param method: GET, POST, PATCH, ...
+
+    @type url: String
+    @param url: The url called
+
+    @rtype: String
+    @return: One of CATEGORIES
+    """
+    path = urlparse(url).path
+    method = method.upper()
+    if "/query" in path:
+        return "query"
+    elif "/composite/sobjects" in path:
+        return "attachment" if method == "POST" else "update"
+    elif "/composite/" in path:
+        return "composite"
+    elif "/sobjects/Attachment" in path:
+        return "attachment"
+    elif "/sobjects/" in path and method == "POST":
+        return "create"
+    elif "/sobjects/" in path and method == "PATCH":
+        return "update"
+    return "other"
+
+
+class ApiBudget(object):
+    """
+    Counts the calls made against the org's daily API request limit.
+
+    The limit and what is left of it are read when the budget is created.
+    Every call made through the watched session is counted from then on,
+    Bulk API calls are counted by the BulkWriter.
+
+    @type sf: simple_salesforce.Salesforce
+    @param sf: Logged in salesforce instance
+
+    @type reserve: Float
+    @param reserve: Share of the daily limit to leave to everyone else,
+    see tight
+    """
+
+    log = Logger()
+
+    def __init__(self, sf, reserve=0.1):
+        self.reserve = reserve
+        self.calls = dict((category, 0) for category in CATEGORIES)
+        self._lock = threading.Lock()
+        self.limit = None
+        self.start_remaining = None
+
+        sf.request.hooks.setdefault("response", []).append(self.hook)
+        try:
+            result = sf.request.get(
+                "%slimits/" % sf.base_url, headers=sf.headers
+            )
+            result.raise_for_status()
+            daily = result.json()["DailyApiRequests"]
+            self.limit = daily["Max"]
+            self.start_remaining = daily["Remaining"]
+        except Exception, e:
+            self.log.error("Could not read the API limits: %s" % e)
+
+        if self.limit:
+            self.log.info("API requests: %s of %s left" % (
+                self.start_remaining, self.limit
+            ))
+
+    def hook(self, response, *args, **kwargs):
+        """Count a call, as a requests response hook."""
+        self.count(categorize(response.request.method, response.request.url))
+
+    def count(self, category, calls=1):
+        with self._lock:
+            self.calls[category] += calls
+
+    def used(self):
+        """Calls made so far."""
+        return sum(self.calls.values())
+
+    def remaining(self):
+        """
+        Calls left for the day.
+
+        @rtype: Integer
+        @return: None when the limits could not be read
+        """
+        if self.start_remaining is None:
+            return None
+        return self.start_remaining - self.used()
+
+    def tight(self, expected=0):
+        """
+        Whether expected more calls would eat into the reserve.
+
+        @type expected: Integer
+        @param expected: Calls the rest of the run is projected to make
+
+        @rtype: Bool
+        @return: False when the limits could not be read
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return False
+        return remaining - expected < self.reserve * self.limit
+
+    def summary(self):
+        """
+        The calls made, by category.
+
+        @rtype: String
+        @return: One line per category, then the total
+        """
+        lines = [
+            "%s: %s" % (category, self.calls[category])
+            for category in CATEGORIES if self.calls[category]
+        ]
+        lines.append("total: %s" % self.used())
+        if self.limit:
+            lines.append("left: %s of %s" % (self.remaining(), self.limit))
+        return "\n".join(lines)
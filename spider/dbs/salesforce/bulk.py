@@ -0,0 +1,332 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Bulk API writes for the Salesforce plugin."""
+
+from cStringIO import StringIO
+import csv
+
+from salesforce_bulk_api import SalesforceBulkJob, bulk_response_attribute
+from twisted.logger import Logger
+
+from budget import BULK_JOB_CALLS
+from data_types import Child, SiblingGroup
+from pool import RETRIES, WriterPool, backoff, is_retryable
+
+
+def csv_fields(fields):
+    """
+    Flatten a record for a Bulk API CSV row.
+
+    A dict value is a reference to another record by an external id, e.g.
+    {"Child_1_First_Name__r": {"Case_Number__c": "123"}}, which the Bulk API
+    takes as a Child_1_First_Name__r.Case_Number__c column.
+    """
+    flat = {}
+    for k, v in fields.items():
+        if isinstance(v, dict):
+            for external_id, value in v.items():
+                flat["%s.%s" % (k, external_id)] = value
+        else:
+            flat[k] = v
+
+    return flat
+
+
+def csv_value(value):
+    """
+    Format a field value for a Bulk API CSV row.
+
+    A Child or SiblingGroup stands for its Id, which may only be known once
+    the bulk insert creating it has run. A list is a multi-select picklist
+    value.
+
+    @rtype: String
+    @return: The value as UTF-8 bytes
+    """
+    if isinstance(value, (Child, SiblingGroup)):
+        value = value.get_field("Id")
+
+    if value is None:
+        return ""
+    elif type(value) is bool:
+        return "true" if value else "false"
+    elif isinstance(value, (list, tuple)):
+        return ";".join(csv_value(v) for v in value)
+    elif isinstance(value, unicode):
+        return value.encode("utf-8")
+
+    return str(value)
+
+
+def csv_document(header, rows):
+    r"""
+    The UTF-8 CSV of a Bulk API batch.
+
+    >>> lines = csv_document(["Name", "Child_s_Nationality__c"], [
+    ...     [csv_value(u"Jos\xe9 \u201cJo\u201d"), csv_value([])],
+    ...     [csv_value(u"Zo\xeb"), csv_value([u"Asian", u"White"])],
+    ... ]).splitlines()
+    >>> lines[1]
+    'Jos\xc3\xa9 \xe2\x80\x9cJo\xe2\x80\x9d,'
+    >>> lines[2]
+    'Zo\xc3\xab,Asian;White'
+
+    @type header: list(String)
+    @param header: The columns
+
+    @type rows: list(list(String))
+    @param rows: The rows, of values formatted by csv_value
+
+    @rtype: String
+    @return: The CSV, as bytes
+    """
+    document = StringIO()
+    writer = csv.writer(document)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return document.getvalue()
+
+
+class DescribedSalesforce(object):
+    """
+    A salesforce instance whose global describe comes from elsewhere.
+
+    SalesforceBulkJob checks the sObject it writes is in the global
+    describe, which it requests for every job it is created for. Handed
+    this instead, the jobs use a cached describe. Anything else is the
+    instance's.
+
+    @type sf: simple_salesforce.Salesforce
+    @param sf: Logged in salesforce instance
+
+    @type describe: callable
+    @param describe: Returns the global describe, or as much of it as
+    names the sObjects
+    """
+
+    def __init__(self, sf, describe):
+        self._sf = sf
+        self.describe = describe
+
+    def __getattr__(self, name):
+        return getattr(self._sf, name)
+
+
+class BulkWriter(object):
+    """
+    Inserts and updates of one sObject type, sent as Bulk API jobs on flush.
+
+    @type sf: simple_salesforce.Salesforce
+    @param sf: Logged in salesforce instance the jobs are run with
+
+    @type object_name: String
+    @param object_name: The sObject written, e.g. Children__c
+
+    @type batch_size: Integer
+    @param batch_size: Rows per job
+
+    @type external_id_field: String
+    @param external_id_field: Field upserts match existing records by
+
+    @type pool: WriterPool
+    @param pool: Runs the jobs of an operation at the same time
+
+    @type budget: ApiBudget
+    @param budget: Counts the calls the jobs make
+
+    @type describe: callable
+    @param describe: Returns the global describe, see DescribedSalesforce.
+    Each job requests it otherwise.
+    """
+
+    log = Logger()
+
+    # The order jobs are run in on flush
+    OPERATIONS = ("insert", "upsert", "update")
+
+    def __init__(self, sf, object_name, batch_size=5000,
+                 external_id_field=None, pool=None, budget=None,
+                 describe=None):
+        self.sf = sf
+        # What the jobs are run with
+        self.salesforce = (
+            sf if describe is None else DescribedSalesforce(sf, describe)
+        )
+        self.object_name = object_name
+        self.external_id_field = external_id_field
+        self.pool = pool or WriterPool()
+        self.budget = budget
+        # A job of a single batch returns its results in the order the rows
+        # were uploaded, which is what maps them back to the records
+        self.batch_size = min(
+            batch_size, SalesforceBulkJob.PUBLISHING_BATCH_SIZE
+        )
+        # (fields, [callback]) for each record queued, by operation
+        self.queued = dict((operation, []) for operation in self.OPERATIONS)
+        # Pending inserts and upserts by key, see insert
+        self._keys = {}
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.queued.values())
+
+    def insert(self, fields, callback=None, key=None):
+        """
+        Queue a record to insert.
+
+        @type fields: dict
+        @param fields: The record's fields
+
+        @type callback: callable
+        @param callback: Called with the new record's Id once inserted
+
+        @type key: String
+        @param key: Identifies the record, e.g. its case number. A second
+        insert with a pending key is not queued, its callback is called with
+        the Id of the first instead.
+
+        @rtype: bool
+        @return: Whether the record was queued
+        """
+        return self._queue("insert", fields, callback, key)
+
+    def upsert(self, fields, callback=None, key=None):
+        """
+        Queue a record to insert or update by its external_id_field.
+
+        See insert for the parameters.
+        """
+        return self._queue("upsert", fields, callback, key)
+
+    def _queue(self, operation, fields, callback, key):
+        callbacks = [callback] if callback else []
+        if key is not None and key in self._keys:
+            self._keys[key][1].extend(callbacks)
+            return False
+
+        entry = (fields, callbacks)
+        self.queued[operation].append(entry)
+        if key is not None:
+            self._keys[key] = entry
+        return True
+
+    def update(self, fields):
+        """
+        Queue a record to update.
+
+        @type fields: dict
+        @param fields: Id and the fields to change
+        """
+        self.queued["update"].append((fields, []))
+
+    def flush(self):
+        """
+        Run a job for every batch_size records queued.
+
+        The jobs of one operation run at the same time, each operation's
+        once the previous operation's are done. Rows salesforce could not
+        lock are run again.
+
+        @rtype: list((String, dict, String))
+        @return: The operation, fields and error of every record that failed
+        """
+        queued = self.queued
+        self.queued = dict((operation, []) for operation in self.OPERATIONS)
+        self._keys = {}
+
+        failed = []
+        for operation in self.OPERATIONS:
+            entries = queued[operation]
+            chunks = [
+                entries[start:start + self.batch_size]
+                for start in xrange(0, len(entries), self.batch_size)
+            ]
+            for chunk_failed in self.pool.map(
+                lambda chunk: self._run_with_retries(operation, chunk), chunks
+            ):
+                failed.extend(chunk_failed)
+
+        return failed
+
+    def _run_with_retries(self, operation, entries):
+        """Run a job, and new jobs for the rows salesforce was too busy for."""
+        failed = []
+        for attempt in xrange(RETRIES + 1):
+            busy = []
+            for failure in self._run(operation, entries):
+                if attempt < RETRIES and is_retryable(failure[2]):
+                    busy.append(failure)
+                else:
+                    failed.append(failure)
+            if not busy:
+                break
+
+            self.log.warn("Bulk %s of %s busy for %s records, retrying" % (
+                operation, self.object_name, len(busy)
+            ))
+            backoff(attempt)
+            busy_fields = set(id(fields) for _, fields, _ in busy)
+            entries = [e for e in entries if id(e[0]) in busy_fields]
+
+        return failed
+
+    def _run(self, operation, entries):
+        """Run one job and hand the new Ids to the callbacks."""
+        flat = [csv_fields(fields) for fields, _ in entries]
+        # Rows can set different fields, an empty column leaves a field be
+        header = sorted(set(k for fields in flat for k in fields))
+        rows = [[csv_value(fields.get(k)) for k in header] for fields in flat]
+
+        self.log.info("Bulk %s of %s %s records" % (
+            operation, len(rows), self.object_name
+        ))
+        if self.budget is not None:
+            self.budget.count("bulk", BULK_JOB_CALLS)
+        try:
+            job = SalesforceBulkJob(
+                operation, self.object_name,
+                external_id_field=self.external_id_field,
+                salesforce=self.salesforce
+            )
+            # Posted as bytes, salesforce_bulk_api's own CSV encodes them
+            # again and fails on anything but ASCII
+            job.create()
+            response = job.request(
+                "post", job.job_url + "/batch",
+                data=csv_document(header, rows),
+                content_type="text/csv; charset=UTF-8"
+            )
+            job.pending_batches.append(
+                bulk_response_attribute(response, "id")
+            )
+            job.close()
+            job.wait()
+            results = list(job.results())
+        except Exception, e:
+            self.log.error("Bulk %s of %s failed: %s" % (
+                operation, self.object_name, e
+            ))
+            return [(operation, fields, "%s" % e) for fields, _ in entries]
+
+        failed = []
+        for (fields, callbacks), result in zip(entries, results):
+            sid, success, created, error = result
+            if not success:
+                failed.append((operation, fields, error))
+                continue
+
+            for callback in callbacks:
+                callback(sid)
+
+        return failed
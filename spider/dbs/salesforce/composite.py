@@ -0,0 +1,200 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Composite Graph writes for the Salesforce plugin."""
+
+import json
+import re
+
+from twisted.logger import Logger
+
+from pool import send_with_backoff
+
+
+# Most requests a single graph may hold
+GRAPH_SIZE = 500
+
+# "@{ref3.id}", the Id of the record another request of the graph writes
+REFERENCE = re.compile(r"@\{(ref\d+)\.id\}")
+
+
+def is_reference(value):
+    """Whether value is the reference to a record a graph has yet to write."""
+    return isinstance(value, basestring) and bool(REFERENCE.match(value))
+
+
+class CompositeGraph(object):
+    """
+    Requests depending on each other's Ids, sent in one round trip.
+
+    A request refers to the record written by an earlier one with the
+    reference add returned, as a field value or in its url. If salesforce
+    rejects the graph, nothing of it is written and the requests are sent
+    again one by one, the way the plugin writes without a graph.
+
+    @type sf: simple_salesforce.Salesforce
+    @param sf: Logged in salesforce instance, API version 50.0 or later
+    """
+
+    log = Logger()
+
+    def __init__(self, sf):
+        self.sf = sf
+        # (reference id, method, url, JSON body, Attachment, callback)
+        self.requests = []
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add(self, method, url, fields, attachment=None, callback=None):
+        """
+        Add a request to the graph.
+
+        @type method: String
+        @param method: POST, PATCH, ...
+
+        @type url: String
+        @param url: Relative to the REST API's base url, e.g.
+        sobjects/Children__c
+
+        @type fields: dict
+        @param fields: The request's body
+
+        @type attachment: Attachment
+        @param attachment: Attachment whose Body goes with the fields
+
+        @type callback: callable
+        @param callback: Called with the Id of the record written, once the
+        graph has been sent
+
+        @rtype: String
+        @return: Reference to the Id of the record written, usable by the
+        requests added after this one
+        """
+        reference_id = "ref%d" % len(self.requests)
+        self.requests.append(
+            (reference_id, method, url, json.dumps(fields), attachment,
+             callback)
+        )
+        return "@{%s.id}" % reference_id
+
+    def send(self):
+        """
+        Send the graph, or each of its requests when the graph fails.
+
+        @rtype: dict
+        @return: The Id written by each request, by reference id
+        """
+        if not self.requests:
+            return {}
+
+        if len(self.requests) <= GRAPH_SIZE:
+            ids = self._send_graph()
+            if ids is not None:
+                return self._callback(ids)
+
+        return self._callback(self._send_each())
+
+    def _iter_body(self, body, attachment, resolve=None):
+        """Yield a request's JSON body, streaming the Attachment's Body."""
+        if resolve is not None:
+            body = resolve(body)
+
+        if attachment is None:
+            yield body
+            return
+
+        # base64 never needs escaping inside a JSON string
+        yield '%s, "Body": "' % body[:-1]
+        for chunk in attachment.iter_body():
+            yield chunk
+        yield '"}'
+
+    def _send_graph(self):
+        """Send all requests as one graph, None if it was not written."""
+        base_path = "/services/data/v%s/" % self.sf.sf_version
+
+        def document():
+            yield '{"graphs": [{"graphId": "1", "compositeRequest": ['
+            for i, request in enumerate(self.requests):
+                reference_id, method, url, body, attachment, _ = request
+                if i:
+                    yield ", "
+                yield '{"method": %s, "url": %s, "referenceId": %s, ' % (
+                    json.dumps(method), json.dumps(base_path + url),
+                    json.dumps(reference_id)
+                )
+                yield '"body": '
+                for chunk in self._iter_body(body, attachment):
+                    yield chunk
+                yield "}"
+            yield "]}]}"
+
+        result = send_with_backoff(lambda: self.sf.request.post(
+            "%scomposite/graph" % self.sf.base_url,
+            headers=self.sf.headers,
+            data=document(),
+        ))
+        if result.status_code >= 300:
+            self.log.error("Composite graph failed: %s" % result.text)
+            return None
+
+        graph = result.json()["graphs"][0]
+        responses = graph["graphResponse"]["compositeResponse"]
+        if not graph.get("isSuccessful"):
+            errors = [
+                response.get("body") for response in responses
+                if response.get("httpStatusCode", 500) >= 300
+            ]
+            self.log.error("Composite graph rolled back: %s" % errors)
+            return None
+
+        ids = {}
+        for response in responses:
+            body = response.get("body") or {}
+            ids[response["referenceId"]] = body.get("id")
+        return ids
+
+    def _send_each(self):
+        """Send the requests one at a time, resolving references."""
+        ids = {}
+
+        def resolve(text):
+            return REFERENCE.sub(lambda m: ids.get(m.group(1)) or "", text)
+
+        for reference_id, method, url, body, attachment, _ in self.requests:
+            result = send_with_backoff(lambda: self.sf.request.request(
+                method,
+                "%s%s" % (self.sf.base_url, resolve(url)),
+                headers=self.sf.headers,
+                data=self._iter_body(body, attachment, resolve),
+            ))
+            if result.status_code >= 300:
+                self.log.error("%s %s failed: %s" % (method, url, result.text))
+            result.raise_for_status()
+
+            # Updates answer with no content
+            ids[reference_id] = (
+                result.json().get("id") if result.content else None
+            )
+
+        return ids
+
+    def _callback(self, ids):
+        """Hand each callback the Id its request wrote."""
+        for reference_id, _, _, _, _, callback in self.requests:
+            if callback:
+                callback(ids.get(reference_id))
+
+        return ids
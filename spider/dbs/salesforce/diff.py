@@ -0,0 +1,202 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Scraped records compared to the records salesforce has."""
+
+import hashlib
+import json
+
+from dateutil.parser import parse as date_parse
+
+
+class Equal(object):
+    """Values differ unless they are equal, the rule of most fields."""
+
+    def changed(self, olds, news):
+        """
+        Compare a column of stored values to the scraped ones.
+
+        @type olds: list
+        @param olds: The stored values, None where there is none
+
+        @type news: list
+        @param news: The scraped values, in the same order
+
+        @rtype: list(Bool)
+        @return: Whether each scraped value is a change
+        """
+        return [old != new for old, new in zip(olds, news)]
+
+
+class Ignore(Equal):
+    """Never a change, for fields the site sets on every scrape."""
+
+    def changed(self, olds, news):
+        return [False] * len(news)
+
+
+class DateTolerance(Equal):
+    """
+    Dates within a tolerance of the stored one are no change.
+
+    Each distinct value of a column is parsed once.
+
+    @type tolerance: relativedelta
+    @param tolerance: How far off either way a date may be
+    """
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+
+    def changed(self, olds, news):
+        parsed = {}
+
+        def parse(value):
+            if value not in parsed:
+                try:
+                    parsed[value] = date_parse(value) if value else None
+                except (ValueError, OverflowError):
+                    parsed[value] = None
+            return parsed[value]
+
+        result = []
+        for old, new in zip(olds, news):
+            if old == new:
+                result.append(False)
+                continue
+
+            old_date, new_date = parse(old), parse(new)
+            result.append(
+                old_date is None or new_date is None or not (
+                    old_date - self.tolerance <= new_date <=
+                    old_date + self.tolerance
+                )
+            )
+
+        return result
+
+
+class Picklist(Equal):
+    """Multi-select picklist values, the order of the options is no change."""
+
+    def changed(self, olds, news):
+        def options(value):
+            if not value:
+                return frozenset()
+            return frozenset(o.strip() for o in value.split(";"))
+
+        return [
+            old != new and options(old) != options(new)
+            for old, new in zip(olds, news)
+        ]
+
+
+class DiffEngine(object):
+    """
+    Compare a batch of scraped records to the stored ones, a field at a time.
+
+    Every field of the batch is compared as one column, under the rule
+    for that field, so a rule's setup is paid once per batch instead of
+    once per record.
+
+    @type rules: dict
+    @param rules: Rule by field name, Equal for the fields not in it
+    """
+
+    def __init__(self, rules=None):
+        self.rules = rules or {}
+        self.default = Equal()
+
+    def diff(self, scraped, stored):
+        """
+        Find the changes of each scraped record.
+
+        @type scraped: list(dict)
+        @param scraped: The scraped records
+
+        @type stored: list(dict)
+        @param stored: The stored records, in the same order
+
+        @rtype: list(dict)
+        @return: For each scraped record, (old, new) by field for the
+        fields that changed. Unchanged records have an empty dict.
+        """
+        changes = [{} for _ in scraped]
+        fields = set()
+        for record in scraped:
+            fields.update(record)
+
+        for field in fields:
+            rows = [i for i, record in enumerate(scraped) if field in record]
+            olds = [stored[i].get(field) for i in rows]
+            news = [scraped[i][field] for i in rows]
+            rule = self.rules.get(field, self.default)
+            for i, old, new, changed in zip(
+                rows, olds, news, rule.changed(olds, news)
+            ):
+                if changed:
+                    changes[i][field] = (old, new)
+
+        return changes
+
+    def diff_one(self, scraped, stored):
+        """The changes of a single record, see diff."""
+        return self.diff([scraped], [stored])[0]
+
+
+def fingerprint(record, ignored=()):
+    """
+    Hash a scraped Child or SiblingGroup, to tell whether it changed.
+
+    The variable fields, attachments and, for a SiblingGroup, children go
+    into the hash. The constants change from one run to the next and are
+    left out, along with the Id.
+
+    @type record: Child or SiblingGroup
+    @param record: The record as scraped, before it is written
+
+    @type ignored: iterable(String)
+    @param ignored: More fields to leave out, see Ignore
+
+    @rtype: String
+    @return: sha1 hex digest
+    """
+    ignored = set(ignored) | set(["Id"])
+
+    def normalized(value):
+        if isinstance(value, (list, tuple)):
+            return [normalized(v) for v in value]
+        if hasattr(value, "get_variable_fields"):
+            return dict(
+                (k, normalized(value.get_field(k)))
+                for k in value.get_variable_fields() if k not in ignored
+            )
+        return value
+
+    document = {
+        "fields": normalized(record),
+        # Lazy attachments are known by their source, others by their body
+        "attachments": sorted(
+            a.source_url or a.get_hashes().get("sha1")
+            for a in record.get_attachments()
+        ),
+    }
+    if hasattr(record, "get_children"):
+        document["children"] = [
+            fingerprint(child, ignored) for child in record.get_children()
+        ]
+
+    return hashlib.sha1(
+        json.dumps(document, sort_keys=True, default=unicode)
+    ).hexdigest()
@@ -0,0 +1,185 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Lookup tables kept on disk between runs of the Salesforce plugin."""
+
+import json
+import os
+import time
+
+from twisted.logger import Logger
+
+
+class PersistentIndex(object):
+    """
+    A dict of strings to JSON serializable values, saved as a JSON file.
+
+    Everything is kept in memory. sync writes the file back out if anything
+    changed, through a temporary file so an interrupted run never leaves a
+    half written index behind.
+
+    @type path: String
+    @param path: File the index is loaded from and saved to. None keeps the
+    index in memory only.
+
+    @type mode: Integer
+    @param mode: Permissions the file is created with, less the umask
+    """
+
+    log = Logger()
+
+    def __init__(self, path=None, mode=0666):
+        self.path = path
+        self.mode = mode
+        self._data = {}
+        self._dirty = False
+
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._data = json.load(f)
+            except ValueError, e:
+                # A corrupt index only costs the lookups it would have saved
+                self.log.error("Ignoring unreadable index %s: %s" % (path, e))
+                self._data = {}
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._dirty = True
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._dirty = True
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        return self._data.keys()
+
+    def iteritems(self):
+        return self._data.iteritems()
+
+    def sync(self):
+        """Write the index to its file, if it has one and has changed."""
+        if not (self.path and self._dirty):
+            return
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        tmp_path = "%s.tmp" % self.path
+        # Created with its permissions, never readable by others for a
+        # moment. One left behind by a crash could have others.
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        fd = os.open(
+            tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, self.mode
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump(self._data, f)
+        os.rename(tmp_path, self.path)
+        self._dirty = False
+
+    def close(self):
+        """Sync the index."""
+        self.sync()
+
+
+class MetadataCache(object):
+    """
+    describe results kept for ttl seconds, in a PersistentIndex.
+
+    Entries are only good for the API version and instance they were
+    fetched with, a change of either fetches them again.
+
+    @type path: String
+    @param path: See PersistentIndex
+
+    @type ttl: Float
+    @param ttl: Seconds a describe result is used for
+
+    @type key: String
+    @param key: API version and instance the results are fetched with
+    """
+
+    def __init__(self, path, ttl, key):
+        self.index = PersistentIndex(path)
+        self.ttl = ttl
+        self.key = key
+
+    def get(self, name, fetch):
+        """
+        The describe result of an sObject, fetched if it is not cached.
+
+        @type name: String
+        @param name: The sObject, e.g. Children__c
+
+        @type fetch: callable
+        @param fetch: Fetches the describe result
+
+        @rtype: dict
+        @return: The describe result
+        """
+        entry = self.index.get(name)
+        if (
+            entry and entry["key"] == self.key and
+            time.time() - entry["fetched"] < self.ttl
+        ):
+            return entry["describe"]
+
+        describe = fetch()
+        self.index[name] = {
+            "key": self.key, "fetched": time.time(), "describe": describe
+        }
+        self.index.sync()
+        return describe
+
+    def invalidate(self, name=None):
+        """Forget the describe result of an sObject, or of all of them."""
+        for cached in ([name] if name else self.index.keys()):
+            if cached in self.index:
+                del self.index[cached]
+        self.index.sync()
+
+
+def index_path(config, name):
+    """
+    Path of the named index in the configured state_dir.
+
+    @type config: ConfigObj
+    @param config: The plugin's configuration
+
+    @type name: String
+    @param name: The index's name, e.g. contacts
+
+    @rtype: String or None
+    @return: The index's file, or None when state_dir is set empty, in
+    which case indexes only last for the run
+    """
+    state_dir = config.get("state_dir", ".")
+    if not state_dir:
+        return None
+
+    return os.path.join(state_dir, "salesforce_%s.json" % name)
@@ -0,0 +1,92 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Scraped values turned into picklist options."""
+
+import re
+
+from helpers import LRUCache
+
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class PicklistMatcher(object):
+    """
+    Match scraped values to the options of a multi-select picklist.
+
+    A value matches the options containing its first word. The options are
+    indexed by their words once, so matching a value is a dict lookup. A
+    first word that is no whole word of any option still matches the
+    options it is part of, e.g. "Asia" matches "Asian". Results are
+    remembered by value.
+
+    @type labels: list(String)
+    @param labels: The picklist's labels
+
+    @type default: String
+    @param default: Option of the values nothing matches
+    """
+
+    def __init__(self, labels, default="Unknown"):
+        self.labels = list(labels)
+        self.default = default
+        # Word -> labels holding it, in picklist order
+        self.words = {}
+        for label in self.labels:
+            for word in set(WORD.findall(label)):
+                self.words.setdefault(word, []).append(label)
+        self._matches = LRUCache(1024)
+
+    def match(self, value):
+        """
+        The options a single scraped value stands for.
+
+        @type value: String
+        @param value: e.g. "Hispanic", "White/Caucasian"
+
+        @rtype: list(String)
+        @return: The matching labels, possibly none
+        """
+        matches = self._matches.get(value)
+        if matches is None:
+            word = WORD.match(value)
+            first_word = word.group() if word else self.default
+            matches = self.words.get(first_word)
+            if matches is None:
+                matches = [
+                    label for label in self.labels if first_word in label
+                ]
+            self._matches[value] = matches
+
+        return matches
+
+    def picklist(self, values):
+        """
+        The multi-select picklist value of several scraped values.
+
+        @type values: list(String)
+        @param values: The scraped values
+
+        @rtype: String
+        @return: The matching labels joined by ";", the default when
+        nothing matched
+        """
+        picks = []
+        for value in values:
+            for label in self.match(value):
+                if label not in picks:
+                    picks.append(label)
+
+        return ";".join(picks or [self.default])
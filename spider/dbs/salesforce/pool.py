@@ -0,0 +1,174 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Concurrent requests for the Salesforce plugin."""
+
+from Queue import Queue
+import random
+import sys
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from twisted.logger import Logger
+
+
+log = Logger()
+
+# Errors salesforce answers with while the org is busy, a request failing
+# with one is sent again after a while
+RETRYABLE_ERRORS = (
+    "REQUEST_LIMIT_EXCEEDED",
+    "UNABLE_TO_LOCK_ROW",
+    "SERVER_UNAVAILABLE",
+)
+
+# Times a request is sent again, and the seconds waited before the first
+# retry. The wait doubles with every retry.
+RETRIES = 5
+BACKOFF = 1.0
+
+
+def is_retryable(error):
+    """Whether an error, as salesforce's response text, is worth a retry."""
+    error = "%s" % error
+    return any(code in error for code in RETRYABLE_ERRORS)
+
+
+def backoff(attempt):
+    """Sleep before retry number attempt, 0 being the first."""
+    delay = BACKOFF * 2 ** attempt
+    time.sleep(delay + random.uniform(0, delay / 2))
+
+
+def send_with_backoff(send):
+    """
+    Send a request until salesforce is not too busy to take it.
+
+    @type send: callable
+    @param send: Sends the request, returning the requests Response
+
+    @rtype: requests.Response
+    @return: The last response
+    """
+    for attempt in xrange(RETRIES + 1):
+        response = send()
+        if response.status_code < 300 or not is_retryable(response.text):
+            return response
+
+        if attempt < RETRIES:
+            log.warn(
+                "Salesforce is busy, retrying: %s" % response.text[:200]
+            )
+            backoff(attempt)
+
+    return response
+
+
+def pool_connections(sf, size):
+    """
+    Keep up to size connections to salesforce open, one for each request
+    that can be running at once.
+
+    @type sf: simple_salesforce.Salesforce
+    @param sf: Logged in salesforce instance
+    """
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(size, 1))
+    sf.request.mount("https://", adapter)
+
+
+class Task(object):
+    """A call run by a WriterPool, see WriterPool.submit."""
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def run(self):
+        try:
+            self._result = self.function(*self.args)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._done.set()
+
+    def result(self):
+        """Wait for the call, returning its result or raising its error."""
+        self._done.wait()
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class WriterPool(object):
+    """
+    Threads sending requests to salesforce, size of them at once.
+
+    Tasks run in any order. Callers needing an order, like children before
+    the sibling groups referring to them, wait for the results of one set of
+    tasks before submitting the next.
+
+    @type size: Integer
+    @param size: Requests running at once. 1 runs every task as it is
+    submitted, on the calling thread.
+    """
+
+    def __init__(self, size=1):
+        self.size = max(int(size), 1)
+        self._tasks = Queue()
+        self._threads = []
+
+    def submit(self, function, *args):
+        """
+        Run function(*args) on one of the threads.
+
+        @rtype: Task
+        @return: The task, whose result waits for the call to finish
+        """
+        task = Task(function, args)
+        if self.size == 1:
+            task.run()
+            return task
+
+        if not self._threads:
+            for _ in xrange(self.size):
+                thread = threading.Thread(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+        self._tasks.put(task)
+        return task
+
+    def map(self, function, items):
+        """Run function on each of items, returning the results in order."""
+        tasks = [self.submit(function, item) for item in items]
+        return [task.result() for task in tasks]
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            task.run()
+
+    def close(self):
+        """Stop the threads once the tasks submitted so far have run."""
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
@@ -16,17 +16,67 @@
 
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from dateutil.parser import parse as bday_parse
-import re
+import json
+import time
 
 from bs4 import BeautifulSoup
-from simple_salesforce import Salesforce as sfdb
+from simple_salesforce import Salesforce as sfdb, SalesforceExpiredSession
 from twisted.logger import Logger
 from zope.interface import implements
 from zope.interface.exceptions import DoesNotImplement
 
-from data_types import AllChildren, Child, Contact, SiblingGroup
+from data_types import (
+    AllChildren, Child, Contact, SiblingGroup, hash_distance, parse_hashes
+)
 from iplugin import DBPlugin
+from attachment_index import AttachmentIndex
+from budget import ApiBudget
+from bulk import BulkWriter
+from composite import CompositeGraph, is_reference
+from diff import DateTolerance, DiffEngine, Ignore, Picklist, fingerprint
+from index import MetadataCache, PersistentIndex, index_path
+from picklist import PicklistMatcher
+from pool import WriterPool, pool_connections, send_with_backoff
+from sobject_collections import CollectionWriter
+
+
+# Most bits the perceptual hashes of two attachments may differ by for them
+# to be taken for the same picture, out of 64
+AHASH_DISTANCE = 5
+
+# How the fields of existing records are compared to the scraped ones, see
+# DiffEngine. The bulletin date changes on every scrape and a birthdate
+# computed from an age is only accurate to six months.
+FIELD_RULES = {
+    "Child_Bulletin_Date__c": Ignore(),
+    "Child_s_Birthdate__c": DateTolerance(relativedelta(months=3)),
+    "Child_s_Nationality__c": Picklist(),
+}
+
+# Fields whose changes never count, left out of the fingerprints too
+IGNORED_FIELDS = [k for k, rule in FIELD_RULES.items() if type(rule) is Ignore]
+
+# The field holding the profile photo of each type
+PHOTO_FIELDS = {
+    Child: "Child_s_Photo__c",
+    SiblingGroup: "Sibling_Photo__c",
+}
+
+# The field referring to the caseworker Contact of each type
+CONTACT_FIELDS = {
+    Child: "Case_Worker_Contact__c",
+    SiblingGroup: "Caseworker__c",
+}
+
+# Fields the site plugins set beyond the variable fields of Child and
+# SiblingGroup. They are preloaded along with them so the diffs in
+# add_or_update_child and add_or_update_sibling_group need no query.
+PRELOADED_EXTRA_FIELDS = {
+    Child: (
+        "Child_s_Bio__c", "Child_s_Sex__c", "Child_s_Primary_Language__c"
+    ),
+    SiblingGroup: (),
+}
 
 
 class Salesforce(object):
@@ -67,20 +117,121 @@ class Salesforce(object):
         self.config = self._check_config(config)
         # Create a salesforce instance
         self.log.debug("Create sf instance")
-        self.sf = sfdb(
-            username=self.config['username'],
-            password=self.config['password'],
-            security_token=self.config['token'],
-            sandbox=bool(self.config['sandbox']),
+        self.sf = self._connect()
+        # SFTypes by sObject name, see _sobject
+        self._sobjects = {}
+        # describe results kept between runs, see _describe
+        self.metadata = MetadataCache(
+            index_path(self.config, "metadata"),
+            float(self.config.get("metadata_ttl", 24)) * 3600,
+            "%s@%s" % (self.sf.sf_version, self.sf.sf_instance)
+        )
+        # Daily API requests left and spent, see _check_budget
+        self.budget = ApiBudget(
+            self.sf, float(self.config.get("api_reserve", 0.1))
         )
+        # Set once the budget is too tight for attachments, those are then
+        # left for the next run
+        self.defer_attachments = False
+        # Calls made and profiles written when the budget was last acted on
+        self._budget_mark = (self.budget.used(), 0)
+
         # Report with a datetime string appended
         n = datetime.now().isoformat().replace(":", "-")
         self.report = open("Report_%s.txt" % n, 'w')
 
+        self.differ = DiffEngine(FIELD_RULES)
+
+        # Number of streamed profiles handed to add_children and
+        # add_sibling_groups at a time
+        self.batch_size = int(self.config.get("batch_size", 25))
+
+        # Contacts already matched or created, by get_contact's conditions
+        self.contacts = PersistentIndex(index_path(self.config, "contacts"))
+        # Seconds those are used for before being looked up again
+        self.contact_ttl = float(self.config.get("contact_ttl", 24)) * 3600
+        # The conditions each contact returned by get_contact was found
+        # with, by Id, see _forget_contact
+        self._contact_keys = {}
+        # Attachment Ids by the source_url of lazy attachments, an attachment
+        # whose source is known is never downloaded again
+        self.sources = PersistentIndex(
+            index_path(self.config, "attachment_sources")
+        )
+        # Fingerprint and Id of the records last written, by type and case
+        # number. A record scraped the same as last time is skipped.
+        self.fingerprints = PersistentIndex(
+            index_path(self.config, "fingerprints")
+        )
+        self.skip_unchanged = (
+            self.config.get("skip_unchanged", "True") == "True"
+        )
+        # Fingerprints of the records written since the last flush, they
+        # are only kept once the writes went through
+        self._written = {}
+
+        # Existing Children__c and Sibling_Group__c records by Case_Number__c
+        # and the fields loaded for them, see _preload
+        self.existing = {}
+        self.existing_fields = {}
+        # Attachments already in salesforce, by parent. Those of preloaded
+        # records are loaded many parents at a time.
+        self.attachments = AttachmentIndex(
+            self._iter_query, fields=("BodyLength", "Description")
+        )
+        if self.config.get("preload", "True") == "True":
+            self._preload(Child)
+            self._preload(SiblingGroup)
+
+        # Requests the writers send at once, over as many connections
+        self.pool = WriterPool(int(self.config.get("concurrency", 1)))
+        pool_connections(self.sf, self.pool.size)
+
+        # Attachments to insert and profile photos to set, sent through the
+        # sObject Collections endpoint many at a time
+        self.attachment_writer = CollectionWriter(
+            self.sf, "POST", pool=self.pool
+        )
+        self.photo_writer = CollectionWriter(self.sf, "PATCH", pool=self.pool)
+
+        # In composite mode each sibling group is written with its children
+        # and attachments by one Composite Graph request, see
+        # add_or_update_sibling_group
+        self.composite = self.config.get("composite", "False") == "True"
+        if self.composite and float(self.sf.sf_version) < 50:
+            raise Exception(
+                "%s: composite requires an api_version of 50.0 or later" %
+                self.settings_name
+            )
+        # The graph being built, while in add_or_update_sibling_group
+        self.graph = None
+
+        # In upsert mode new records are upserted by Case_Number__c, which
+        # must be an External ID field of Children__c and Sibling_Group__c.
+        # Only records the preload did not find are upserted, with their
+        # creation time constants, so the existing ones are left be.
+        self.upsert = self.config.get("upsert", "False") == "True"
+        if self.upsert and not self.existing:
+            raise Exception(
+                "%s: upsert requires preload = True" % self.settings_name
+            )
+
+        # In bulk mode Children__c and Sibling_Group__c records are written
+        # by Bulk API jobs, bulk_batch_size records at a time
+        self.bulk = {}
+        if self.config.get("bulk", "False") == "True":
+            self._enable_bulk()
+
         self.nationalities = []
 
         # Grab all metadata
-        all_field_metadata = self.sf.Children__c.describe()['fields']
+        all_field_metadata = self._describe("Children__c")['fields']
+        if "Child_s_Nationality__c" not in [
+            field.get("name") for field in all_field_metadata
+        ]:
+            # Cached from before the field was added
+            self.metadata.invalidate("Children__c")
+            all_field_metadata = self._describe("Children__c")['fields']
         for field in all_field_metadata:
             if field.get("name") == "Child_s_Nationality__c":
                 # Grab the Nationality picklist labels
@@ -91,6 +242,122 @@ class Salesforce(object):
                         label = value_dict.get('label')
                         if label:
                             self.nationalities.append(label)
+        self.nationality_matcher = PicklistMatcher(self.nationalities)
+
+    def _connect(self):
+        """
+        Log in to salesforce.
+
+        The session is kept in state_dir and reused by the next run, which
+        skips the login for as long as salesforce accepts the session.
+
+        @rtype: simple_salesforce.Salesforce
+        @return: The logged in instance
+        """
+        # sObject Collections need 42.0 or later
+        version = self.config.get("api_version", "42.0")
+        session = PersistentIndex(index_path(self.config, "session"))
+        reuse = self.config.get("reuse_session", "True") == "True"
+        if (
+            reuse and session.get("session_id") and
+            session.get("username") == self.config["username"]
+        ):
+            sf = sfdb(
+                session_id=session["session_id"],
+                instance=session["instance"],
+                version=version,
+            )
+            try:
+                accepted = sf.request.get(
+                    sf.base_url, headers=sf.headers
+                ).status_code < 300
+            except Exception, e:
+                self.log.error("Could not check the session: %s" % e)
+                accepted = False
+
+            if accepted:
+                self.log.debug("Reusing the salesforce session")
+                return sf
+            self.log.info("Salesforce session rejected, logging in")
+
+        return self._login()
+
+    def _login(self):
+        """
+        Log in to salesforce with the configured credentials.
+
+        With reuse_session the session is kept in state_dir, in a file only
+        the user running the spider can read.
+
+        @rtype: simple_salesforce.Salesforce
+        @return: The logged in instance
+        """
+        sf = sfdb(
+            username=self.config['username'],
+            password=self.config['password'],
+            security_token=self.config['token'],
+            sandbox=bool(self.config['sandbox']),
+            version=self.config.get("api_version", "42.0"),
+        )
+        if self.config.get("reuse_session", "True") == "True":
+            session = PersistentIndex(
+                index_path(self.config, "session"), mode=0600
+            )
+            session["username"] = self.config["username"]
+            session["session_id"] = sf.session_id
+            session["instance"] = sf.sf_instance
+            session.close()
+
+        return sf
+
+    def _login_again(self):
+        """
+        Log in again, salesforce having rejected the session mid-run.
+
+        The instance is updated in place, the writers, bulk jobs and budget
+        all hold on to it.
+        """
+        self.log.info("Salesforce session expired, logging in again")
+        sf = self._login()
+        for name in (
+            "session_id", "sf_instance", "headers", "base_url", "apex_url"
+        ):
+            setattr(self.sf, name, getattr(sf, name))
+        # SFTypes were handed the old session's headers
+        self._sobjects = {}
+
+    def _describe(self, name):
+        """The describe result of an sObject, see MetadataCache."""
+        return self.metadata.get(
+            name, lambda: self._sobject(name).describe()
+        )
+
+    def _describe_global(self):
+        """
+        The sObjects of the org, see MetadataCache.
+
+        Only their names are kept, all a bulk job checks the global
+        describe for.
+        """
+        return self.metadata.get("(global)", lambda: {"sobjects": [
+            {"name": sobject["name"]}
+            for sobject in self.sf.describe()["sobjects"]
+        ]})
+
+    def _sobject(self, name):
+        """
+        The simple_salesforce SFType of an sObject, e.g. Children__c.
+
+        An SFType opens a session of its own. It is handed the plugin's
+        instead, so its calls share the pooled connections and are counted
+        by the budget.
+        """
+        sobject = self._sobjects.get(name)
+        if sobject is None:
+            sobject = getattr(self.sf, name)
+            sobject.request = self.sf.request
+            self._sobjects[name] = sobject
+        return sobject
 
     def _query(self, query):
         """
@@ -100,6 +367,164 @@ class Salesforce(object):
         """
         return self.sf.query(query)
 
+    def _iter_query(self, query):
+        """
+        Yield every record a query returns.
+
+        Like query_all, but each page of results is let go of once its
+        records have been yielded.
+
+        INTERNAL USE ONLY - HERE BE DRAGONS!
+        """
+        result = self.sf.query(query)
+        while True:
+            for record in result["records"]:
+                yield record
+            if result["done"]:
+                break
+            result = self.sf.query_more(
+                result["nextRecordsUrl"], identifier_is_url=True
+            )
+
+    def _preload(self, t):
+        """
+        Load every record of type t with a case number into self.existing.
+
+        One paged query replaces the query find_by_case_number would
+        otherwise send for each and every profile.
+
+        @type t: type
+        @param t: Child or SiblingGroup
+        """
+        fields = set(["Id"])
+        fields.update(t.schema().names)
+        fields.update(PRELOADED_EXTRA_FIELDS[t])
+
+        query = "SELECT %s FROM %s WHERE Case_Number__c != null" % (
+            ", ".join(sorted(fields)), t.table_name
+        )
+
+        records = {}
+        for record in self._iter_query(query):
+            record = dict(record)
+            del record["attributes"]
+            records[record["Case_Number__c"]] = record
+
+        self.log.info("Preloaded %s %s records" % (len(records), t.table_name))
+        self.existing[t] = records
+        self.existing_fields[t] = fields
+        self.attachments.expect(
+            record["Id"] for record in records.itervalues()
+        )
+
+    def _remember(self, t, fields):
+        """
+        Record a created or updated record in self.existing.
+
+        @type t: type
+        @param t: Child or SiblingGroup
+
+        @type fields: dict
+        @param fields: The fields written, including Id and Case_Number__c
+        """
+        records = self.existing.get(t)
+        if records is None:
+            return
+
+        case_number = fields.get("Case_Number__c")
+        record = records.setdefault(case_number, {})
+        record.update(
+            (k, v) for k, v in fields.items()
+            if k in self.existing_fields[t]
+        )
+
+    def _upsert(self, t, fields):
+        """
+        Upsert a Children__c or Sibling_Group__c record by Case_Number__c.
+
+        INTERNAL USE ONLY - HERE BE DRAGONS!
+
+        @type t: type
+        @param t: Child or SiblingGroup
+
+        @type fields: dict
+        @param fields: The record's fields, Case_Number__c included
+
+        @rtype: String
+        @return: The Id of the record inserted or updated
+        """
+        fields = dict(fields)
+        case_number = fields.pop("Case_Number__c")
+        fields.pop("Id", None)
+
+        sobject = self._sobject(t.table_name)
+        result = sobject.upsert(
+            "Case_Number__c/%s" % case_number, fields, raw_response=True
+        )
+        if result.status_code == 201:
+            return result.json().get("id")
+
+        # An update answers with no content, so no Id either
+        return sobject.get_by_custom_id("Case_Number__c", case_number)["Id"]
+
+    def _graph_write(self, t, fields, callback):
+        """
+        Add the insert, or upsert, of a new record to self.graph.
+
+        @rtype: String
+        @return: Reference to the new record's Id within the graph
+        """
+        fields = dict(fields)
+        if self.upsert:
+            case_number = fields.pop("Case_Number__c")
+            return self.graph.add(
+                "PATCH",
+                "sobjects/%s/Case_Number__c/%s" % (t.table_name, case_number),
+                fields, callback=callback
+            )
+
+        return self.graph.add(
+            "POST", "sobjects/%s" % t.table_name, fields, callback=callback
+        )
+
+    def _create_attachment(self, attachment):
+        """
+        Insert an Attachment, streaming its body into the request.
+
+        simple_salesforce would need the whole record, base64 body included,
+        as one dict. Instead the JSON document is generated piece by piece so
+        only one encoded chunk of the body is in memory at a time.
+
+        INTERNAL USE ONLY - HERE BE DRAGONS!
+
+        @type attachment: Attachment
+        @param attachment: The attachment to insert
+
+        @rtype: dict
+        @return: salesforce's response, including the new id
+        """
+        fields = attachment.as_dict()
+        if "BodyLength" in fields:
+            fields.pop("BodyLength", None)
+
+        def document():
+            # base64 never needs escaping inside a JSON string
+            yield '%s, "Body": "' % json.dumps(fields)[:-1]
+            for chunk in attachment.iter_body():
+                yield chunk
+            yield '"}'
+
+        result = send_with_backoff(lambda: self.sf.request.post(
+            "%ssobjects/Attachment/" % self.sf.base_url,
+            headers=self.sf.headers,
+            data=document(),
+        ))
+        if result.status_code >= 300:
+            self.log.error("Attachment insert failed: %s" % result.text)
+        result.raise_for_status()
+
+        return result.json()
+
     def _results_to_childs(self, results):
         """
         Convert salesforce Child results into a list of Child objects.
@@ -167,18 +592,296 @@ class Salesforce(object):
             )
 
         # Start with Children
-        children = all_of_them.get_children()
-        for child in children:
-            # We do not save the return value as it
-            # is not needed for anything here.
-            self.add_or_update_child(child)
+        self.add_children(all_of_them.iter_children())
 
         # Finish with SiblingGroups
-        sgroups = all_of_them.get_siblings()
-        for sgroup in sgroups:
-            # We do not save the return value as it
-            # is not needed for anything here.
-            self.add_or_update_sibling_group(sgroup)
+        self.add_sibling_groups(all_of_them.iter_siblings())
+
+    def _enable_bulk(self):
+        """Write children and sibling groups with Bulk API jobs from now on."""
+        self.bulk_batch_size = int(self.config.get("bulk_batch_size", 5000))
+        # Read once, the jobs run on the pool's threads
+        describe = self._describe_global()
+        self.bulk = dict(
+            (t, BulkWriter(
+                self.sf, t.table_name, self.bulk_batch_size,
+                external_id_field="Case_Number__c", pool=self.pool,
+                budget=self.budget, describe=lambda: describe
+            ))
+            for t in (Child, SiblingGroup)
+        )
+
+    def _check_budget(self, written):
+        """
+        Project the calls the rest of the run makes, and spend fewer if they
+        would not fit in the API budget.
+
+        The projection takes the calls per profile since the budget was last
+        acted on, and as many profiles as were preloaded. A tight budget
+        first switches to bulk mode, then defers the attachments.
+
+        @type written: Integer
+        @param written: Profiles written so far
+        """
+        used, mark = self._budget_mark
+        total = sum(len(records) for records in self.existing.values())
+        expected = 0
+        if written > mark and total > written:
+            expected = (
+                (self.budget.used() - used) * (total - written) /
+                (written - mark)
+            )
+
+        if not self.budget.tight(expected):
+            return
+
+        if not self.bulk:
+            self.log.warn("API budget is tight, switching to bulk mode")
+            self._enable_bulk()
+        elif not self.defer_attachments:
+            self.log.warn(
+                "API budget is tight, leaving attachments for the next run"
+            )
+            self.defer_attachments = True
+        self._budget_mark = (self.budget.used(), written)
+
+    def add_profiles(self, profiles):
+        """
+        Import Child and SiblingGroup objects as they are yielded.
+
+        Profiles are imported batch_size at a time and nothing is held on to
+        once written, so memory stays flat no matter how many profiles the
+        iterable produces. The API budget is checked after every batch.
+        """
+        children = []
+        sgroups = []
+        written = 0
+        for profile in profiles:
+            if type(profile) is Child:
+                children.append(profile)
+            elif type(profile) is SiblingGroup:
+                sgroups.append(profile)
+            else:
+                raise TypeError(
+                    "%s: db.add_profiles can only add Child and "
+                    "SiblingGroup objects to the database." % type(profile)
+                )
+
+            if len(children) + len(sgroups) >= self.batch_size:
+                self._add_batch(children, sgroups)
+                written += len(children) + len(sgroups)
+                children = []
+                sgroups = []
+                self._check_budget(written)
+
+            if self.bulk and sum(
+                len(writer) for writer in self.bulk.values()
+            ) >= self.bulk_batch_size:
+                self._flush_bulk()
+
+        self._add_batch(children, sgroups)
+
+    def _add_batch(self, children, sgroups):
+        """
+        Add or update a batch of profiles, see add_profiles.
+
+        Should the session expire on the way, the batch is written again
+        once logged in again. What went through before is flushed first,
+        so those profiles are found already written.
+        """
+        try:
+            self.add_children(children)
+            self.add_sibling_groups(sgroups)
+        except SalesforceExpiredSession:
+            self._login_again()
+            self.flush()
+            self.add_children(children)
+            self.add_sibling_groups(sgroups)
+
+    def add_children(self, children):
+        """
+        Add or update each Child in a list.
+
+        The existing children are compared to their records as one batch.
+        A child listed twice starts a new batch, so the second sees what
+        the first wrote.
+        """
+        added = []
+        batch = []
+        case_numbers = set()
+        for child in children:
+            case_number = child.get_field("Case_Number__c")
+            if case_number in case_numbers:
+                added.extend(self._add_child_batch(batch))
+                batch = []
+                case_numbers = set()
+            batch.append(child)
+            case_numbers.add(case_number)
+
+        added.extend(self._add_child_batch(batch))
+        return added
+
+    def _add_child_batch(self, children):
+        """Add or update children with distinct case numbers."""
+        prepared = []
+        for child in children:
+            fp = self._fingerprint(Child, child)
+            if not self._unchanged(Child, child, fp):
+                prepared.append((child, fp, self._prepare_child(child)))
+
+        existing = [(c, e) for c, _, e in prepared if e is not None]
+        changes = iter(self.differ.diff(
+            [c.as_dict() for c, _ in existing],
+            [e.as_dict() for _, e in existing]
+        ))
+
+        for c, fp, e in prepared:
+            self._write_prepared_child(
+                c, e, next(changes) if e is not None else None
+            )
+            self._wrote(Child, c, fp)
+
+        return list(children)
+
+    def _fingerprint(self, t, record):
+        """
+        Fingerprint a scraped record, see diff.fingerprint.
+
+        @rtype: String
+        @return: The fingerprint, None for records of another type or
+        without a case number, those are never skipped
+        """
+        if type(record) is not t or not record.get_field("Case_Number__c"):
+            return None
+
+        return fingerprint(record, IGNORED_FIELDS)
+
+    def _fingerprint_key(self, t, case_number):
+        return "%s:%s" % (t.table_name, case_number)
+
+    def _unchanged(self, t, record, fp):
+        """
+        Whether a record is scraped the same as when it was last written.
+
+        An unchanged Child gets the Id it was written with, for its sibling
+        group to refer to.
+        """
+        if not (self.skip_unchanged and fp):
+            return False
+
+        entry = self.fingerprints.get(
+            self._fingerprint_key(t, record.get_field("Case_Number__c"))
+        )
+        if not entry or entry["fingerprint"] != fp:
+            return False
+        if t is Child:
+            if not entry.get("Id"):
+                return False
+            record.update_field("Id", entry["Id"])
+
+        self.log.debug("Unchanged: %s - %s" % (
+            record.get_field("Case_Number__c"), record.get_field("Name")
+        ))
+        return True
+
+    def _wrote(self, t, record, fp):
+        """
+        Keep a written record's fingerprint until the next flush.
+
+        Not while attachments are deferred, the record has to be written
+        again for them.
+        """
+        if fp and not self.defer_attachments:
+            self._written[self._fingerprint_key(
+                t, record.get_field("Case_Number__c")
+            )] = (fp, record)
+
+    def _keep_fingerprints(self):
+        """Store the fingerprints of the records written since last flush."""
+        for key, (fp, record) in self._written.items():
+            rid = record.get_field("Id")
+            self.fingerprints[key] = {
+                "fingerprint": fp,
+                # A reference to a graph's record is no Id
+                "Id": None if is_reference(rid) else rid,
+            }
+        self._written = {}
+
+    def add_sibling_groups(self, sgroups):
+        """Add or update each SiblingGroup in a list."""
+        return [self.add_or_update_sibling_group(sg) for sg in sgroups]
+
+    def _flush_bulk(self):
+        """Run the queued bulk jobs and report the records that failed."""
+        # Children first, sibling groups refer to them
+        for t in (Child, SiblingGroup):
+            if t not in self.bulk:
+                continue
+
+            for operation, fields, error in self.bulk[t].flush():
+                # Written again on the next run
+                self._written.pop(self._fingerprint_key(
+                    t, fields.get("Case_Number__c")
+                ), None)
+                self._forget_contact(fields.get(CONTACT_FIELDS[t]))
+                self.log.error("Bulk %s of %s %s failed: %s" % (
+                    operation, t.table_name, fields.get("Case_Number__c"),
+                    error
+                ))
+                self.report.write(
+                    "===========\n"
+                    "BULK FAILED\n"
+                    "===========\n"
+                )
+                self.report.write("%s %s - %s\n%s\n\n" % (
+                    operation, fields.get("Case_Number__c"),
+                    fields.get("Name"), error
+                ))
+
+    def flush(self):
+        """Write out everything buffered so far."""
+        # Bulk inserts queue the attachments of the new records
+        self._flush_bulk()
+        self._forget_parents(
+            self.attachment_writer.flush() + self.photo_writer.flush()
+        )
+        self._keep_fingerprints()
+        self.report.flush()
+        self.contacts.sync()
+        self.sources.sync()
+        self.fingerprints.sync()
+
+    def _forget_parents(self, failed):
+        """
+        Have the records whose attachments or photo failed written again.
+
+        @type failed: list((String, String, String))
+        @param failed: The parent, JSON and errors of each failed write, see
+        CollectionWriter.flush
+        """
+        parents = set(parent for parent, _, _ in failed if parent)
+        if not parents:
+            return
+
+        for key, (_, record) in self._written.items():
+            if record.get_field("Id") in parents:
+                # Written again on the next run
+                del self._written[key]
+        for parent in parents:
+            self.attachments.forget(parent)
+        self.log.error("Attachments of %s records failed" % len(parents))
+
+    def close(self):
+        """Flush and close the report and indexes."""
+        self.flush()
+        summary = self.budget.summary()
+        self.log.info("API calls:\n%s" % summary)
+        self.report.write("=========\nAPI CALLS\n=========\n%s\n" % summary)
+        self.report.close()
+        self.contacts.close()
+        self.sources.close()
+        self.fingerprints.close()
+        self.pool.close()
 
     def find_by_case_number(self, case_number, t=None, return_fields=[]):
         """
@@ -207,6 +910,28 @@ class Salesforce(object):
         # be used for either Children__c or Sibling_Group__c
         existing_results = AllChildren([], [])
 
+        # Answer from the preloaded records when they hold every field asked
+        # for, there is no need to ask salesforce then
+        types = [t] if t else [Child, SiblingGroup]
+        if all(
+            k in self.existing and
+            self.existing_fields[k].issuperset(return_fields)
+            for k in types
+        ):
+            for k in types:
+                record = self.existing[k].get(case_number)
+                if not record:
+                    continue
+                elif k is Child:
+                    existing_results.add_child(
+                        self._results_to_childs([record])[0]
+                    )
+                else:
+                    existing_results.add_sibling_group(
+                        self._results_to_sibling_groups([record])[0]
+                    )
+            return existing_results
+
         # Type not specified, return both
         if not t:
             children = self.get_children_by(criteria, return_fields)
@@ -214,7 +939,7 @@ class Salesforce(object):
             for child in self._results_to_childs(children):
                 existing_results.add_child(child)
             for sibling in self._results_to_sibling_groups(siblings):
-                existing_results.add_or_update_sibling_group(sibling)
+                existing_results.add_sibling_group(sibling)
         # Return results from Children__c
         elif t == Child:
             children = self.get_children_by(criteria, return_fields)
@@ -240,7 +965,38 @@ class Salesforce(object):
         """
         Add a Child object to the database.
 
-        Doing so may also require adding a Contact object as well.
+        Doing so may also require adding a Contact object as well. A child
+        scraped the same as when last written is skipped.
+        """
+        fp = self._fingerprint(Child, child)
+        if self._unchanged(Child, child, fp):
+            return child
+
+        existing_child = self._prepare_child(child)
+        changes = None
+        if existing_child is not None:
+            changes = self.differ.diff_one(
+                child.as_dict(), existing_child.as_dict()
+            )
+
+        self._write_prepared_child(child, existing_child, changes)
+        self._wrote(Child, child, fp)
+        return child
+
+    def _write_prepared_child(self, child, existing_child, changes):
+        """_write_child, forgetting the child's contact should it fail."""
+        try:
+            self._write_child(child, existing_child, changes)
+        except Exception:
+            self._forget_contact(child.get_field(CONTACT_FIELDS[Child]))
+            raise
+
+    def _prepare_child(self, child):
+        """
+        Look a Child up and fill in its contact and nationality.
+
+        @rtype: Child
+        @return: The existing record, None for a new child
         """
         if type(child) is not Child:
             raise TypeError(
@@ -259,6 +1015,7 @@ class Salesforce(object):
         ))
 
         save_fields = child.get_variable_fields()
+        existing_child = None
 
         # Check for existing with TareId
         existing_tare_id_results = self.find_by_case_number(
@@ -270,7 +1027,7 @@ class Salesforce(object):
         # If a Children__c object exists with the given tare id
         if not existing_tare_id_results.is_empty():
             self.log.debug("TARE Id exists in the database already, updating.")
-            existing_child = existing_tare_id_results.get_children()[0]
+            existing_child = next(existing_tare_id_results.iter_children())
             self.log.debug(
                 "Updating child with Id: %s" % existing_child.get_field("Id")
             )
@@ -294,90 +1051,32 @@ class Salesforce(object):
         # Do our best to turn the Nationality into picklist options
         nationalities = child.get_field("Child_s_Nationality__c")
         if nationalities:
-            picklist = []
-            word = re.compile("\w+")
-            for nationality in nationalities:
-                word_match = word.match(nationality)
-                first_word = (
-                    "Unknown" if not word_match
-                    else word_match.group()
-                )
-                for pick in self.nationalities:
-                    if first_word in pick:
-                        picklist.append(pick)
-            if not picklist:
-                picklist.append("Unknown")
-
-            child.update_field('Child_s_Nationality__c', ";".join(picklist))
-
-        child_id = child.get_field("Id")
-        if child_id:
-            in_db_child = existing_child.as_dict()
-            scraped_dict = child.as_dict()
-            if "Child_Bulletin_Date__c" in scraped_dict:
-                del scraped_dict["Child_Bulletin_Date__c"]
-            if "Child_Bulletin_Date__c" in in_db_child:
-                del in_db_child["Child_Bulletin_Date__c"]
-            null_to_value = {}
-            update_dict = {}
-
-            for k, v in scraped_dict.items():
-                if in_db_child[k] != v:
-                    # Birthday check
-                    if k == "Child_s_Birthdate__c":
-                        # Bday from site
-                        scraped_bday = bday_parse(v)
-                        # Bday currently in the DB
-                        db_bday = bday_parse(in_db_child[k])
-                        # Six months
-                        three_months = relativedelta(months=3)
-                        # Acceptable bounds for a birthdate
-                        lower_bound = db_bday - three_months
-                        upper_bound = db_bday + three_months
-                        # If within range, skip
-                        if lower_bound <= scraped_bday <= upper_bound:
-                            continue
-
-                    update_dict[k] = {
-                        "old": in_db_child[k],
-                        "new": v
-                    }
-                    if in_db_child[k] is None:
-                        null_to_value[k] = v
-
-            keys = update_dict.keys()
-            non_update = (
-                True
-                if "Recruitment_Update__c" in keys and len(keys) == 1
-                else False
+            child.update_field(
+                'Child_s_Nationality__c',
+                self.nationality_matcher.picklist(nationalities)
             )
-            self.log.debug("Non-Update? %s" % non_update)
-            if keys and not non_update:
-                self.log.debug("Keys: %s" % keys)
-                self.report.write(
-                    "============\n"
-                    "UPDATE CHILD\n"
-                    "============\n"
-                )
-                self.report.write(
-                     "%s\n" % child.get_field("Link_to_Child_s_Page__c")
-                )
-                self.report.write("%s - %s\n" % (
-                    child.get_field("Case_Number__c"), child.get_field("Name"))
-                )
-                for k, v in update_dict.items():
-                    if k == "Child_s_Bio__c":
-                        report_str = "%s: Bio has change." % k
-                    else:
-                        report_str = ("%s: %s, %s" % (k, v["old"], v["new"]))
-                    self.report.write("%s\n" % report_str)
-
-                self.report.write("\n")
-
-            if null_to_value.keys():
-                self.sf.Children__c.update(
-                    child.get_field("Id"), null_to_value
-                )
+
+        return existing_child
+
+    def _write_child(self, child, existing_child, changes):
+        """
+        Update or create a prepared Child and add its attachments.
+
+        @type child: Child
+        @param child: The scraped child, see _prepare_child
+
+        @type existing_child: Child
+        @param existing_child: Its record, None for a new child
+
+        @type changes: dict
+        @param changes: The child's changes, see DiffEngine.diff
+        """
+        if existing_child is not None:
+            self._report_update(
+                "UPDATE CHILD", child.get_field("Link_to_Child_s_Page__c"),
+                child.as_dict(), changes, "Child_s_Bio__c"
+            )
+            self._fill_nulls(Child, child.as_dict(), changes)
         else:
             self.report.write(
                 "=========\n"
@@ -389,46 +1088,246 @@ class Salesforce(object):
             self.report.write("%s - %s\n" % (
                 child.get_field("Case_Number__c"), child.get_field("Name"))
             )
-            x = self.sf.Children__c.create(child.as_dict())
             self.report.write("\n")
-            child.update_field("Id", x.get("id"))
+            if self.bulk:
+                # Attachments wait for the Id the bulk insert returns
+                def created(cid):
+                    child.update_field("Id", cid)
+                    self._remember(Child, child.as_dict())
+                    if not self.upsert:
+                        self.attachments.add_parent(cid)
+                    self._add_missing_attachments(
+                        child.get_attachments(), cid,
+                        child.get_field("Name"), Child
+                    )
+
+                queue = (
+                    self.bulk[Child].upsert if self.upsert
+                    else self.bulk[Child].insert
+                )
+                queue(
+                    child.as_dict(), created, child.get_field("Case_Number__c")
+                )
+                return child
+
+            if self.graph is not None:
+                # Sent with the sibling group, meanwhile the Id is a
+                # reference the group and attachments can use
+                def created(cid):
+                    child.update_field("Id", cid)
+                    self._remember(Child, child.as_dict())
 
-        # Add attachments and give the attachment's the Child object's ID
-        attachments = list(child.get_attachments())
-        in_db_attachments = self._query(
-            "SELECT Id,BodyLength FROM Attachment WHERE ParentId='%s'" %
-            child.get_field("Id")
+                child.update_field(
+                    "Id", self._graph_write(Child, child.as_dict(), created)
+                )
+            elif self.upsert:
+                child.update_field("Id", self._upsert(Child, child.as_dict()))
+            else:
+                x = self._sobject("Children__c").create(child.as_dict())
+                child.update_field("Id", x.get("id"))
+                self.attachments.add_parent(x.get("id"))
+            if self.graph is None:
+                self._remember(Child, child.as_dict())
+
+        self._add_missing_attachments(
+            child.get_attachments(),
+            child.get_field("Id"),
+            child.get_field("Name"),
+            Child,
         )
-        current_body_sizes = [
-            a["BodyLength"] for a in in_db_attachments["records"]
-        ]
 
-        # self.log.info("New:\n%s" % sorted(new_body_sizes))
+        return child
+
+    def _report_update(self, title, link, fields, changes, bio_field):
+        """
+        Write a record's changes to the report.
+
+        @type title: String
+        @param title: UPDATE CHILD or UPDATE SIBLING GROUP
+
+        @type link: String
+        @param link: The profile's page
+
+        @type fields: dict
+        @param fields: The scraped record
+
+        @type changes: dict
+        @param changes: Its changes, see DiffEngine.diff
+
+        @type bio_field: String
+        @param bio_field: Field whose change is reported without the text
+        """
+        keys = changes.keys()
+        # A change of the recruitment update alone is not worth reporting
+        if not keys or keys == ["Recruitment_Update__c"]:
+            return
+
+        self.log.debug("Keys: %s" % keys)
+        rule = "=" * len(title)
+        self.report.write("%s\n%s\n%s\n" % (rule, title, rule))
+        self.report.write("%s\n" % link)
+        self.report.write("%s - %s\n" % (
+            fields.get("Case_Number__c"), fields.get("Name")
+        ))
+        for k, (old, new) in changes.items():
+            if k == bio_field:
+                report_str = "%s: Bio has change." % k
+            else:
+                report_str = "%s: %s, %s" % (k, old, new)
+            self.report.write("%s\n" % report_str)
+
+        self.report.write("\n")
+
+    def _fill_nulls(self, t, fields, changes, extra=None):
+        """
+        Write the changed fields a record had no value for.
+
+        Fields salesforce already has a value for are left be, they are
+        only reported.
+
+        @type t: type
+        @param t: Child or SiblingGroup
+
+        @type fields: dict
+        @param fields: The scraped record, with its Id
+
+        @type changes: dict
+        @param changes: Its changes, see DiffEngine.diff
+
+        @type extra: dict
+        @param extra: Fields written regardless of the changes
+        """
+        null_to_value = dict(extra or {})
+        null_to_value.update(
+            (k, new) for k, (old, new) in changes.items() if old is None
+        )
+        if not null_to_value:
+            return
+
+        rid = fields.get("Id")
+        if self.bulk:
+            self.bulk[t].update(dict(null_to_value, Id=rid))
+        elif self.graph is not None:
+            self.graph.add(
+                "PATCH", "sobjects/%s/%s" % (t.table_name, rid), null_to_value
+            )
+        else:
+            self._sobject(t.table_name).update(rid, null_to_value)
+
+        null_to_value["Case_Number__c"] = fields.get("Case_Number__c")
+        self._remember(t, null_to_value)
+
+    def _add_missing_attachments(self, attachments, sid, name, t):
+        """
+        Add the attachments the Child or SiblingGroup sid does not have yet.
+
+        See add_attachment for the parameters.
+        """
+        if self.defer_attachments:
+            return
+
+        if is_reference(sid):
+            # Created by the graph being built, it has no attachments yet
+            self.add_attachments(attachments, sid, name, t)
+            return
+
+        current = self.attachments.get(sid)
+        current_ids = set(a["Id"] for a in current if a.get("Id"))
+        hashed = []
+        # Attachments uploaded before hashes were recorded in the Description
+        legacy = []
+        for a in current:
+            hashes = parse_hashes(a.get("Description"))
+            if "sha1" in hashes:
+                hashed.append((hashes, a))
+            else:
+                legacy.append(a)
+
+        new_attachments = []
         for attachment in attachments:
-            # Is the attachment going into the db?
-            adding = True
-            bs = None
-            for bs in current_body_sizes:
-                if attachment.get_field("BodyLength") == bs:
-                    # In this instance, more than likely, the attachment
-                    # is already in the database, so we skip it
-                    adding = False
-                    break
+            source = attachment.source_url
+            if source and self.sources.get(source) in current_ids:
+                # Already uploaded from the same source, no need to fetch it
+                continue
+            if not attachment.load_body():
+                continue
+
+            found = self._find_picture(
+                attachment.get_hashes(), attachment.get_field("BodyLength"),
+                hashed
+            )
+            if found is None:
+                # More than likely the same picture, each one only matches
+                # once
+                bs = attachment.get_field("BodyLength")
+                for a in legacy:
+                    if a["BodyLength"] == bs:
+                        legacy.remove(a)
+                        found = a
+                        break
+
+            if found is None:
+                new_attachments.append(attachment)
+                continue
+
+            if source and found.get("Id"):
+                self.sources[source] = found["Id"]
+            attachment.release_body()
+
+        self.add_attachments(new_attachments, sid, name, t)
+        self.log.debug("Queued %s attachments" % len(new_attachments))
+
+    @staticmethod
+    def _find_picture(hashes, length, hashed):
+        """
+        Find an attachment's picture among those of a parent, and take it.
 
-            # Remove already added items
-            if bs and adding:
-                current_body_sizes.remove(bs)
+        The same sha1 is the same file, looked for first. Failing that, a
+        perceptual hash at most AHASH_DISTANCE bits away is the same
+        picture re-encoded, if it is the same size too: a thumbnail hashes
+        like the picture it was made from. The attachment found is removed
+        from hashed, each one only matches once.
 
-            if adding:
-                a = self.add_attachment(
-                    attachment,
-                    child.get_field("Id"),
-                    child.get_field("Name"),
-                    Child,
-                )
-                self.log.debug("Adding attachment: %s" % a)
+        @type hashes: dict
+        @param hashes: The new attachment's hashes, see parse_hashes
 
-        return child
+        @type length: Integer
+        @param length: The new attachment's BodyLength
+
+        @type hashed: list((dict, dict))
+        @param hashed: Hashes and fields of the parent's attachments
+
+        @rtype: dict
+        @return: Fields of the matching attachment, or None
+        """
+        def same_size(current, fields):
+            if hashes.get("size") and current.get("size"):
+                return hashes["size"] == current["size"]
+            # Uploaded before sizes were recorded. A thumbnail is a fraction
+            # of the picture's length, a re-encoding about the same.
+            lengths = (length or 0, fields.get("BodyLength") or 0)
+            return max(lengths) <= 2 * min(lengths)
+
+        found = None
+        if hashes.get("sha1"):
+            for entry in hashed:
+                if entry[0].get("sha1") == hashes["sha1"]:
+                    found = entry
+                    break
+
+        if found is None and hashes.get("ahash"):
+            for entry in hashed:
+                current, fields = entry
+                if current.get("ahash") and hash_distance(
+                    hashes["ahash"], current["ahash"]
+                ) <= AHASH_DISTANCE and same_size(current, fields):
+                    found = entry
+                    break
+
+        if found is None:
+            return None
+        hashed.remove(found)
+        return found[1]
 
     def add_attachment(self, attachment, sid, name, t):
         """
@@ -450,37 +1349,92 @@ class Salesforce(object):
         @return: Attachment ID
         """
         self.log.info("Adding attachment")
+        if not attachment.load_body():
+            return None
         # Add the ParentId to the attachment
         attachment.update_field("ParentId", sid)
         # Create said attachment
-        attach_dict = attachment.as_dict()
-        del attach_dict["BodyLength"]
-        attached = self.sf.Attachment.create(attach_dict)
+        attached = self._create_attachment(attachment)
 
         # If this is the profile pic on the page, let's add it to the db object
-        if attachment.is_profile:
-            b64_data = attachment.get_field("Body")
-            img = BeautifulSoup('', 'lxml')
-            img_tag = img.new_tag(
-                "img",
-                alt=name,
-                src="data:image/jpeg;base64,%s" % b64_data,
+        if attachment.is_profile and t in PHOTO_FIELDS:
+            self._sobject(t.table_name).update(
+                sid,
+                {PHOTO_FIELDS[t]: self._photo_html(attachment, name)}
             )
-            img.append(img_tag)
-            if t is Child:
-                self.sf.Children__c.update(
-                    sid,
-                    {'Child_s_Photo__c': img.prettify()}
-                )
-            elif t is SiblingGroup:
-                self.sf.Sibling_Group__c.update(
-                    sid,
-                    {'Sibling_Photo__c': img.prettify()}
-                )
 
         # Return the sf results
         return attached
 
+    def _photo_html(self, attachment, name):
+        """The img tag of a profile photo, with the image inlined."""
+        b64_data = attachment.get_field("Body")
+        img = BeautifulSoup('', 'lxml')
+        img_tag = img.new_tag(
+            "img",
+            alt=name,
+            src="data:image/jpeg;base64,%s" % b64_data,
+        )
+        img.append(img_tag)
+        return img.prettify()
+
+    def add_attachments(self, attachments, sid, name, t):
+        """
+        Add several attachments belonging to the same Child or SiblingGroup.
+
+        The attachments and profile photo are queued, and sent through the
+        sObject Collections endpoint along with those of other profiles. In
+        composite mode they are added to the sibling group's graph instead.
+
+        See add_attachment for the parameters.
+        """
+        if self.defer_attachments:
+            return []
+
+        for attachment in attachments:
+            if not attachment.load_body():
+                continue
+
+            attachment.update_field("ParentId", sid)
+            fields = attachment.as_dict()
+            indexed = fields.copy()
+            fields.pop("BodyLength", None)
+            saved = self._attachment_saved(
+                sid, attachment.source_url, indexed
+            )
+            if self.graph is not None:
+                self.graph.add(
+                    "POST", "sobjects/Attachment", fields, attachment, saved
+                )
+            else:
+                self.attachment_writer.add(
+                    "Attachment", fields, attachment, saved, parent=sid
+                )
+
+            if not (attachment.is_profile and t in PHOTO_FIELDS):
+                continue
+
+            photo = {PHOTO_FIELDS[t]: self._photo_html(attachment, name)}
+            if self.graph is not None:
+                self.graph.add(
+                    "PATCH", "sobjects/%s/%s" % (t.table_name, sid), photo
+                )
+            else:
+                self.photo_writer.add(
+                    t.table_name, dict(photo, Id=sid), parent=sid
+                )
+
+        return []
+
+    def _attachment_saved(self, sid, source, indexed):
+        """Callback indexing an attachment of sid once it is saved."""
+        def saved(aid):
+            indexed["Id"] = aid
+            self.attachments.add(sid, indexed)
+            if source and aid:
+                self.sources[source] = aid
+        return saved
+
     def get_children_by(self, search_criteria, return_fields=[]):
         """
         Simple query result of a Child objects.
@@ -540,7 +1494,14 @@ class Salesforce(object):
         """
         Add a SiblingGroup object to the database.
 
-        Doing so may also require adding a Contact object as well.
+        Doing so may also require adding a Contact object as well. A group
+        scraped the same as when last written, children included, is
+        skipped.
+
+        In composite mode the writes for the group, its children and their
+        attachments are collected into one Composite Graph, sent once they
+        all are known. Should salesforce reject the graph, its requests are
+        sent again one by one.
         """
         if type(sgroup) is not SiblingGroup:
             raise TypeError(
@@ -548,6 +1509,40 @@ class Salesforce(object):
                 "objects to the database as SiblingGroups" % type(sgroup)
             )
 
+        fp = self._fingerprint(SiblingGroup, sgroup)
+        if self._unchanged(SiblingGroup, sgroup, fp):
+            return sgroup
+
+        if not self.composite or self.bulk:
+            try:
+                self._add_or_update_sibling_group(sgroup)
+            except Exception:
+                self._forget_group_contacts(sgroup)
+                raise
+            self._wrote(SiblingGroup, sgroup, fp)
+            return sgroup
+
+        written = dict(self._written)
+        self.graph = CompositeGraph(self.sf)
+        try:
+            self._add_or_update_sibling_group(sgroup)
+            graph = self.graph
+        finally:
+            self.graph = None
+
+        try:
+            graph.send()
+        except Exception:
+            # None of the group's children were written either
+            self._written = written
+            self._forget_group_contacts(sgroup)
+            raise
+
+        self._wrote(SiblingGroup, sgroup, fp)
+        return sgroup
+
+    def _add_or_update_sibling_group(self, sgroup):
+        """Write a SiblingGroup, see add_or_update_sibling_group."""
         self.log.info("%s - %s" % (
             sgroup.get_field("Case_Number__c"), sgroup.get_field("Name")
         ))
@@ -568,13 +1563,26 @@ class Salesforce(object):
         children = sgroup.get_children()
         c_names = [x.get_field("Name") for x in children]
         children_references = {}
+        referenced_children = {}
         for num, child in enumerate(children):
             names = list(c_names)
             names.remove(child.get_field("Name"))
             child.update_field("Child_s_Siblings__c", ", ".join(names))
             added_child = self.add_or_update_child(child)
             cid = added_child.get_field("Id")
+            if not cid and self.upsert:
+                # Queued for a bulk upsert, refer to it by its case number
+                relationship = (reference_str % (num + 1))[:-1] + "r"
+                children_references[relationship] = {
+                    "Case_Number__c": added_child.get_field("Case_Number__c")
+                }
+                continue
+            elif not cid and self.bulk:
+                # Queued for a bulk insert, the Id is read from the Child
+                # when the sibling group's own job runs
+                cid = added_child
             children_references[reference_str % int(int(num) + 1)] = cid
+            referenced_children[reference_str % int(int(num) + 1)] = child
 
         scraped_dict.update(children_references)
 
@@ -588,63 +1596,26 @@ class Salesforce(object):
         # Are we updating or creating?
         if not existing_tare_id_results.is_empty():
             self.log.debug("TARE Id exists in the database already, updating.")
-            existing_group = existing_tare_id_results.get_siblings()[0]
+            existing_group = next(existing_tare_id_results.iter_siblings())
             gr_id = existing_group.get_field("Id")
             self.log.debug("Updating sibling group with Id: %s" % gr_id)
             scraped_dict.update({"Id": gr_id})
 
         if scraped_dict.get("Id"):
-            in_db_group = existing_group.as_dict()
-            if "Child_Bulletin_Date__c" in scraped_dict:
-                del scraped_dict["Child_Bulletin_Date__c"]
-            if "Child_Bulletin_Date__c" in in_db_group:
-                del in_db_group["Child_Bulletin_Date__c"]
-            null_to_value = {}
-            update_dict = {}
-
-            for k, v in scraped_dict.items():
-                if in_db_group[k] != v:
-                    update_dict[k] = {
-                        "old": in_db_group[k],
-                        "new": v
-                    }
-                    if in_db_group[k] is None:
-                        null_to_value[k] = v
-
-            keys = update_dict.keys()
-            non_update = (
-                True
-                if "Recruitment_Update__c" in keys and len(keys) == 1
-                else False
+            # A child new to salesforce, the group has to point at it
+            references = dict(
+                (k, v) for k, v in scraped_dict.items() if k.endswith("__r")
             )
-            self.log.debug("Non-Update? %s" % non_update)
-            if keys and not non_update:
-                self.log.debug("Keys: %s" % keys)
-                self.report.write(
-                    "====================\n"
-                    "UPDATE SIBLING GROUP\n"
-                    "====================\n"
-                )
-                self.report.write(
-                     "%s\n" % scraped_dict.get("Children_s_Webpage__c")
-                )
-                self.report.write("%s - %s\n" % (
-                    scraped_dict.get("Case_Number__c"),
-                    scraped_dict.get("Name")
-                ))
-                for k, v in update_dict.items():
-                    if k == "Children_s_Bio__c":
-                        report_str = "%s: Bio has change." % k
-                    else:
-                        report_str = ("%s: %s, %s" % (k, v["old"], v["new"]))
-                    self.report.write("%s\n" % report_str)
-
-                self.report.write("\n")
-
-            if null_to_value.keys():
-                self.sf.Sibling_Group__c.update(
-                    scraped_dict.get("Id"), null_to_value
-                )
+            compared = dict(
+                (k, v) for k, v in scraped_dict.items() if k not in references
+            )
+            changes = self.differ.diff_one(compared, existing_group.as_dict())
+            self._report_update(
+                "UPDATE SIBLING GROUP",
+                scraped_dict.get("Children_s_Webpage__c"), scraped_dict,
+                changes, "Children_s_Bio__c"
+            )
+            self._fill_nulls(SiblingGroup, scraped_dict, changes, references)
         else:
             self.report.write(
                 "=================\n"
@@ -657,43 +1628,59 @@ class Salesforce(object):
             self.report.write("%s - %s\n" % (
                 scraped_dict.get("Case_Number__c"), scraped_dict.get("Name"))
             )
-            x = self.sf.Sibling_Group__c.create(scraped_dict)
-            scraped_dict.update({"Id": x.get("id")})
-
-        # Add attachments and give the attachment's the Child object's ID
-        attachments = list(sgroup.get_attachments())
-        in_db_attachments = self._query(
-            "SELECT Id,BodyLength FROM Attachment WHERE ParentId='%s'" %
-            scraped_dict["Id"]
-        )
-        current_body_sizes = [
-            a["BodyLength"] for a in in_db_attachments["records"]
-        ]
-
-        # self.log.info("New:\n%s" % sorted(new_body_sizes))
-        for attachment in attachments:
-            # Is the attachment going into the db?
-            adding = True
-            bs = None
-            for bs in current_body_sizes:
-                if attachment.get_field("BodyLength") == bs:
-                    # In this instance, more than likely, the attachment
-                    # is already in the database, so we skip it
-                    adding = False
-                    break
-
-            # Remove already added items
-            if bs and adding:
-                current_body_sizes.remove(bs)
+            if self.bulk:
+                # Attachments wait for the Id the bulk insert returns
+                def created(gid):
+                    scraped_dict.update({"Id": gid})
+                    sgroup.update_field("Id", gid)
+                    self._remember(SiblingGroup, scraped_dict)
+                    if not self.upsert:
+                        self.attachments.add_parent(gid)
+                    self._add_missing_attachments(
+                        sgroup.get_attachments(), gid,
+                        scraped_dict.get("Name"), SiblingGroup
+                    )
 
-            if adding:
-                a = self.add_attachment(
-                    attachment,
-                    scraped_dict.get("Id"),
-                    scraped_dict.get("Name"),
-                    SiblingGroup,
+                queue = (
+                    self.bulk[SiblingGroup].upsert if self.upsert
+                    else self.bulk[SiblingGroup].insert
+                )
+                queue(
+                    scraped_dict, created, scraped_dict.get("Case_Number__c")
                 )
-                self.log.debug("Adding attachment: %s" % a)
+                return sgroup
+
+            if self.graph is not None:
+                def created(gid):
+                    # The children have their Ids by now
+                    scraped_dict.update(
+                        (k, c.get_field("Id"))
+                        for k, c in referenced_children.items()
+                    )
+                    scraped_dict.update({"Id": gid})
+                    sgroup.update_field("Id", gid)
+                    self._remember(SiblingGroup, scraped_dict)
+
+                gid = self._graph_write(SiblingGroup, scraped_dict, created)
+            elif self.upsert:
+                gid = self._upsert(SiblingGroup, scraped_dict)
+            else:
+                gid = self._sobject("Sibling_Group__c").create(
+                    scraped_dict
+                ).get("id")
+                self.attachments.add_parent(gid)
+            scraped_dict.update({"Id": gid})
+            if self.graph is None:
+                self._remember(SiblingGroup, scraped_dict)
+
+        # Kept with the group's fingerprint, see _keep_fingerprints
+        sgroup.update_field("Id", scraped_dict.get("Id"))
+        self._add_missing_attachments(
+            sgroup.get_attachments(),
+            scraped_dict.get("Id"),
+            scraped_dict.get("Name"),
+            SiblingGroup,
+        )
 
         return sgroup
 
@@ -762,29 +1749,20 @@ class Salesforce(object):
             )
         self.log.debug("add_contact: %s" % contact.name())
         contact.update_field("AccountId", self.config['contact_account'])
-        returned = self.sf.Contact.create(contact.as_dict()).get("id")
+        returned = self._sobject("Contact").create(contact.as_dict()).get("id")
         contact.update_field("Id", returned)
         return contact
 
-    def get_contact(self, contact, create=False):
-        """Find and return a list of similar contacts, create if missing."""
-        query = """
-            SELECT Id,%(fields)s FROM Contact
-            WHERE (%(name)s) AND (%(mailing)s)
+    def _contact_criteria(self, contact):
         """
+        Build the where clauses get_contact matches similar contacts with.
 
-        # Fields to return from the query along with the Id
-        fields = {
-            'MailingStreet': '',
-            'MailingCity': '',
-            'MailingState': '',
-            'MailingPostalCode': '',
-            'FirstName': [],
-            'LastName': '',
-            'Phone': '',
-            # 'Email': '',
-        }
+        @type contact: Contact
+        @param contact: The contact to find
 
+        @rtype: dict
+        @return: SOQL conditions keyed by the field they compare
+        """
         # Fields for comparison
         where_fields = {
             "FirstName": '',
@@ -792,9 +1770,10 @@ class Salesforce(object):
             "MailingPostalCode": '',
             "MailingStreet": '',
             "MailingCity": '',
+            "MailingState": '',
         }
 
-        for field in fields:
+        for field in where_fields.keys():
             data = contact.get_field(field)
             self.log.debug("Field Data: %s" % data)
             # Handle first names
@@ -802,34 +1781,70 @@ class Salesforce(object):
                 # First Name to search
                 fname = data.strip()
                 if fname.startswith("bob"):
-                    fields["FirstName"].append('bob')
-                    fields["FirstName"].append('r')
+                    starts = ['bob', 'r']
                 elif fname.startswith('rob'):
-                    fields["FirstName"].append('rob')
-                    fields["FirstName"].append('b')
+                    starts = ['rob', 'b']
                 elif fname.startswith('will'):
-                    fields["FirstName"].append('will')
-                    fields["FirstName"].append('b')
+                    starts = ['will', 'b']
                 elif fname.startswith('bill'):
-                    fields["FirstName"].append('bill')
-                    fields["FirstName"].append('w')
+                    starts = ['bill', 'w']
                 else:
-                    fields["FirstName"].append(fname[0])
+                    starts = [fname[0]]
 
-                where = ["FirstName LIKE '%s%%'" % x for x in fields[field]]
+                where = ["FirstName LIKE '%s%%'" % x for x in starts]
                 where_fields["FirstName"] = " OR ".join(where)
             elif field == "LastName":
-                # Store the data in the fields (probably not necessary)
-                fields[field] = data
                 # Only use the first 4 letters of the last name
-                where = "%s = '%s'" % (field, fields[field][0:4])
-                where_fields["LastName"] = where
+                where_fields["LastName"] = "%s = '%s'" % (field, data[0:4])
             else:
-                fields[field] = data
-                where = "%s = '%s'" % (field, fields[field])
-                where_fields[field] = where
+                where_fields[field] = "%s = '%s'" % (field, data)
+
+        return where_fields
+
+    def get_contact(self, contact, create=False):
+        """
+        Find and return a list of similar contacts, create if missing.
+
+        Contacts found or created are remembered by the conditions they were
+        matched with, in memory and in the contacts index, so a caseworker
+        shared by many profiles is only looked up once. They are looked up
+        again after contact_ttl hours, or once a write referring to them
+        failed, see _forget_contact.
+        """
+        query = """
+            SELECT Id,%(fields)s FROM Contact
+            WHERE (%(name)s) AND (%(mailing)s)
+        """
+
+        # Fields to return from the query along with the Id
+        fields = [
+            'MailingStreet',
+            'MailingCity',
+            'MailingState',
+            'MailingPostalCode',
+            'FirstName',
+            'LastName',
+            'Phone',
+            # 'Email',
+        ]
 
-        select_fields = ",".join(fields.keys())
+        where_fields = self._contact_criteria(contact)
+
+        # The conditions themselves are the blocking key
+        key = self._contact_key(where_fields)
+        known = self.contacts.get(key)
+        # Entries of older runs were bare lists, with no time to go by
+        if (
+            isinstance(known, dict) and
+            time.time() - known["fetched"] < self.contact_ttl
+        ):
+            self.log.debug("Known contact: %s" % contact.name())
+            results = self._results_to_contacts(known["records"])
+            for result in results:
+                self._contact_keys[result.get_field("Id")] = key
+            return results
+
+        select_fields = ",".join(fields)
         fname = where_fields["FirstName"]
 
         mailing_list = []
@@ -850,10 +1865,51 @@ class Salesforce(object):
 
         if (not results) and create:
             self.log.debug("Creating contact")
-            results = self.add_contact(contact)
+            results = [self.add_contact(contact)]
 
         # FIXME: Only handling the one most likely. This may need to change.
         if results:
-            return [results] if not type(results) == list else results
+            self.contacts[key] = {"fetched": time.time(), "records": [
+                dict(
+                    (k, v) for k, v in result.iter_fields()
+                    if k != "attributes"
+                )
+                for result in results
+            ]}
+            for result in results:
+                self._contact_keys[result.get_field("Id")] = key
+            return results
         else:
+            if key in self.contacts:
+                del self.contacts[key]
             return []
+
+    @staticmethod
+    def _contact_key(where_fields):
+        """The contacts index key of get_contact's conditions."""
+        return "\n".join(where_fields[k] for k in sorted(where_fields))
+
+    def _forget_contact(self, contact):
+        """
+        Drop the cached lookup that found a contact.
+
+        Called when a write referring to the contact failed, it may have
+        been deleted or merged in salesforce since it was cached.
+
+        @type contact: Contact or String
+        @param contact: The scraped contact, or the Id get_contact returned
+        """
+        if type(contact) is Contact:
+            key = self._contact_key(self._contact_criteria(contact))
+        else:
+            key = self._contact_keys.pop(contact, None)
+
+        if key is not None and key in self.contacts:
+            self.log.debug("Forgetting contact %s" % contact)
+            del self.contacts[key]
+
+    def _forget_group_contacts(self, sgroup):
+        """Forget the contacts of a SiblingGroup whose write failed."""
+        self._forget_contact(sgroup.get_field(CONTACT_FIELDS[SiblingGroup]))
+        for child in sgroup.get_children():
+            self._forget_contact(child.get_field(CONTACT_FIELDS[Child]))
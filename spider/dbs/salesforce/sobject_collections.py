@@ -0,0 +1,206 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""sObject Collections writes for the Salesforce plugin."""
+
+import json
+
+from twisted.logger import Logger
+
+from pool import RETRIES, WriterPool, backoff, is_retryable, send_with_backoff
+
+
+# Records per sObject Collections request, as many as salesforce allows
+COLLECTION_SIZE = 200
+
+# JSON bytes per request, comfortably below salesforce's request size limit
+COLLECTION_BYTES = 32 * 1024 * 1024
+
+
+class CollectionWriter(object):
+    """
+    Records of any sObject type, sent COLLECTION_SIZE at a time.
+
+    Records are queued with add and sent once a request's worth has been
+    queued, or on flush. Attachment bodies are streamed into the request
+    from their spooled files, as _create_attachment does for a single one.
+
+    Full requests are sent by the pool while more records are queued, and
+    records salesforce was too busy to save are sent again.
+
+    @type sf: simple_salesforce.Salesforce
+    @param sf: Logged in salesforce instance, API version 42.0 or later
+
+    @type method: String
+    @param method: POST to insert the records, PATCH to update them
+
+    @type pool: WriterPool
+    @param pool: Sends the requests
+    """
+
+    log = Logger()
+
+    def __init__(self, sf, method, size=COLLECTION_SIZE,
+                 max_bytes=COLLECTION_BYTES, pool=None):
+        self.sf = sf
+        self.method = method
+        self.size = size
+        self.max_bytes = max_bytes
+        self.pool = pool or WriterPool()
+        # (JSON of the fields, Attachment or None, callback, parent) for each
+        # record
+        self.queued = []
+        self.queued_bytes = 0
+        # Requests sent since the last flush
+        self._sending = []
+
+    def __len__(self):
+        return len(self.queued)
+
+    def add(self, object_type, fields, attachment=None, callback=None,
+            parent=None):
+        """
+        Queue a record, sending the queue first if it would not fit.
+
+        @type object_type: String
+        @param object_type: sObject of the record, e.g. Attachment
+
+        @type fields: dict
+        @param fields: The record's fields, with its Id when updating
+
+        @type attachment: Attachment
+        @param attachment: Attachment whose Body goes with the fields
+
+        @type callback: callable
+        @param callback: Called with the record's Id once written
+
+        @type parent: String
+        @param parent: Id of the record this one belongs to, reported along
+        with the record should it fail, see flush
+        """
+        document = json.dumps(dict(fields, attributes={"type": object_type}))
+        size = len(document)
+        if attachment is not None:
+            size += (attachment.get_field("BodyLength") or 0) * 4 / 3
+
+        if self.queued and (
+            len(self.queued) >= self.size or
+            self.queued_bytes + size > self.max_bytes
+        ):
+            self._send_queued()
+
+        self.queued.append((document, attachment, callback, parent))
+        self.queued_bytes += size
+
+    def _send_queued(self):
+        """Hand the queued records to the pool."""
+        queued, self.queued = self.queued, []
+        self.queued_bytes = 0
+        if queued:
+            self._sending.append(self.pool.submit(self._send, queued))
+
+    def flush(self):
+        """
+        Send everything queued and wait for the requests sent so far.
+
+        @rtype: list((String, String, String))
+        @return: The parent, JSON and errors of every record that failed
+        """
+        self._send_queued()
+        sending, self._sending = self._sending, []
+
+        failed = []
+        for task in sending:
+            failed.extend(task.result())
+        return failed
+
+    def _send(self, queued):
+        """
+        Send records, again for those salesforce was too busy to save.
+
+        The failures are logged.
+        """
+        for attempt in xrange(RETRIES + 1):
+            failed, busy = self._request(queued)
+            if not busy:
+                break
+            if attempt == RETRIES:
+                failed.extend(
+                    (entry[3], entry[0], entry[4]) for entry in busy
+                )
+                break
+
+            self.log.warn("Sending %s busy records again" % len(busy))
+            backoff(attempt)
+            queued = [entry[:4] for entry in busy]
+
+        for _, fields, errors in failed:
+            self.log.error("Failed to save %s: %s" % (fields[:200], errors))
+        return failed
+
+    def _request(self, queued):
+        """
+        Send records in one request.
+
+        @rtype: (list, list)
+        @return: The parent, JSON and errors of the records that failed, and
+        the queued entries, with their errors, salesforce was too busy to
+        save
+        """
+        def document():
+            yield '{"allOrNone": false, "records": ['
+            for i, (fields, attachment, _, _) in enumerate(queued):
+                if i:
+                    yield ", "
+                if attachment is None:
+                    yield fields
+                    continue
+
+                # base64 never needs escaping inside a JSON string
+                yield '%s, "Body": "' % fields[:-1]
+                for chunk in attachment.iter_body():
+                    yield chunk
+                yield '"}'
+            yield "]}"
+
+        result = send_with_backoff(lambda: self.sf.request.request(
+            self.method,
+            "%scomposite/sobjects" % self.sf.base_url,
+            headers=self.sf.headers,
+            data=document(),
+        ))
+        if result.status_code >= 300:
+            self.log.error("sObject Collections %s of %s failed: %s" % (
+                self.method, len(queued), result.text
+            ))
+            return [
+                (parent, fields, result.text)
+                for fields, _, _, parent in queued
+            ], []
+
+        failed = []
+        busy = []
+        for (fields, attachment, callback, parent), saved in zip(
+            queued, result.json()
+        ):
+            errors = saved.get("errors")
+            if saved.get("success"):
+                if callback:
+                    callback(saved.get("id"))
+            elif is_retryable(errors):
+                busy.append((fields, attachment, callback, parent, errors))
+            else:
+                failed.append((parent, fields, errors))
+
+        return failed, busy
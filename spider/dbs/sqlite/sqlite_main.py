@@ -0,0 +1,422 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""SQLite plugin for AFFEC Spider."""
+
+import json
+import sqlite3
+
+from twisted.logger import Logger
+from zope.interface import implements
+
+from data_types import Child, Contact, SiblingGroup
+from iplugin import DBPlugin
+
+
+# Children and sibling groups are looked up by case number, or by profile
+# URL when they have none. Contacts are looked up by their blocking key,
+# see blocking_key, and never matched on an empty one. Each field of a
+# record is kept in the fields column as JSON.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS contacts (
+        id INTEGER PRIMARY KEY,
+        blocking_key TEXT NOT NULL,
+        first_name TEXT,
+        last_name TEXT,
+        fields TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS contacts_blocking_key
+        ON contacts (blocking_key);
+
+    CREATE TABLE IF NOT EXISTS sibling_groups (
+        id INTEGER PRIMARY KEY,
+        case_number TEXT,
+        link TEXT,
+        name TEXT,
+        contact_id INTEGER REFERENCES contacts (id),
+        fields TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS sibling_groups_case_number
+        ON sibling_groups (case_number);
+    CREATE INDEX IF NOT EXISTS sibling_groups_link
+        ON sibling_groups (link);
+
+    CREATE TABLE IF NOT EXISTS children (
+        id INTEGER PRIMARY KEY,
+        case_number TEXT,
+        link TEXT,
+        name TEXT,
+        contact_id INTEGER REFERENCES contacts (id),
+        sibling_group_id INTEGER REFERENCES sibling_groups (id),
+        fields TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS children_case_number
+        ON children (case_number);
+    CREATE INDEX IF NOT EXISTS children_link
+        ON children (link);
+
+    CREATE TABLE IF NOT EXISTS attachments (
+        id INTEGER PRIMARY KEY,
+        parent_table TEXT NOT NULL,
+        parent_id INTEGER NOT NULL,
+        name TEXT,
+        sha1 TEXT,
+        description TEXT,
+        source_url TEXT,
+        is_profile INTEGER NOT NULL DEFAULT 0,
+        body BLOB
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS attachments_parent_sha1
+        ON attachments (parent_table, parent_id, sha1);
+    CREATE INDEX IF NOT EXISTS attachments_source_url
+        ON attachments (parent_table, parent_id, source_url);
+"""
+
+# Table, profile URL field and contact field of each type of record
+TABLES = {
+    Child: ("children", "Link_to_Child_s_Page__c", "Case_Worker_Contact__c"),
+    SiblingGroup: (
+        "sibling_groups", "Children_s_Webpage__c", "Caseworker__c"
+    ),
+}
+
+
+def blocking_key(contact):
+    """
+    The key similar contacts share.
+
+    Like the Salesforce plugin's contact criteria, contacts with the same
+    first initial, first four letters of the last name and mailing street,
+    city, state and postal code are taken for the same person.
+
+    @type contact: Contact
+    @param contact: The contact
+
+    @rtype: String
+    @return: The key, empty when a part of it is missing
+    """
+    def field(name):
+        return (contact.get_field(name) or "").strip().lower()
+
+    parts = (
+        field("FirstName")[:1],
+        field("LastName")[:4],
+        field("MailingStreet"),
+        field("MailingCity"),
+        field("MailingState"),
+        field("MailingPostalCode"),
+    )
+    # Contacts missing a part would all share a key, and be merged
+    if not all(parts):
+        return ""
+    return "|".join(parts)
+
+
+class SQLite(object):
+    """
+    SQLite plugin for AFFEC Spider.
+
+    Writes children, sibling groups, contacts and attachments to a local
+    database file. Writes are grouped into transactions of batch_size
+    records, committed by flush and close.
+    """
+
+    # Let the plugin loader know this is a Database Plugin
+    # and thus guarantee an interface
+    implements(DBPlugin)
+
+    log = Logger()
+
+    settings_name = "SQLite"
+
+    def __init__(self, config):
+        """
+        Open, and create if need be, the database.
+
+        @type config: dict
+        @param config: The [[SQLite]] section of the config
+        """
+        self.config = config
+        self.path = config.get("path") or "spider.sqlite3"
+        self.batch_size = int(config.get("batch_size", 500))
+        self.log.info("Opening %s" % self.path)
+
+        self.db = sqlite3.connect(self.path)
+        self.db.text_factory = unicode
+        # The database is a scratch copy, rebuilt by scraping again should
+        # a crash corrupt it
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+        # Records written since the last commit
+        self._pending = 0
+
+    def _wrote(self, count=1):
+        """Commit once batch_size records are written since the last one."""
+        self._pending += count
+        if self._pending >= self.batch_size:
+            self.db.commit()
+            self._pending = 0
+
+    def add_profiles(self, profiles):
+        """Add or update every Child and SiblingGroup as it is yielded."""
+        for profile in profiles:
+            if type(profile) is Child:
+                self.add_or_update_child(profile)
+            elif type(profile) is SiblingGroup:
+                self.add_or_update_sibling_group(profile)
+            else:
+                raise TypeError(
+                    "%s: db.add_profiles can only add Child and "
+                    "SiblingGroup objects to the database." % type(profile)
+                )
+
+    def add_children(self, children):
+        """Add or update each Child in a list."""
+        return [self.add_or_update_child(child) for child in children]
+
+    def add_sibling_groups(self, sgroups):
+        """Add or update each SiblingGroup in a list."""
+        return [
+            self.add_or_update_sibling_group(sgroup) for sgroup in sgroups
+        ]
+
+    def flush(self):
+        """Commit everything written so far."""
+        self.db.commit()
+        self._pending = 0
+
+    def close(self):
+        """Commit and close the database."""
+        self.flush()
+        self.db.close()
+
+    def _find(self, t, record):
+        """
+        Look up the row of a Child or SiblingGroup.
+
+        @rtype: Integer
+        @return: The row's id, None for a new record
+        """
+        table, link_field, _ = TABLES[t]
+        for column, field in (
+            ("case_number", "Case_Number__c"), ("link", link_field)
+        ):
+            value = record.get_field(field)
+            if value:
+                row = self.db.execute(
+                    "SELECT id FROM %s WHERE %s = ?" % (table, column),
+                    (value,)
+                ).fetchone()
+                return row[0] if row else None
+
+        return None
+
+    def _save(self, t, record):
+        """
+        Insert or update the row of a Child or SiblingGroup.
+
+        Its contact is looked up, and added when missing, first.
+
+        @rtype: Integer
+        @return: The row's id
+        """
+        table, link_field, contact_field = TABLES[t]
+
+        contact_id = None
+        contact = record.get_field(contact_field)
+        if type(contact) is Contact:
+            contact_id = self.get_contact(contact, create=True)[0].get_field(
+                "Id"
+            )
+
+        fields = dict(
+            (k, v) for k, v in record.iter_fields() if k != "Id"
+        )
+        fields[contact_field] = contact_id
+        row = (
+            record.get_field("Case_Number__c") or None,
+            record.get_field(link_field) or None,
+            record.get_field("Name"),
+            contact_id,
+            json.dumps(fields, sort_keys=True, default=unicode),
+        )
+
+        rid = self._find(t, record)
+        if rid is None:
+            rid = self.db.execute(
+                "INSERT INTO %s (case_number, link, name, contact_id, fields)"
+                " VALUES (?, ?, ?, ?, ?)" % table, row
+            ).lastrowid
+        else:
+            self.db.execute(
+                "UPDATE %s SET case_number = ?, link = ?, name = ?,"
+                " contact_id = ?, fields = ? WHERE id = ?" % table,
+                row + (rid,)
+            )
+
+        record.update_field("Id", rid)
+        self.add_attachments(
+            record.get_attachments(), rid, record.get_field("Name"), t
+        )
+        self._wrote()
+        return rid
+
+    def add_or_update_child(self, child):
+        """Add or update a Child, its contact and attachments."""
+        if type(child) is not Child:
+            raise TypeError(
+                "%s != Child: Can only add Child "
+                "objects to the database as Child objects" % type(child)
+            )
+
+        self._save(Child, child)
+        return child
+
+    def add_or_update_sibling_group(self, sgroup):
+        """Add or update a SiblingGroup, its children and contact."""
+        if type(sgroup) is not SiblingGroup:
+            raise TypeError(
+                "%s != SiblingGroup: Can only add SiblingGroup "
+                "objects to the database as SiblingGroups" % type(sgroup)
+            )
+
+        child_ids = [
+            self._save(Child, child) for child in sgroup.get_children()
+        ]
+        sid = self._save(SiblingGroup, sgroup)
+        self.db.executemany(
+            "UPDATE children SET sibling_group_id = ? WHERE id = ?",
+            [(sid, cid) for cid in child_ids]
+        )
+        return sgroup
+
+    def get_children_count(self):
+        """Return the number of Child objects in the database."""
+        return self.db.execute("SELECT COUNT(*) FROM children").fetchone()[0]
+
+    def get_sibling_group_count(self):
+        """Return the number of SiblingGroup objects in the database."""
+        return self.db.execute(
+            "SELECT COUNT(*) FROM sibling_groups"
+        ).fetchone()[0]
+
+    def add_contact(self, contact):
+        """Add a Contact object to the database."""
+        if type(contact) is not Contact:
+            raise TypeError(
+                "add_contact requires a Contact object as an argument"
+            )
+
+        fields = dict((k, v) for k, v in contact.iter_fields() if k != "Id")
+        cid = self.db.execute(
+            "INSERT INTO contacts (blocking_key, first_name, last_name,"
+            " fields) VALUES (?, ?, ?, ?)", (
+                blocking_key(contact),
+                contact.get_field("FirstName"),
+                contact.get_field("LastName"),
+                json.dumps(fields, sort_keys=True, default=unicode),
+            )
+        ).lastrowid
+        contact.update_field("Id", cid)
+        self._wrote()
+        return contact
+
+    def get_contact(self, contact, create=False):
+        """Find the contacts sharing a blocking key, create if missing."""
+        results = []
+        key = blocking_key(contact)
+        rows = self.db.execute(
+            "SELECT id, fields FROM contacts WHERE blocking_key = ?", (key,)
+        ) if key else ()
+        for cid, fields in rows:
+            found = Contact()
+            found.update_fields(json.loads(fields))
+            found.update_field("Id", cid)
+            results.append(found)
+
+        if not results and create:
+            results = [self.add_contact(contact)]
+
+        return results
+
+    def add_attachment(self, attachment, sid, name, t):
+        """
+        Add an attachment, unless its parent already has it.
+
+        See add_attachments for the parameters.
+
+        @rtype: Integer
+        @return: Id of the attachment's row, None if it has no body
+        """
+        table = TABLES[t][0]
+
+        # Lazy attachments already stored are never downloaded again
+        if attachment.source_url and self.db.execute(
+            "SELECT 1 FROM attachments WHERE parent_table = ?"
+            " AND parent_id = ? AND source_url = ?",
+            (table, sid, attachment.source_url)
+        ).fetchone():
+            return None
+
+        if not attachment.load_body():
+            self.log.debug("No body for an attachment of %s" % name)
+            return None
+
+        attachment.update_field("ParentId", sid)
+        body = "".join(attachment.iter_body(encoded=False))
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO attachments (parent_table, parent_id,"
+            " name, sha1, description, source_url, is_profile, body)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (
+                table,
+                sid,
+                attachment.get_field("Name"),
+                attachment.get_hashes().get("sha1"),
+                attachment.get_field("Description"),
+                attachment.source_url,
+                attachment.is_profile,
+                sqlite3.Binary(body),
+            )
+        )
+        attachment.release_body()
+        # Nothing is inserted for a body the parent already has
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def add_attachments(self, attachments, sid, name, t):
+        """
+        Add the attachments of a Child or SiblingGroup.
+
+        @type attachments: list(Attachment)
+        @param attachments: The attachments to insert
+
+        @type sid: Integer
+        @param sid: Id of the Child's or SiblingGroup's row
+
+        @type name: String
+        @param name: Name field of the Child or SiblingGroup
+
+        @type t: type
+        @param t: Child or SiblingGroup
+
+        @rtype: list(Integer)
+        @return: Ids of the rows added
+        """
+        ids = []
+        for attachment in attachments:
+            aid = self.add_attachment(attachment, sid, name, t)
+            if aid:
+                ids.append(aid)
+
+        return ids
@@ -13,6 +13,8 @@
 #  limitations under the License.
 
 """Helper/Misc functions and the like to make life easier for everyone."""
+from collections import OrderedDict
+
 from twisted.logger import Logger
 
 log = Logger()
@@ -40,3 +42,38 @@ def return_type(t):
             return result
         return wrapped_f
     return wrap
+
+
+class LRUCache(object):
+    """
+    A bounded mapping forgetting the least recently used entries first.
+
+    @type size: Integer
+    @param size: Maximum number of entries kept
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        """Return the value of key, marking it as most recently used."""
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
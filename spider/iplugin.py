@@ -61,6 +61,17 @@ class SitePlugin(Interface):
         @return: All children and sibling groups discovered on the site
         """
 
+    def iter_profiles():
+        """
+        Yield every Child and SiblingGroup found, one at a time.
+
+        Unlike get_all, profiles are yielded as soon as they are parsed so
+        they can be imported while the rest of the site is still scraped.
+
+        @rtype: generator(Child or SiblingGroup)
+        @return: Children and sibling groups discovered on the site
+        """
+
     def get_child_by_id(cid):
         """
         Find a child by it's given external id.
@@ -104,6 +115,59 @@ class DBPlugin(Interface):
         same name as the plugin.
     """)
 
+    def add_profiles(profiles):
+        """
+        Add or update every Child and SiblingGroup of an iterable.
+
+        The iterable is consumed lazily, so a SitePlugin.iter_profiles
+        generator can be passed straight in.
+
+        @type profiles: iterable(Child or SiblingGroup)
+        @param profiles: Children and sibling groups to add to the database
+        """
+
+    def add_children(children):
+        """
+        Add or update many Child objects at once.
+
+        Backends may group the writes into bulk calls, in which case they
+        may not reach the database until flush() is called.
+
+        @type children: list(Child)
+        @param children: Child objects to add to the database
+
+        @rtype: list(Child)
+        @returns: The children passed in
+        """
+
+    def add_sibling_groups(sgroups):
+        """
+        Add or update many SiblingGroup objects at once.
+
+        Same as add_children, but for sibling groups.
+
+        @type sgroups: list(SiblingGroup)
+        @param sgroups: Sibling groups to add to the database
+
+        @rtype: list(SiblingGroup)
+        @returns: The sibling groups passed in
+        """
+
+    def flush():
+        """
+        Write out anything the plugin has buffered.
+
+        Called by the spider after each site has been imported.
+        """
+
+    def close():
+        """
+        Flush and release any resources held by the plugin.
+
+        Called by the spider once all sites have been imported. The plugin
+        is not used afterwards.
+        """
+
     def add_or_update_child(child):
         """
         Add or update a child object to/in the database.
@@ -167,6 +231,26 @@ class DBPlugin(Interface):
         @return: Attachment ID
         """
 
+    def add_attachments(attachments, id, name, t):
+        """
+        Add many attachment objects sharing the same parent at once.
+
+        @type attachments: list(Attachment)
+        @param attachments: The attachments to Insert
+
+        @type id: String
+        @param id: Id to associate with the attachments
+
+        @type name: String
+        @param name: Name field of the Child or SiblingGroup
+
+        @type t: type
+        @param t: Child or SiblingGroup
+
+        @rtype: list
+        @return: Attachment IDs, or an empty list if they were buffered
+        """
+
     def get_contact(contact, create=False):
         """
         Lookup a contact with similar data to the contact parameter.
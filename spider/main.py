@@ -14,9 +14,8 @@
 
 """Main module to get things fired up and running."""
 
+import argparse
 import os
-from itertools import imap
-import string
 import sys
 
 from configobj import ConfigObj, ConfigObjError
@@ -26,6 +25,7 @@ from twisted.logger import (
 )
 
 from plugin import load_database_plugin, load_site_plugins
+from staging import StagingReader, StagingWriter
 
 
 log = Logger()
@@ -73,42 +73,115 @@ def import_data(plugins):
     @type plugins: dict
     @param pluigns: {
         'sites': [SitePluigin,],
-        'database': DBPlugin
+        'database': DBPlugin, or StagingWriter to stage the profiles
     }
     """
     log.info("Begin parsing and importing data from sites.")
-    # For each site listed in the config
-    for site in plugins['sites']:
-        # grab all chilrden and sibling groups
-        first_name_starts = [
-            "%s%s" % (x, y)
-            for x in string.ascii_lowercase for y in string.ascii_lowercase
-        ]
+    db = plugins["database"]
+    try:
+        # For each site listed in the config
+        for site in plugins['sites']:
+            # stream all children and sibling groups into the database as
+            # they are scraped
+            log.info("db plugin: add_profiles.")
+            db.add_profiles(site.iter_profiles())
+            # and make sure anything buffered is written out
+            db.flush()
+    finally:
+        db.close()
+
+
+def load_staged(db, reader):
+    """
+    Load the staged profiles into the given database.
+
+    Each segment is flushed once loaded and remembered as loaded by the
+    database's settings_name, so a load that fails picks up again from the
+    segment it failed on.
+
+    @type db: DBPlugin
+    @param db: The database to load into
+
+    @type reader: StagingReader
+    @param reader: The staging directory to load from
+    """
+    loaded = reader.loaded(db.settings_name)
+    try:
+        for segment in reader.segments():
+            if segment in loaded:
+                continue
+            log.info("Loading staged profiles from %s" % segment)
+            db.add_profiles(reader.iter_profiles(segment))
+            db.flush()
+            reader.mark_loaded(db.settings_name, segment)
+    finally:
+        db.close()
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line.
 
-        for ac in imap(site.search_profiles, first_name_starts):
-            log.debug(unicode(ac))
+    @type argv: list(String)
+    @param argv: The arguments, sys.argv[1:] by default
 
-            log.info("db plugin: add_allchildren.")
-            # and import the data
-            plugins["database"].add_all(ac)
+    @rtype: argparse.Namespace
+    @return: The command, config path and staging directory
+    """
+    parser = argparse.ArgumentParser(
+        description="Import children and sibling groups from sites."
+    )
+    parser.add_argument(
+        "command", nargs="?", default="run",
+        choices=("run", "scrape", "load"),
+        help=(
+            "run scrapes straight into the database (default), scrape "
+            "stages the profiles to the staging directory and load loads "
+            "them into the database once the scrape is over"
+        )
+    )
+    parser.add_argument(
+        "-c", "--config", default=None,
+        help="path to the config, ./config.ini by default"
+    )
+    parser.add_argument(
+        "-s", "--staging", default=None,
+        help="staging directory, overrides path in [staging]"
+    )
+
+    return parser.parse_args(argv)
 
 
-def main(config_path=None):
+def main(argv=None):
     """
     main.
 
-    @type config_path: String
-    @param config_path: optional alternative path to a config file
+    @type argv: list(String)
+    @param argv: The command line arguments, see parse_args
     """
     log.debug("Welcome to the jungle!")
+    args = parse_args(argv)
 
     try:
-        cfg = load_config(config_path) if config_path else load_config()
+        cfg = load_config(args.config) if args.config else load_config()
     except ConfigObjError, e:
         log.failure(str(e))
 
+    staging = cfg.get("staging", {})
+    staging_path = args.staging or staging.get("path") or "staging"
+
+    if args.command == "load":
+        db_plugin = load_database_plugin(cfg['database'])
+        load_staged(db_plugin, StagingReader(staging_path))
+        return
+
     site_plugins = load_site_plugins(cfg['sites'])
-    db_plugin = load_database_plugin(cfg['database'])
+    if args.command == "scrape":
+        db_plugin = StagingWriter(
+            staging_path, int(staging.get("segment_size", 500))
+        )
+    else:
+        db_plugin = load_database_plugin(cfg['database'])
     plugins = {
         'sites': site_plugins,
         'database': db_plugin
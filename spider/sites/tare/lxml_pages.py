@@ -0,0 +1,176 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+lxml backend for parsing TARE profile pages.
+
+The CSS selectors of soup_pages, compiled once to XPath. Each page is
+parsed into a single lxml.html tree which the child, contact and attachment
+extractors all walk.
+"""
+
+from lxml import etree, html
+
+
+def _has_class(name):
+    """XPath predicate equivalent to the CSS .name class selector."""
+    return "contains(concat(' ', normalize-space(@class), ' '), ' %s ')" % (
+        name
+    )
+
+
+GALLERY_IMAGE = _has_class("galleryImage")
+IMAGE_LIGHTBOX = _has_class("imageLightbox")
+
+DESCENDANT_DIVS = etree.XPath(".//div")
+CHILD_DIVS = etree.XPath("./div")
+GALLERY_LINKS = etree.XPath(".//a[%s]" % IMAGE_LIGHTBOX)
+GROUP_HEADERS = etree.XPath(".//div[%s]" % _has_class("groupHeader"))
+GROUP_BODIES = etree.XPath(".//div[%s]" % _has_class("groupBody"))
+
+# soup_pages.CHILD_SELECTORS and CHILD_ATTACHMENT_SELECTORS
+CHILD_XPATHS = {
+    "Case_Number__c": etree.XPath(
+        "//div[@id='pageContent']/div/div/div[2]/span"
+    ),
+    # Field divs next to the "Name" label
+    "fields": etree.XPath("(//span[.='Name'])[1]/../../div"),
+    "contact_fields": etree.XPath("//fieldset/div"),
+    "information": etree.XPath("//div[@id='#Information']"),
+    "profile_picture": etree.XPath(
+        "//div[@id='#Information']/div[%s]/a[%s]" % (
+            GALLERY_IMAGE, IMAGE_LIGHTBOX
+        )
+    ),
+    "other_pictures": etree.XPath("//div[@id='contentGallery']"),
+}
+
+# soup_pages.SGROUP_SELECTORS, GROUP_ATTACHMENT_SELECTORS and friends
+GROUP_XPATHS = {
+    "Name": etree.XPath("//div/div[2]/a"),
+    "Case_Number__c": etree.XPath(
+        "//div[@id='pageContent']/div/div[6]/div[2]"
+    ),
+    # Links in the element following ALL_CHILDREN_SELECTOR
+    "children": etree.XPath(
+        "(//div[@id='pageContent']/div/div[%s])[1]"
+        "/following-sibling::*[1]//a" % GALLERY_IMAGE
+    ),
+    "case_worker": etree.XPath(
+        "(//span[.='TARE Coordinator'])[1]/../../.."
+    ),
+    # CSS div:nth-of-type(2) below a node
+    "second_div": etree.XPath(".//div[2]"),
+    "profile_picture": etree.XPath(
+        "//div[@id='pageContent']/div/div[%s]/a[%s]" % (
+            GALLERY_IMAGE, IMAGE_LIGHTBOX
+        )
+    ),
+    "other_pictures": etree.XPath("//div[@id='contentGallery']/div"),
+}
+
+
+# One parser per page encoding
+_PARSERS = {}
+
+
+def _first(elements):
+    """First element of an XPath result, or None."""
+    return elements[0] if elements else None
+
+
+class LxmlPage(object):
+    """A TARE page parsed with lxml."""
+
+    def __init__(self, response):
+        # Decode with the same encoding requests uses for response.text
+        encoding = response.encoding or "utf-8"
+        parser = _PARSERS.get(encoding)
+        if parser is None:
+            parser = _PARSERS[encoding] = html.HTMLParser(encoding=encoding)
+
+        self.tree = html.fromstring(response.content, parser=parser)
+
+    def text(self, node):
+        """Stripped text of a node and everything below it."""
+        return node.text_content().strip()
+
+    def descendant_divs(self, node):
+        """All divs below node."""
+        return DESCENDANT_DIVS(node)
+
+    def direct_divs(self, node):
+        """The divs directly below node."""
+        return CHILD_DIVS(node)
+
+    def bio_sections(self, node=None):
+        """(header, body) texts of the groupHeader/groupBody divs."""
+        node = self.tree if node is None else node
+        return [
+            (self.text(header), self.text(body))
+            for header, body in zip(GROUP_HEADERS(node), GROUP_BODIES(node))
+        ]
+
+    def _attachment_hrefs(self, xpaths):
+        profile = _first(xpaths["profile_picture"](self.tree))
+        profile_href = profile.get("href") if profile is not None else None
+
+        urls = []
+        gallery = _first(xpaths["other_pictures"](self.tree))
+        if gallery is not None:
+            for tag in GALLERY_LINKS(gallery):
+                if tag.get("href"):
+                    urls.append(tag.get("href"))
+
+        return profile_href, urls
+
+
+class LxmlChildPage(LxmlPage):
+    """A TARE child profile parsed with lxml."""
+
+    def case_number(self):
+        return self.text(CHILD_XPATHS["Case_Number__c"](self.tree)[0])
+
+    def field_nodes(self):
+        return CHILD_XPATHS["fields"](self.tree)
+
+    def contact_nodes(self):
+        return CHILD_XPATHS["contact_fields"](self.tree)
+
+    def child_bio_sections(self):
+        information = _first(CHILD_XPATHS["information"](self.tree))
+        return self.bio_sections(information)
+
+    def attachment_hrefs(self):
+        return self._attachment_hrefs(CHILD_XPATHS)
+
+
+class LxmlGroupPage(LxmlPage):
+    """A TARE sibling group profile parsed with lxml."""
+
+    def select_text(self, field):
+        node = _first(GROUP_XPATHS[field](self.tree))
+        return self.text(node) if node is not None else ""
+
+    def child_links(self):
+        return [a.get("href") for a in GROUP_XPATHS["children"](self.tree)]
+
+    def case_worker_block(self):
+        return _first(GROUP_XPATHS["case_worker"](self.tree))
+
+    def second_div_text(self, node):
+        return self.text(GROUP_XPATHS["second_div"](node)[0])
+
+    def attachment_hrefs(self):
+        return self._attachment_hrefs(GROUP_XPATHS)
@@ -13,38 +13,23 @@
 #  limitations under the License.
 
 """Tare helper functions to parse children pages."""
-import random
 import re
 
-from bs4 import BeautifulSoup
 from twisted.logger import Logger
 
 from data_types import Child, Contact
 from helpers import return_type
-from utils import (
-    create_attachment, get_birthdate, get_pictures_encoded, parse_name
-)
+from lxml_pages import LxmlChildPage
+from soup_pages import SoupChildPage
+from utils import build_attachments, get_birthdate, parse_name, walk_fields
 from validators import dict_of_validators as validators
 
 log = Logger()
 
-# These are the magic phrases that get the data from a TARE profile page
-# They also happen to represent some, if not all of the fields to be updated
-CHILD_SELECTORS = {
-    "Name": (
-        "div##Information > div:nth-of-type(2) > div:nth-of-type(2) > "
-        "span:nth-of-type(1)"
-    ),
-    "Child_s_Birthdate__c": (
-        "div##Information > div > div > div:nth-of-type(2) > "
-        "span:nth-of-type(1)"
-    ),
-    "Case_Number__c": (
-        "div#pageContent > div > div > div:nth-of-type(2) > span"
-    ),
-    "District__c": (
-        "div##Information > div > div > div:nth-of-type(2) > span"
-    ),
+# Page parsing backends, chosen by the Tare `parser` config option
+PAGES = {
+    "bs4": SoupChildPage,
+    "lxml": LxmlChildPage,
 }
 
 CONTACT_SELECTORS = {
@@ -54,37 +39,25 @@ CONTACT_SELECTORS = {
     "Phone Number": "Phone"
 }
 
-ATTACHMENT_SELECTORS = {
-    "profile_picture": "div##Information > div.galleryImage > a.imageLightbox",
-    "other_pictures": "div#contentGallery",
-}
-
 
 @return_type(Child)
-def parse_child_info(link, soup):
+def parse_child_info(link, page):
     """
-    Parse Child data from a swirl of soup.
+    Parse Child data from a parsed profile page.
 
-    @type soup: BeautifulSoup data
-    @param soup: Chunk of a webpage containing the child info.
+    @type page: SoupChildPage or LxmlChildPage
+    @param page: The child's profile page.
 
     @rtype: Child
-    @return: Child object filled in with data from the soup.
+    @return: Child object filled in with data from the page.
     """
     child_info = Child()
-    child_fields = list(child_info.get_variable_fields())
 
     # Handle Special Cases
-    try:
-        child_info.update_fields({
-            "Link_to_Child_s_Page__c": link,
-            'Case_Number__c': soup.select(
-                CHILD_SELECTORS['Case_Number__c']
-            )[0].text.strip(),
-        })
-        child_fields.remove('Link_to_Child_s_Page__c')
-    except ValueError:
-        pass
+    child_info.update_fields({
+        "Link_to_Child_s_Page__c": link,
+        'Case_Number__c': page.case_number(),
+    })
 
     tare_provided_fields = {
         "Name": "Name",
@@ -96,19 +69,17 @@ def parse_child_info(link, soup):
         "Primary Language": "Child_s_Primary_Language__c",
     }
 
-    def grab_child_data(current, itr):
-        field = current.text.strip()
-
+    def grab_child_data(field, next_value):
         # Handle special parsing requirements
         if field == "Age":
-            value = get_birthdate(next(itr).text.strip())
+            value = get_birthdate(next_value())
         elif field in ["Ethnicity", "Race"]:
             value = child_info.get_field(tare_provided_fields[field])
-            value.append(next(itr).text.strip())
+            value.append(next_value())
         elif field == "Region":
-            value = "Region: %s" % next(itr).text.strip()
+            value = "Region: %s" % next_value()
         elif field in tare_provided_fields.keys():
-            value = next(itr).text.strip()
+            value = next_value()
         # Short circuit if nothing relavent found
         else:
             return None
@@ -117,28 +88,14 @@ def parse_child_info(link, soup):
         child_info.update_field(tare_provided_fields[field], value)
 
     log.debug("Begin Child Fields")
-    fields = iter(soup.find("span", text="Name").parent.parent.select("> div"))
-    for field in fields:
-        # Only one div should be proccessed,
-        # if multiple exist, let's break it down
-        rabbit_hole = field.select("div")
-        fs = iter(rabbit_hole)
-        # Given sub-fields, lets check them
-        if len(rabbit_hole):
-            for rabbit_itr in fs:
-                grab_child_data(rabbit_itr, fs)
-        else:
-            grab_child_data(field, fields)
+    walk_fields(page, page.field_nodes(), grab_child_data)
 
     # Grab the Bio
     bio = ""
-    info = soup.select_one("div##Information")
-    headers = info.find_all("div", class_="groupHeader")
-    bodies = info.find_all("div", class_="groupBody")
 
     # Add all the headers and bodies to the bio
-    for header, body in zip(headers, bodies):
-        bio += "%s\n%s\n\n" % (header.text.strip(), body.text.strip())
+    for header, body in page.child_bio_sections():
+        bio += "%s\n%s\n\n" % (header, body)
 
     # Update siblings' bio
     child_info.update_field("Child_s_Bio__c", bio.strip())
@@ -148,15 +105,15 @@ def parse_child_info(link, soup):
 
 
 @return_type(Contact)
-def parse_contact_info(soup):
+def parse_contact_info(page):
     """
-    Parse Contact data from a swirl of soup.
+    Parse Contact data from a parsed profile page.
 
-    @type soup: BeautifulSoup data
-    @param soup: Chunk of a webpage containing the contact info.
+    @type page: SoupChildPage or LxmlChildPage
+    @param page: The child's profile page.
 
     @rtype: Contact
-    @return: Contact object filled in with data from the soup.
+    @return: Contact object filled in with data from the page.
     """
     contact_info = Contact()
 
@@ -167,73 +124,42 @@ def parse_contact_info(soup):
         "Email Address": "Email",
     }
 
-    def grab_contact_data(current, itr):
-        field = current.text.strip()
-
+    def grab_contact_data(field, next_value):
         # Handle special parsing requirements
         if field == "Name":
             contact_info.update_fields(
-                parse_name(next(itr).text.strip())
+                parse_name(next_value())
             )
         elif field == "Phone":
             contact_info.update_field(
                 tare_provided_fields[field],
-                validators["phone"](next(iter).text.strip())
+                validators["phone"](next_value())
             )
         elif field == "Address":
             cleaned_re = re.compile("\s+")
-            info = cleaned_re.sub(" ", next(itr).text.strip())
+            info = cleaned_re.sub(" ", next_value())
             try:
                 address = validators["address"](info.strip())
-                str_types = [str, unicode]
                 address_fields = {
-                    "MailingStreet": (
-                        address.street
-                        if type(address.street) in str_types
-                        else " ".join(address.street)
-                    ),
-                    "MailingCity": (
-                        address.city
-                        if type(address.city) in str_types
-                        else " ".join(address.city)
-                    ),
-                    "MailingState": (
-                        address.state
-                        if type(address.state) in str_types
-                        else " ".join(address.state)
-                    ),
-                    "MailingPostalCode": (
-                        address.zip
-                        if type(address.zip) in str_types
-                        else " ".join(address.zip)
-                    ),
+                    "MailingStreet": address.street,
+                    "MailingCity": address.city,
+                    "MailingState": address.state,
+                    "MailingPostalCode": address.zip,
                 }
                 contact_info.update_fields(address_fields)
             except:
                 pass
         elif field in tare_provided_fields.keys():
-            value = next(itr).text.strip()
+            value = next_value()
             contact_info.update_field(tare_provided_fields[field], value)
         # End of grab_contact_data
 
-    cw_soup = iter(soup.select("fieldset > div"))
-
-    for field in cw_soup:
-        # Only one div should be proccessed,
-        # if multiple exist, let's break it down
-        rabbit_hole = field.select("div")
-        fs = iter(rabbit_hole)
-        # Given sub-fields, lets check them
-        if len(rabbit_hole):
-            for rabbit_itr in fs:
-                grab_contact_data(rabbit_itr, fs)
-        else:
-            grab_contact_data(field, cw_soup)
+    walk_fields(page, page.contact_nodes(), grab_contact_data)
 
     return contact_info
 
 
-def parse_attachments(cname, session, souped, base_url):
+def parse_attachments(cname, session, page, base_url):
     """
     Parse attachments and add them to the child object.
 
@@ -243,103 +169,48 @@ def parse_attachments(cname, session, souped, base_url):
     @type session: requests session
     @param session: The "browser" session that has us logged into TARE.
 
-    @type souped: BeautifulSoup data
-    @param soup: Chunk of a webpage containing the contact info.
+    @type page: SoupChildPage or LxmlChildPage
+    @param page: The child's profile page.
 
     @type base_url: String
     @param base_url: The beginning of all TARE urls.
     """
-    # Get the profile picture attachment
-    try:
-        profile_img_tag = souped.select_one(
-            ATTACHMENT_SELECTORS["profile_picture"]
-        )
-        if profile_img_tag.get("href"):
-            profile_image_data = get_pictures_encoded(
-                session, base_url, [profile_img_tag.get("href")], True
-            )
-    except IndexError:
-        profile_image_data = {'full': None, 'thumbnail': None}
-
-    gallery = souped.select_one(ATTACHMENT_SELECTORS.get("other_pictures"))
-    urls = []
-    if gallery:
-        other_img_tags = gallery.find_all("a", class_="imageLightbox")
-        for tag in other_img_tags:
-            if tag.get("href"):
-                urls.append(tag.get("href"))
-
-    # Get other images
-    other_images = get_pictures_encoded(
-        session, base_url, urls, False
-    )
-
-    log.debug(
-        "GRABBED ALL ATTACHMENTS! %s and %s" % (
-            len(profile_image_data), len(other_images)
-        )
-    )
+    profile_href, other_hrefs = page.attachment_hrefs()
 
-    attachments_returned = []
-
-    # Create attachments for the profile and thumbnail of the profile
-    for img in profile_image_data:
-        for k, v in img.items():
-            if v:
-                name = "%s-%s.jpg" % (cname, str(random.randint(100, 999)))
-                attch = create_attachment(v["data"], name)
-                attch.update_field("BodyLength", v["length"])
-                if k == "full":
-                    attch.is_profile = True
-                attachments_returned.append(attch)
-
-    # Create attachments of all other images and append a number to the name
-    for i, img in enumerate(other_images):
-        # For non-Profile pictures, we just want the full image.
-        # thumbnail is None anyway
-        name = "%s-%s.jpg" % (cname, str(random.randint(100, 999)))
-        full = img.get("full")
-        if full:
-            attch = create_attachment(full.get("data"), name)
-            attch.update_field("BodyLength", full.get("length"))
-            attachments_returned.append(attch)
-
-    log.debug("Returning %s attachments for %s" % (
-        len(attachments_returned), cname)
+    return build_attachments(
+        cname, session, base_url, profile_href, other_hrefs
     )
-    return list(attachments_returned)
 
 
 @return_type(Child)
-def gather_profile_details_for(link, session, base_url):
+def gather_profile_details_for(link, session, base_url, parser="bs4"):
     """
     Given a TARE URL, pull the following data about a child.
 
     Photos, Name, TareId, Age (to be converted to a birthdate), others
+
+    The page is parsed once, with the `parser` backend (see PAGES), and
+    shared by the child, contact and attachment parsing.
     """
     log.info("Child:\n%s" % link)
     # Data required to have for a child
 
-    # "Import" the html into BeautifulSoup for easy traversal
     req = session.get(link)
     if "/Application/TARE/Home.aspx/Error" in req.url:
         raise ValueError("TARE Server had an error for link: %s" % link)
     elif "/Application/TARE/Home.aspx/Default" in req.url:
         raise ValueError("TARE redirected away from the url %s" % link)
 
-    # HTML data from the request
-    html_data = req.text
-
     # Parse the html for Child data scraping
-    souped = BeautifulSoup(html_data, 'lxml')
-    child = parse_child_info(link, souped)
+    page = PAGES[parser](req)
+    child = parse_child_info(link, page)
 
-    # Get a smaller soup for the contact data since it's contained in one area
-    contact = parse_contact_info(souped)
+    # The contact data is contained in one area of the same page
+    contact = parse_contact_info(page)
 
     # Get pictures/attachments
     attachments = parse_attachments(
-        child.get_field("Name"), session, souped, base_url
+        child.get_field("Name"), session, page, base_url
     )
     log.debug("Adding %s images to %s from\n\t%s" % (
         len(attachments), child.get_field("Name"), link
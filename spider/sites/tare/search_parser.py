@@ -0,0 +1,127 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Streaming parser for TARE search results pages.
+
+The page is fed to lxml chunk by chunk, as it is downloaded, with a parser
+target instead of a tree: only the a.listLink elements of the
+div#results > ul list are looked at, nothing else of the page is kept.
+"""
+
+from collections import deque
+import re
+
+from lxml import etree
+
+
+# The trailing number of a profile link is its TARE id
+LISTING_ID = re.compile(r"(\d+)\D*$")
+
+
+def listing_type(href):
+    """Return 'child', 'group' or None, going by a profile link."""
+    if "Child.aspx" in href:
+        return "child"
+    elif "Group.aspx" in href:
+        return "group"
+    return None
+
+
+class _ListingTarget(object):
+    """
+    lxml parser target collecting the search results' profile links.
+
+    Listings found are appended to self.listings, which the caller drains
+    after each chunk fed to the parser.
+    """
+
+    def __init__(self):
+        # Open tags, as (tag, id, is the results list) tuples
+        self.stack = []
+        # Number of open div#results > ul elements
+        self.in_results = 0
+        # The listing whose link text is being read, if any
+        self.current = None
+        self.listings = deque()
+
+    def start(self, tag, attrib):
+        parent = self.stack[-1] if self.stack else (None, None, False)
+        is_results = tag == "ul" and parent[:2] == ("div", "results")
+        self.stack.append((tag, attrib.get("id"), is_results))
+        if is_results:
+            self.in_results += 1
+
+        classes = (attrib.get("class") or "").split()
+        if self.in_results and tag == "a" and "listLink" in classes:
+            href = attrib.get("href") or ""
+            match = LISTING_ID.search(href)
+            self.current = {
+                "href": href,
+                "type": listing_type(href),
+                "id": match.group(1) if match else None,
+                "name": [],
+            }
+
+    def data(self, text):
+        if self.current is not None:
+            self.current["name"].append(text)
+
+    def end(self, tag):
+        if not self.stack:
+            return
+
+        closed, _, is_results = self.stack.pop()
+        if is_results:
+            self.in_results -= 1
+
+        if closed == "a" and self.current is not None:
+            self.current["name"] = " ".join(
+                "".join(self.current["name"]).split()
+            )
+            self.listings.append(self.current)
+            self.current = None
+
+    def close(self):
+        return None
+
+
+def iter_search_results(chunks, encoding=None):
+    """
+    Yield the listings of a search results page as it is downloaded.
+
+    @type chunks: iterable(String)
+    @param chunks: The page's raw bytes, e.g. response.iter_content()
+
+    @type encoding: String
+    @param encoding: The page's encoding, if known
+
+    @rtype: generator(dict)
+    @return: One dict per listing with its link (href), name, type
+    ('child', 'group' or None) and TARE id, each yielded as soon as the
+    chunk holding the end of its link has been parsed
+    """
+    target = _ListingTarget()
+    parser = etree.HTMLParser(target=target, encoding=encoding)
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        parser.feed(chunk)
+        while target.listings:
+            yield target.listings.popleft()
+
+    parser.close()
+    while target.listings:
+        yield target.listings.popleft()
@@ -0,0 +1,165 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+BeautifulSoup backend for parsing TARE profile pages.
+
+Each page is parsed into a single soup which the child, contact and
+attachment extractors all walk using the CSS selectors below.
+"""
+
+from bs4 import BeautifulSoup
+
+
+# These are the magic phrases that get the data from a TARE profile page
+# They also happen to represent some, if not all of the fields to be updated
+CHILD_SELECTORS = {
+    "Name": (
+        "div##Information > div:nth-of-type(2) > div:nth-of-type(2) > "
+        "span:nth-of-type(1)"
+    ),
+    "Child_s_Birthdate__c": (
+        "div##Information > div > div > div:nth-of-type(2) > "
+        "span:nth-of-type(1)"
+    ),
+    "Case_Number__c": (
+        "div#pageContent > div > div > div:nth-of-type(2) > span"
+    ),
+    "District__c": (
+        "div##Information > div > div > div:nth-of-type(2) > span"
+    ),
+}
+
+CHILD_ATTACHMENT_SELECTORS = {
+    "profile_picture": "div##Information > div.galleryImage > a.imageLightbox",
+    "other_pictures": "div#contentGallery",
+}
+
+ALL_CHILDREN_SELECTOR = "div#pageContent > div > div.galleryImage"
+CASE_WORKER_SELECTOR = "div#pageContent > div > div:nth-of-type(6)"
+
+SGROUP_SELECTORS = {
+    "Name": (
+        "div > div:nth-of-type(2) > a"
+    ),
+    # TARE Id
+    "Case_Number__c": (
+        "div#pageContent > div > div:nth-of-type(6) > div:nth-of-type(2)"
+    ),
+    "Children_s_Bio__c": [
+        "div#pageContent > div > div:nth-of-type(8)",
+        "div#pageContent > div > div:nth-of-type(9)",
+        "div#pageContent > div > div:nth-of-type(10)",
+        "div#pageContent > div > div:nth-of-type(11)",
+        "div#pageContent > div > div:nth-of-type(12)",
+        "div#pageContent > div > div:nth-of-type(13)",
+    ],
+}
+
+GROUP_ATTACHMENT_SELECTORS = {
+    "profile_picture": (
+        "div#pageContent > div > div.galleryImage > a.imageLightbox"
+    ),
+    "other_pictures": "div#contentGallery > div",
+
+}
+
+
+class SoupPage(object):
+    """A TARE page parsed with BeautifulSoup."""
+
+    def __init__(self, response):
+        self.soup = BeautifulSoup(response.text, 'lxml')
+
+    def text(self, node):
+        """Stripped text of a node and everything below it."""
+        return node.text.strip()
+
+    def descendant_divs(self, node):
+        """All divs below node."""
+        return node.select("div")
+
+    def direct_divs(self, node):
+        """The divs directly below node."""
+        return node.select("> div")
+
+    def bio_sections(self, node=None):
+        """(header, body) texts of the groupHeader/groupBody divs."""
+        node = self.soup if node is None else node
+        headers = node.find_all("div", class_="groupHeader")
+        bodies = node.find_all("div", class_="groupBody")
+        return [
+            (self.text(header), self.text(body))
+            for header, body in zip(headers, bodies)
+        ]
+
+    def _attachment_hrefs(self, selectors):
+        profile = self.soup.select_one(selectors["profile_picture"])
+        profile_href = profile.get("href") if profile else None
+
+        urls = []
+        gallery = self.soup.select_one(selectors["other_pictures"])
+        if gallery:
+            for tag in gallery.find_all("a", class_="imageLightbox"):
+                if tag.get("href"):
+                    urls.append(tag.get("href"))
+
+        return profile_href, urls
+
+
+class SoupChildPage(SoupPage):
+    """A TARE child profile parsed with BeautifulSoup."""
+
+    def case_number(self):
+        return self.text(
+            self.soup.select(CHILD_SELECTORS['Case_Number__c'])[0]
+        )
+
+    def field_nodes(self):
+        name = self.soup.find("span", text="Name")
+        return name.parent.parent.select("> div")
+
+    def contact_nodes(self):
+        return self.soup.select("fieldset > div")
+
+    def child_bio_sections(self):
+        return self.bio_sections(self.soup.select_one("div##Information"))
+
+    def attachment_hrefs(self):
+        return self._attachment_hrefs(CHILD_ATTACHMENT_SELECTORS)
+
+
+class SoupGroupPage(SoupPage):
+    """A TARE sibling group profile parsed with BeautifulSoup."""
+
+    def select_text(self, field):
+        selected = self.soup.select_one(SGROUP_SELECTORS[field])
+        return self.text(selected) if selected else ""
+
+    def child_links(self):
+        children = self.soup.select_one(
+            ALL_CHILDREN_SELECTOR
+        ).find_next_sibling()
+        return [link.get("href") for link in children.select("a")]
+
+    def case_worker_block(self):
+        return self.soup.find(
+            "span", string="TARE Coordinator"
+        ).parent.parent.parent
+
+    def second_div_text(self, node):
+        return self.text(node.select_one("div:nth-of-type(2)"))
+
+    def attachment_hrefs(self):
+        return self._attachment_hrefs(GROUP_ATTACHMENT_SELECTORS)
@@ -18,15 +18,25 @@ import string
 
 from bs4 import BeautifulSoup
 import requests
-from requests.exceptions import HTTPError
+from requests.exceptions import HTTPError, RequestException
 from twisted.logger import Logger
 from zope.interface import implements
 from zope.interface.exceptions import DoesNotImplement
 
-from data_types import AllChildren
+from data_types import AllChildren, SiblingGroup
 from helpers import return_type
 from iplugin import SitePlugin
-from . import only_child_parser, sibling_group_parser
+from . import only_child_parser, search_parser, sibling_group_parser
+
+
+# Searching every two letter name prefix finds every profile on TARE
+FIRST_NAME_STARTS = [
+    "%s%s" % (x, y)
+    for x in string.ascii_lowercase for y in string.ascii_lowercase
+]
+
+# Bytes of a search results page handed to the parser at a time
+SEARCH_CHUNK_SIZE = 8192
 
 
 class TareSite(object):
@@ -72,6 +82,8 @@ class TareSite(object):
         self.log.debug("TARE plugin logging in.")
         # Verify requirements
         self.config = self._check_config(config)
+        # Profile page parsing backend, bs4 or lxml
+        self.parser = self.config.get("parser", "bs4")
         # Initialize our session, this does cookies and things
         self.session = requests.Session()
         # Login!
@@ -104,6 +116,16 @@ class TareSite(object):
                         self.settings_name, key
                     )
                 )
+
+        parser = config.get("parser", "bs4")
+        if parser not in only_child_parser.PAGES:
+            raise Exception(
+                "%s: unknown parser '%s', expected one of %s" % (
+                    self.settings_name, parser,
+                    ", ".join(sorted(only_child_parser.PAGES))
+                )
+            )
+
         return config
 
     @return_type(AllChildren)
@@ -115,21 +137,31 @@ class TareSite(object):
         @return: Returns an AllChildren object of all children and sibling
         groups found on the Tare website.
         """
-        # To gather all Children and Sibling Groups from TARE,
-        # a search of all names is required. So, from aa to zz,
-        # all will be searched.
-        first_name_starts = [
-            "%s%s" % (x, y)
-            for x in string.ascii_lowercase for y in string.ascii_lowercase
-        ]
-#        first_name_starts = ['aa']
         all_children = AllChildren([], [])
-        for fname in first_name_starts:
-            self.log.debug("Searching: %s" % fname)
-            results = self.search_profiles(fname)
-            self.log.debug("Merging: %s" % fname)
+        for profile in self.iter_profiles():
+            if type(profile) is SiblingGroup:
+                all_children.add_sibling_group(profile)
+            else:
+                all_children.add_child(profile)
+
+        return all_children
+
+    def iter_profiles(self):
+        """
+        Yield every Child and SiblingGroup on the tare website.
+
+        To gather all Children and Sibling Groups from TARE, a search of all
+        names is required. So, from aa to zz, all will be searched. A profile
+        turning up in more than one search is only scraped once.
 
-        return all_children.merge(results)
+        @rtype: generator(Child or SiblingGroup)
+        @return: Each profile as soon as it has been parsed
+        """
+        seen = set()
+        for fname in FIRST_NAME_STARTS:
+            self.log.debug("Searching: %s" % fname)
+            for profile in self.iter_search_profiles(fname, seen):
+                yield profile
 
     @return_type(AllChildren)
     def search_profiles(self, search="aa"):
@@ -146,6 +178,32 @@ class TareSite(object):
         # The children and sibling groups to return
         all_children = AllChildren([], [])
 
+        for profile in self.iter_search_profiles(search):
+            if type(profile) is SiblingGroup:
+                all_children.add_sibling_group(profile)
+            else:
+                all_children.add_child(profile)
+
+        # Returned the parsed data
+        self.log.debug("Returning results for: %s" % search)
+        return all_children
+
+    def iter_search_profiles(self, search="aa", seen=None):
+        """
+        Yield the Child and SiblingGroup objects found by a search.
+
+        @type search: String
+        @param search: Name parameter for search
+
+        @type seen: set
+        @param seen: Profile links already scraped, these are skipped. Links
+        scraped by this search are added to it.
+
+        @rtype: generator(Child or SiblingGroup)
+        @return: Each profile found by the search as soon as it is parsed
+        """
+        seen = set() if seen is None else seen
+
         search_post_url = (
             "%s/Application/TARE/Search.aspx/NonMatchingSearchResults" %
             self.base_url
@@ -155,54 +213,46 @@ class TareSite(object):
         self.search_data["Name"] = search
 
         self.log.info("Searching for children starting with %s" % search)
-        req = self.session.post(search_post_url, self.search_data)
-
+        # Streamed into the parser, only the listings are kept. They are all
+        # read before the first profile is scraped, the connection would be
+        # dropped while idle otherwise.
         try:
+            req = self.session.post(
+                search_post_url, self.search_data, stream=True
+            )
             req.raise_for_status()
-        except HTTPError, e:
-            self.log.error("Failed to search for: %s" % search)
-            self.log.failure(e)
-            return all_children
-
-        # Get the results section of the page
-        html = req.text
-        soup = BeautifulSoup(html, "lxml")
-        search_results = soup.select_one("div#results > ul")
-
-        # Grab each result
-        results_soup = BeautifulSoup(str(search_results), "lxml")
-        results = results_soup.select("a.listLink")
+            try:
+                listings = list(search_parser.iter_search_results(
+                    req.iter_content(SEARCH_CHUNK_SIZE), req.encoding
+                ))
+            finally:
+                req.close()
+        except RequestException, e:
+            self.log.error("Failed to search for: %s (%s)" % (search, e))
+            return
 
         # Iterate through the results and grab the link and name
-        for result in results:
+        for listing in listings:
             # Shorten lines up a bit
-            link = "%s%s" % (self.base_url, result.get('href'))
-
-            # If the link contains Child.aspx, it's an only child
-            if "Child.aspx" in link:
-                try:
-                    child = only_child_parser.gather_profile_details_for(
-                        link, self.session, self.base_url
-                    )
-                    all_children.add_child(child)
-                except ValueError, e:
-                    self.log.debug("%s" % e)
-                    continue
-
-            # If the link contains Group.aspx, it's a sibling group
-            elif "Group.aspx" in link:
-                try:
-                    group = sibling_group_parser.gather_profile_details_for(
-                        link, self.session, self.base_url
-                    )
-                    all_children.add_sibling_group(group)
-                except ValueError, e:
-                    self.log.debug("%s" % e)
-                    continue
+            link = "%s%s" % (self.base_url, listing["href"])
+            if link in seen:
+                continue
+            seen.add(link)
+
+            self.log.debug("Found %(type)s %(id)s: %(name)s" % listing)
+            # A Child.aspx link is an only child, Group.aspx a group
+            if listing["type"] == "child":
+                gather = only_child_parser.gather_profile_details_for
+            elif listing["type"] == "group":
+                gather = sibling_group_parser.gather_profile_details_for
+            else:
+                continue
 
-        # Returned the parsed data
-        self.log.debug("Returning results for: %s" % search)
-        return all_children
+            try:
+                yield gather(link, self.session, self.base_url, self.parser)
+            except ValueError, e:
+                self.log.debug("%s" % e)
+                continue
 
     @return_type(AllChildren)
     def search_profiles_old_template(self, search="ad"):
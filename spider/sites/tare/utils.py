@@ -14,12 +14,12 @@
 
 """Utility functions useful to TARE."""
 
-from base64 import b64encode
 from datetime import date
 from StringIO import StringIO
 
 from PIL import Image
 from dateutil.relativedelta import relativedelta
+from requests.exceptions import RequestException
 from twisted.logger import Logger
 
 from data_types import Attachment
@@ -54,6 +54,41 @@ def parse_name(name_copy):
     return info
 
 
+def walk_fields(page, nodes, grab):
+    """
+    Walk the label/value pairs of a TARE profile's field list.
+
+    A field is either a div wrapping label and value divs, or a label div
+    directly followed by its value div.
+
+    @type page: SoupPage or LxmlPage
+    @param page: The parsed page the nodes belong to
+
+    @type nodes: list
+    @param nodes: The field divs
+
+    @type grab: callable
+    @param grab: Called with the text of a label and a function returning
+    the text of the next node, the value. grab only calls it when the label
+    is of interest.
+    """
+    def next_text(itr):
+        return lambda: page.text(next(itr))
+
+    fields = iter(nodes)
+    for field in fields:
+        # Only one div should be proccessed,
+        # if multiple exist, let's break it down
+        rabbit_hole = page.descendant_divs(field)
+        # Given sub-fields, lets check them
+        if len(rabbit_hole):
+            fs = iter(rabbit_hole)
+            for rabbit_itr in fs:
+                grab(page.text(rabbit_itr), next_text(fs))
+        else:
+            grab(page.text(field), next_text(fields))
+
+
 def get_birthdate(age):
     """
     Calculatie child's birthdate.
@@ -68,9 +103,33 @@ def get_birthdate(age):
     return info
 
 
+def average_hash(img):
+    """
+    Perceptual hash of an image, as 16 hex digits.
+
+    Each of the 64 bits tells whether a pixel of the image shrunk to 8x8
+    grayscale is brighter than the mean. Re-encoding or rescaling an image
+    leaves the hash the same, or a few bits off, unlike its sha1.
+
+    @type img: PIL.Image.Image
+    @param img: The image to hash
+
+    @rtype: String
+    @return: The hash
+    """
+    small = img.convert("L").resize((8, 8), Image.ANTIALIAS)
+    pixels = list(small.getdata())
+    mean = sum(pixels) / float(len(pixels))
+    bits = 0
+    for pixel in pixels:
+        bits = (bits << 1) | (pixel > mean)
+
+    return "%016x" % bits
+
+
 def generate_thumbnail(img_data):
     """Create a thumbnail with height 230px."""
-    data = {"data": None, "length": None}
+    data = {"data": None, "length": None, "ahash": None, "size": None}
     try:
         # Create thumbnail of the image using the Pillow package
         img = Image.open(StringIO(img_data))
@@ -91,10 +150,11 @@ def generate_thumbnail(img_data):
         in_memory_save = StringIO()
         thumbnail.save(in_memory_save, format="jpeg")
         in_mem_val = in_memory_save.getvalue()
-        thumbnail_b64 = b64encode(in_mem_val)
         data.update({
-            "data": thumbnail_b64,
-            "length": len(in_mem_val)
+            "data": in_mem_val,
+            "length": len(in_mem_val),
+            "ahash": average_hash(thumbnail),
+            "size": "%sx%s" % thumbnail.size,
         })
     except Exception, e:
         log.debug("%s" % e)
@@ -121,7 +181,9 @@ def scale_portrait(img_data):
             img.save(in_memory_save, format="jpeg")
             in_mem_val = in_memory_save.getvalue()
             data["length"] = len(in_mem_val)
-            data["data"] = b64encode(in_mem_val)
+            data["data"] = in_mem_val
+            data["ahash"] = average_hash(img)
+            data["size"] = "%sx%s" % img.size
             return data
 
         # If wider than tall
@@ -138,40 +200,189 @@ def scale_portrait(img_data):
         in_mem_val = in_memory_save.getvalue()
 
         data["length"] = len(in_mem_val)
-        data["data"] = b64encode(in_mem_val)
+        data["data"] = in_mem_val
+        data["ahash"] = average_hash(scaled)
+        data["size"] = "%sx%s" % scaled.size
         return data
     except Exception, e:
         log.debug("%s" % e)
         return None
 
 
-def get_pictures_encoded(session, base_url, urls, thumbnail=False):
+def get_pictures(session, base_url, urls, thumbnail=False):
     """Pull Profile picture and create thumbnail of it. Height of 230px."""
     data = []
 
     for url in urls:
         img_url = "%s%s" % (base_url, url)
         img_data = session.get(img_url).content
-        img_data_b64 = scale_portrait(img_data)
+        full = scale_portrait(img_data)
 
         # Thumbnail
-        thumbnail_b64 = None if not thumbnail else generate_thumbnail(img_data)
+        thumb = None if not thumbnail else generate_thumbnail(img_data)
 
         data.append({
-            'full': img_data_b64, 'thumbnail': thumbnail_b64
+            'full': full, 'thumbnail': thumb
         })
 
-    # Return a dictionary containing the base64 encoded versions
-    # of the thumbnail and the full image
+    # Return a dictionary containing the raw jpeg data of the
+    # thumbnail and the full image
     return data
 
 
-def create_attachment(b64_data, name):
-    """Create a Salesforce attachment object from a jpeg."""
+def create_attachment(data, name, ahash=None, size=None):
+    """
+    Create a Salesforce attachment object from a jpeg.
+
+    The raw jpeg is spooled to disk by the Attachment rather than being kept
+    in memory for the lifetime of the Child or SiblingGroup holding it.
+
+    @type data: String
+    @param data: The jpeg
+
+    @type name: String
+    @param name: Child or SiblingGroup name, the attachment is named after
+    it and the start of the jpeg's sha1, so the same picture keeps the same
+    name from one run to the next
+
+    @type ahash: String
+    @param ahash: Perceptual hash of the picture, see average_hash
+
+    @type size: String
+    @param size: Width and height of the picture, e.g. "230x300"
+
+    @rtype: Attachment
+    @return: The attachment
+    """
     attachment = Attachment()
-    attachment.update_fields({
-        "Body": b64_data,
-        "Name": name,
-    })
+    _spool_picture(attachment, data, name, ahash, size)
 
     return attachment
+
+
+def _spool_picture(attachment, data, name, ahash, size=None):
+    """Spool a jpeg into an attachment, see create_attachment."""
+    attachment.spool_body(data)
+    attachment.update_field("Name", "%s-%s.jpg" % (
+        name, attachment.get_hashes()["sha1"][:8]
+    ))
+    if ahash:
+        attachment.set_hash("ahash", ahash)
+    if size:
+        attachment.set_hash("size", size)
+
+
+def lazy_attachments(name, session, img_url, thumbnail=False):
+    """
+    Create attachments of a picture that is only downloaded when needed.
+
+    The picture is downloaded once, by the first of the attachments to load
+    its body, and scaled as get_pictures would. It is kept only until the
+    last of them has loaded its body. An attachment whose picture
+    fails to download is left without a body, see Attachment.load_body.
+
+    @type name: String
+    @param name: Child or SiblingGroup name, see create_attachment
+
+    @type session: requests session
+    @param session: The "browser" session that has us logged into TARE.
+
+    @type img_url: String
+    @param img_url: The picture's url
+
+    @type thumbnail: Bool
+    @param thumbnail: Also create an attachment of the picture's thumbnail
+
+    @rtype: list(Attachment)
+    @return: The full picture, then its thumbnail
+    """
+    downloaded = []
+    # Attachments yet to load their body, see Attachment.load_body
+    pending = []
+
+    def download():
+        if not downloaded:
+            response = session.get(img_url)
+            response.raise_for_status()
+            downloaded.append(response.content)
+        return downloaded[0]
+
+    def loader(scale):
+        def load(attachment):
+            try:
+                picture = scale(download())
+            except (RequestException, IOError), e:
+                log.error("Failed to download %s for %s (%s)" % (
+                    img_url, name, e
+                ))
+                return
+            finally:
+                pending.pop()
+                if not pending:
+                    del downloaded[:]
+            if picture and picture["data"]:
+                _spool_picture(
+                    attachment, picture["data"], name, picture.get("ahash"),
+                    picture.get("size")
+                )
+        return load
+
+    variants = [("full", scale_portrait)]
+    if thumbnail:
+        variants.append(("thumbnail", generate_thumbnail))
+
+    attachments = []
+    for variant, scale in variants:
+        attachment = Attachment()
+        attachment.set_loader(
+            "%s#%s" % (img_url, variant), loader(scale)
+        )
+        attachments.append(attachment)
+        pending.append(variant)
+
+    return attachments
+
+
+def build_attachments(name, session, base_url, profile_href, other_hrefs):
+    """
+    Turn a profile's pictures into attachments.
+
+    @type name: String
+    @param name: Child or SiblingGroup name, used to name the attachments
+
+    @type session: requests session
+    @param session: The "browser" session that has us logged into TARE.
+
+    @type base_url: String
+    @param base_url: The beginning of all TARE urls.
+
+    @type profile_href: String
+    @param profile_href: Link to the profile picture, or None
+
+    @type other_hrefs: list(String)
+    @param other_hrefs: Links to the gallery pictures
+
+    @rtype: list(Attachment)
+    @return: The profile picture and its thumbnail, then the gallery. They
+    are lazy, nothing is downloaded until the DB plugin loads their bodies.
+    """
+    attachments_returned = []
+
+    # Create attachments for the profile and thumbnail of the profile
+    if profile_href:
+        profile = lazy_attachments(
+            name, session, "%s%s" % (base_url, profile_href), True
+        )
+        profile[0].is_profile = True
+        attachments_returned.extend(profile)
+
+    # For non-Profile pictures, we just want the full image.
+    for href in other_hrefs:
+        attachments_returned.extend(
+            lazy_attachments(name, session, "%s%s" % (base_url, href))
+        )
+
+    log.debug("Returning %s attachments for %s" % (
+        len(attachments_returned), name)
+    )
+    return attachments_returned
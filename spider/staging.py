@@ -0,0 +1,323 @@
+#  Copyright 2016 A Family For Every Child
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""
+Scraped profiles staged on disk, between the scrape and the load.
+
+A staging directory holds:
+
+    segments/000001.jsonl   One profile per line, appended as scraped
+    segments/000002.jsonl.tmp  The segment being staged, renamed once closed
+    bodies/3f/3f78...       Attachment bodies, named after their sha1
+    loaded.<settings_name>  Segments a DB plugin has loaded, one per line
+"""
+
+import json
+import os
+import tempfile
+
+from twisted.logger import Logger
+
+from data_types import Attachment, Child, Contact, SiblingGroup
+
+
+log = Logger()
+
+# The types of record a segment holds, by name
+TYPES = dict((t.__name__, t) for t in (Child, SiblingGroup, Contact))
+
+
+def encode(value):
+    """Turn a field value into JSON, a Contact becoming a nested record."""
+    if type(value) in TYPES.values():
+        return {"__record__": type(value).__name__, "fields": dict(
+            (k, encode(value.get_field(k)))
+            for k in value.get_variable_fields()
+        )}
+    if isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    return value
+
+
+def decode(value):
+    """Turn a field value read back from JSON into what encode was given."""
+    if isinstance(value, dict) and "__record__" in value:
+        record = TYPES[value["__record__"]]()
+        record.update_fields(
+            (k, decode(v)) for k, v in value["fields"].iteritems()
+        )
+        return record
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    return value
+
+
+def body_path(path, sha1):
+    """Where the body with a sha1 is staged in the directory path."""
+    return os.path.join(path, "bodies", sha1[:2], sha1)
+
+
+class StagingWriter(object):
+    """
+    Stage scraped profiles to a directory.
+
+    Takes the place of the DB plugin during a scrape, see main.scrape.
+    Every profile is appended to the open segment as one line of JSON,
+    flushed as soon as it is written, so a crash loses at most the profile
+    being written. A new segment is started every segment_size profiles,
+    and by every run.
+
+    The open segment is written under a .tmp name and only renamed once it
+    is closed, so a load running alongside the scrape never takes up, and
+    marks loaded, a segment still being written. A segment a crashed run
+    left open is renamed by the next run: its profiles are whole but for
+    the last line at most, which the reader skips.
+
+    Attachment bodies are downloaded and written once per distinct body,
+    so the load never goes back to the site.
+
+    @type path: String
+    @param path: The staging directory, created if need be
+
+    @type segment_size: Integer
+    @param segment_size: Profiles per segment
+    """
+
+    def __init__(self, path, segment_size=500):
+        self.path = path
+        self.segment_size = segment_size
+        for directory in ("segments", "bodies"):
+            if not os.path.isdir(os.path.join(path, directory)):
+                os.makedirs(os.path.join(path, directory))
+
+        directory = os.path.join(path, "segments")
+        numbers = [0]
+        for name in os.listdir(directory):
+            if name.endswith(".jsonl.tmp"):
+                log.warn("Finishing segment %s left open by a crash" % name)
+                os.rename(
+                    os.path.join(directory, name),
+                    os.path.join(directory, name[:-len(".tmp")])
+                )
+            if name.endswith((".jsonl", ".jsonl.tmp")):
+                numbers.append(int(name.split(".")[0]))
+        self._number = max(numbers)
+        self._segment = None
+        self._count = 0
+
+    def add_profiles(self, profiles):
+        """Stage every Child and SiblingGroup as it is yielded."""
+        for profile in profiles:
+            if type(profile) not in (Child, SiblingGroup):
+                raise TypeError(
+                    "%s: Only Child and SiblingGroup objects "
+                    "can be staged." % type(profile)
+                )
+
+            if self._segment is None or self._count >= self.segment_size:
+                self._open_segment()
+
+            self._segment.write(json.dumps(
+                self._document(profile), sort_keys=True, default=unicode
+            ))
+            self._segment.write("\n")
+            self._segment.flush()
+            self._count += 1
+
+    def _open_segment(self):
+        """Close the open segment, if any, and start the next one."""
+        self._close_segment()
+        self._number += 1
+        name = "%06d.jsonl" % self._number
+        log.info("Staging to segment %s" % name)
+        self._segment = open(
+            os.path.join(self.path, "segments", name + ".tmp"), "a"
+        )
+        self._count = 0
+
+    def _close_segment(self):
+        """Close the open segment, if any, and give it its finished name."""
+        if self._segment is not None:
+            os.fsync(self._segment.fileno())
+            self._segment.close()
+            os.rename(self._segment.name, self._segment.name[:-len(".tmp")])
+            self._segment = None
+
+    def _document(self, record):
+        """
+        Turn a Child or SiblingGroup into the dict staged for it.
+
+        @rtype: dict
+        @return: The type, fields and attachments of the record, and the
+        children of a SiblingGroup
+        """
+        document = {
+            "type": type(record).__name__,
+            "fields": encode(record)["fields"],
+            "attachments": [],
+        }
+        for attachment in record.get_attachments():
+            if not attachment.load_body():
+                continue
+
+            sha1 = attachment.get_hashes()["sha1"]
+            self._write_body(sha1, attachment)
+            attachment.release_body()
+            document["attachments"].append({
+                "sha1": sha1,
+                "source_url": attachment.source_url,
+                "is_profile": attachment.is_profile,
+                "fields": dict(
+                    (k, attachment.get_field(k))
+                    for k in attachment.get_variable_fields()
+                ),
+            })
+
+        if type(record) is SiblingGroup:
+            document["children"] = [
+                self._document(child) for child in record.get_children()
+            ]
+
+        return document
+
+    def _write_body(self, sha1, attachment):
+        """Write an attachment's body, unless the same body is staged."""
+        path = body_path(self.path, sha1)
+        if os.path.exists(path):
+            return
+
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Written under a temporary name, so a body file is always whole
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            for chunk in attachment.iter_body(encoded=False):
+                f.write(chunk)
+        os.rename(tmp, path)
+
+    def flush(self):
+        """Make the staged profiles durable."""
+        if self._segment is not None:
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+
+    def close(self):
+        """Close the open segment, the next run starts a new one."""
+        self._close_segment()
+
+
+class StagingReader(object):
+    """
+    Read the profiles staged to a directory back, see StagingWriter.
+
+    @type path: String
+    @param path: The staging directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def segments(self):
+        """
+        The segments staged, oldest first.
+
+        The segment a scrape is still writing is left out, see StagingWriter.
+
+        @rtype: list(String)
+        @return: File names of the segments
+        """
+        directory = os.path.join(self.path, "segments")
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            name for name in os.listdir(directory) if name.endswith(".jsonl")
+        )
+
+    def iter_profiles(self, segment):
+        """
+        Rebuild the profiles of a segment, one at a time.
+
+        Attachments are lazy again, with the fields they were staged with.
+        Their bodies are only read from the staging directory once a DB
+        plugin loads them. A line cut short by a crash while it was written
+        is skipped.
+
+        @type segment: String
+        @param segment: File name of the segment
+
+        @rtype: generator(Child or SiblingGroup)
+        @return: The profiles, in the order they were staged
+        """
+        with open(os.path.join(self.path, "segments", segment)) as f:
+            for line in f:
+                try:
+                    document = json.loads(line)
+                except ValueError:
+                    log.warn("Skipping a partly staged profile in %s" % (
+                        segment
+                    ))
+                    continue
+                yield self._record(document)
+
+    def _record(self, document):
+        """Turn a staged dict back into a Child or SiblingGroup."""
+        record = TYPES[document["type"]]()
+        record.update_fields(
+            (k, decode(v)) for k, v in document["fields"].iteritems()
+        )
+
+        for staged in document["attachments"]:
+            attachment = Attachment()
+            attachment.is_profile = staged["is_profile"]
+            attachment.update_fields(staged["fields"])
+            attachment.set_loader(
+                staged["source_url"], self._loader(staged["sha1"])
+            )
+            record.add_attachment(attachment)
+
+        for child in document.get("children", ()):
+            record.add_child(self._record(child))
+
+        return record
+
+    def _loader(self, sha1):
+        def load(attachment):
+            with open(body_path(self.path, sha1), "rb") as f:
+                attachment.spool_body(f.read())
+        return load
+
+    def loaded(self, name):
+        """
+        The segments a DB plugin has loaded.
+
+        @type name: String
+        @param name: The plugin's settings_name
+
+        @rtype: set(String)
+        @return: File names of the segments
+        """
+        path = os.path.join(self.path, "loaded.%s" % name)
+        if not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            return set(line.strip() for line in f if line.strip())
+
+    def mark_loaded(self, name, segment):
+        """Remember a DB plugin has loaded a segment, see loaded."""
+        with open(os.path.join(self.path, "loaded.%s" % name), "a") as f:
+            f.write("%s\n" % segment)
+            f.flush()
+            os.fsync(f.fileno())
@@ -15,10 +15,13 @@
 
 """Data validators."""
 
+from collections import namedtuple
 import re
 
 from twisted.logger import Logger
 
+from helpers import LRUCache
+
 log = Logger()
 
 
@@ -51,36 +54,80 @@ def valid_phone(number):
     return None
 
 
-def valid_address(addr):
-    """Address validator/parser."""
-    # Sanitize-ish
-    multispace = re.compile("\s+")
-    addr = multispace.sub(" ", addr)
-
-    addr_split = [
-        x for x in addr.title().split(" ") if x not in ["", '', None]
-    ]
-
-    sane_addr = []
-    for w in addr_split:
-        if len(w) == 2:
-            w = w.upper()
-
-        if w not in ["N", "S", "E", "W", "NW", "NE", "SW", "SE"]:
-            sane_addr.append(w)
-        else:
-            sane_addr.append(w)
-
-    addr = " ".join(sane_addr)
+# Two letter state abbreviations
+STATES_ABBR = (
+    "AL AK AZ AR CA CO CT DE FL GA HI ID IL IN IA KS KY LA ME MD MA MI MN "
+    "MS MO MT NE NV NH NJ NM NY NC ND OH OK OR PA RI SC SD TN TX UT VT VA "
+    "WA WV WI WY"
+).split()
+
+STATE_NAMES = [
+    "Alabama", "Alaska", "Arizona", "Arkansas", "California", "Colorado",
+    "Connecticut", "Delaware", "Florida", "Georgia", "Hawaii", "Idaho",
+    "Illinois", "Indiana", "Iowa", "Kansas", "Kentucky", "Louisiana",
+    "Maine", "Maryland", "Massachusetts", "Michigan", "Minnesota",
+    "Mississippi", "Missouri", "Montana", "Nebraska", "Nevada", "Ohio",
+    "Oklahoma", "Oregon", "Pennsylvania", "Tennessee", "Texas", "Utah",
+    "Vermont", "Virginia", "Washington", "Wisconsin", "Wyoming",
+    "New Hampshire", "New Jersey", "New Mexico", "New York",
+    "North Carolina", "North Dakota", "Rhode Island", "South Carolina",
+    "South Dakota", "West Virginia",
+]
+
+# types of streets - extend as desired
+STREET_TYPES = (
+    "Street St ST Boulevard Blvd Lane Ln LN Road Rd RD Avenue Ave AVE "
+    " Circle Cir Cove Cv Drive Dr DR Parkway Pkwy PKWY Court Ct Square Sq "
+    "Loop Lp LP"
+).split()
+
+# The common "123 Main St [Suite 4], City Name, ST 12345" form of an address
+# parses to the same street, city, state and zip the full grammar would
+# produce, without the cost of running it.
+FAST_ADDRESS = re.compile(
+    r"^(?P<street>\d+[A-Za-z]?(?: 1/2)?"
+    r"(?: (?:N|S|E|W|NE|NW|SE|SW|North|South|East|West)\.?)?"
+    r"(?: [A-Za-z]+)+ (?:%(types)s)"
+    r"(?: (?:Suite|Ste|Apt|Apartment|Room|Rm|#)\.? ?[A-Za-z0-9-]+)?)\.?, "
+    r"(?P<city>[A-Za-z]+(?: [A-Za-z]+)*), "
+    r"(?P<state>%(states)s)\.?,? "
+    r"(?P<zip>\d{5})$" % {
+        "types": "|".join(set(t.title() for t in STREET_TYPES)),
+        "states": "|".join(STATES_ABBR),
+    },
+    re.IGNORECASE
+)
+
+ParsedAddress = namedtuple("ParsedAddress", "street city state zip")
+
+# Normalized address -> ParsedAddress, or the exception parsing raised. The
+# same few caseworker addresses show up on thousands of profiles.
+_parsed_addresses = LRUCache(1024)
+
+# The pyparsing grammar, built by _address_grammar on first use
+_us_address = None
+
+
+def _address_grammar():
+    """
+    Build the US address grammar, once.
 
-    log.debug("Address: %s" % addr)
+    pyparsing is only imported here as it is a dependency of the site
+    plugins validating addresses, not of the spider itself.
+    """
+    global _us_address
+    if _us_address is not None:
+        return _us_address
 
     from pyparsing import (
         oneOf, CaselessLiteral, Optional, originalTextFor, Combine, Word, nums,
         alphas, White, FollowedBy, MatchFirst, Keyword, OneOrMore, Regex,
-        alphanums, Suppress
+        alphanums, Suppress, ParserElement
     )
 
+    # The grammar backtracks a lot, memoizing makes up for it
+    ParserElement.enablePackrat()
+
     # define number as a set of words
     units = oneOf(
         "Zero One Two Three Four Five Six Seven Eight Nine Ten "
@@ -115,13 +162,9 @@ def valid_address(addr):
     # just a basic word of alpha characters, Maple, Main, etc.
     name = ~numberSuffix + Word(alphas)
 
-    # types of streets - extend as desired
-    type_ = Combine(MatchFirst(map(
-        Keyword,
-        "Street St ST Boulevard Blvd Lane Ln LN Road Rd RD Avenue Ave AVE "
-        " Circle Cir Cove Cv Drive Dr DR Parkway Pkwy PKWY Court Ct Square Sq "
-        "Loop Lp LP".split()
-    )) + Optional(".").suppress())
+    # types of streets
+    type_ = Combine(MatchFirst(map(Keyword, STREET_TYPES)) +
+                    Optional(".").suppress())
 
     # street name
     nsew = Combine(
@@ -175,35 +218,80 @@ def valid_address(addr):
         OneOrMore(Word(alphas)) + Optional(Suppress(","))
     ).setResultsName("city")
 
-    states_abbr = oneOf(
-        "AL AK AZ AR CA CO CT DE FL GA HI ID IL IN IA KS KY LA ME MD MA MI MN"
-        "MS MO MT NE NV NH NJ NM NY NC ND OH OK OR PA RI SC SD TN TX UT VT VA"
-        "WA WV WI WY",
-        caseless=True
-    )
-    state_names = oneOf(
-        ["Alabama", "Alaska", "Arizona", "Arkansas", "California", "Colorado",
-         "Connecticut", "Delaware", "Florida", "Georgia", "Hawaii", "Idaho",
-         "Illinois", "Indiana", "Iowa", "Kansas", "Kentucky", "Louisiana",
-         "Maine", "Maryland", "Massachusetts", "Michigan", "Minnesota",
-         "Mississippi", "Missouri", "Montana", "Nebraska", "Nevada", "Ohio",
-         "Oklahoma", "Oregon", "Pennsylvania", "Tennessee", "Texas", "Utah",
-         "Vermont", "Virginia", "Washington", "Wisconsin", "Wyoming",
-         "New Hampshire", "New Jersey", "New Mexico", "New York",
-         "North Carolina", "North Dakota", "Rhode Island", "South Carolina",
-         "South Dakota", "West Virginia"],
-        caseless=True
-    )
+    states_abbr = oneOf(STATES_ABBR, caseless=True)
+    state_names = oneOf(STATE_NAMES, caseless=True)
     state = (
         states_abbr.setResultsName("state")
         ^ state_names.setResultsName("state")
     ) + Optional(".") + Optional(",")
     zipCode = Word(nums).setResultsName("zip")
 
-    us_address = (
-        streetAddress + city + state + zipCode
-    ).parseString(addr)
-    log.debug("Parsed address: %s" % us_address)
+    _us_address = streetAddress + city + state + zipCode
+    return _us_address
+
+
+def _joined(tokens):
+    """Flatten parsed tokens into a single space separated string."""
+    if isinstance(tokens, basestring):
+        return tokens
+
+    return " ".join(" ".join(_joined(token) for token in tokens).split())
+
+
+def _parse_address(addr):
+    """Parse a normalized address, with the fast path first."""
+    match = FAST_ADDRESS.match(addr)
+    if match:
+        return ParsedAddress(**match.groupdict())
+
+    parsed = _address_grammar().parseString(addr)
+    return ParsedAddress(
+        _joined(parsed.street),
+        _joined(parsed.city),
+        _joined(parsed.state),
+        _joined(parsed.zip),
+    )
+
+
+def valid_address(addr):
+    """
+    Address validator/parser.
+
+    @rtype: ParsedAddress
+    @return: The street, city, state and zip of the address. Raises if the
+    address can not be parsed.
+    """
+    # Sanitize-ish
+    multispace = re.compile("\s+")
+    addr = multispace.sub(" ", addr)
+
+    addr_split = [
+        x for x in addr.title().split(" ") if x not in ["", '', None]
+    ]
+
+    sane_addr = []
+    for w in addr_split:
+        if len(w) == 2:
+            w = w.upper()
+
+        sane_addr.append(w)
+
+    addr = " ".join(sane_addr)
+
+    log.debug("Address: %s" % addr)
+
+    us_address = _parsed_addresses.get(addr)
+    if us_address is None:
+        try:
+            us_address = _parse_address(addr)
+        except Exception, e:
+            us_address = e
+        _parsed_addresses[addr] = us_address
+
+    if isinstance(us_address, Exception):
+        raise us_address
+
+    log.debug("Parsed address: %s" % (us_address,))
 
     return us_address
 